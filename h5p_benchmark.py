@@ -0,0 +1,453 @@
+import os
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import tracemalloc
+try:
+    import resource
+except ImportError:
+    # Windows, where peak resident memory isn't reported.
+    resource = None
+
+import h5p_generator
+from h5p_generator import BuildCache, ConcatMode, Content, H5P, \
+    H5PMetaData, LibraryResolver, SemanticsValidator, combineVideos, \
+    createQuestionSetsFrom, importVideos, mainLibraryOf
+
+
+# Words synthetic questions and choices are made of.
+_words = ["alpha", "beta", "gamma", "matrix", "vector", "eigenvalue",
+          "rank", "basis", "kernel", "span", "norm", "projection",
+          "singular", "orthogonal", "transpose", "inverse", "determinant"]
+
+
+class SyntheticCourse:
+    """
+    Settings for a generated course.
+
+    multipleChoiceRatio is the fraction of questions with more than one
+    correct choice. Every clip is clipSeconds long.
+    """
+
+    sections: int
+    questionsPerSection: int
+    choicesPerQuestion: int
+    multipleChoiceRatio: float
+    clipSeconds: float
+    clipSize: tuple
+    clipFps: int
+    withAudio: bool
+    seed: int
+
+    def __init__(self, sections: int = 10, questionsPerSection: int = 5,
+                 choicesPerQuestion: int = 4,
+                 multipleChoiceRatio: float = 0.5, clipSeconds: float = 5.0,
+                 clipSize: tuple = (640, 360), clipFps: int = 30,
+                 withAudio: bool = True, seed: int = 0):
+        self.sections = sections
+        self.questionsPerSection = questionsPerSection
+        self.choicesPerQuestion = max(2, choicesPerQuestion)
+        self.multipleChoiceRatio = multipleChoiceRatio
+        self.clipSeconds = clipSeconds
+        self.clipSize = clipSize
+        self.clipFps = clipFps
+        self.withAudio = withAudio
+        self.seed = seed
+
+    def toDict(self):
+        return {
+            "sections": self.sections,
+            "questionsPerSection": self.questionsPerSection,
+            "choicesPerQuestion": self.choicesPerQuestion,
+            "multipleChoiceRatio": self.multipleChoiceRatio,
+            "clipSeconds": self.clipSeconds,
+            "clipSize": list(self.clipSize),
+            "clipFps": self.clipFps,
+            "withAudio": self.withAudio,
+            "seed": self.seed
+        }
+
+
+def _sentence(randomGenerator: random.Random, length: int):
+    return " ".join(randomGenerator.choice(_words) for _ in range(length))
+
+
+def writeSyntheticQuestions(course: SyntheticCourse, questionsFile,
+                            videoFileNames: list):
+    randomGenerator = random.Random(course.seed)
+    for videoFileName in videoFileNames:
+        questionsFile.write("video: {}\n\n".format(videoFileName))
+        for questionNumber in range(1, course.questionsPerSection + 1):
+            questionsFile.write("{}. What is the {}?\n".format(
+                questionNumber, _sentence(randomGenerator, 4)))
+            choiceIndexes = list(range(course.choicesPerQuestion))
+            if randomGenerator.random() < course.multipleChoiceRatio:
+                correctChoices = set(randomGenerator.sample(choiceIndexes, 2))
+            else:
+                correctChoices = {randomGenerator.choice(choiceIndexes)}
+            for choiceIndex in choiceIndexes:
+                questionsFile.write("[{}] {}\n".format(
+                    "*" if choiceIndex in correctChoices else " ",
+                    _sentence(randomGenerator, 3)))
+            questionsFile.write("\n")
+        questionsFile.write("\n")
+
+
+def writeSyntheticClip(course: SyntheticCourse, clipFilePath: str,
+                       index: int):
+    # Generated by ffmpeg's test sources, so nothing is downloaded.
+    arguments = [
+        "-f", "lavfi", "-i",
+        "testsrc2=size={}x{}:rate={}:duration={}".format(
+            course.clipSize[0], course.clipSize[1], course.clipFps,
+            course.clipSeconds)
+    ]
+    if course.withAudio:
+        arguments += [
+            "-f", "lavfi", "-i",
+            "sine=frequency={}:sample_rate=44100:duration={}".format(
+                220 + 20 * index, course.clipSeconds),
+            "-c:a", "aac", "-ac", "2"
+        ]
+    arguments += ["-c:v", "libx264", "-preset", "veryfast",
+                  "-pix_fmt", "yuv420p", clipFilePath]
+    h5p_generator._runFFmpeg(arguments)
+
+
+def generateSyntheticCourse(course: SyntheticCourse,
+                            inputsDirectoryPath: str):
+    """
+    Writes videos/ and questions/questions.txt for a synthetic course into
+    inputsDirectoryPath, laid out like the real inputs directory.
+    """
+    videosDirectoryPath = os.path.join(inputsDirectoryPath, "videos")
+    questionsDirectoryPath = os.path.join(inputsDirectoryPath, "questions")
+    os.makedirs(videosDirectoryPath, exist_ok=True)
+    os.makedirs(questionsDirectoryPath, exist_ok=True)
+
+    videoFileNames = []
+    for index in range(course.sections):
+        videoFileName = "{:05d}.mov".format(index)
+        writeSyntheticClip(course,
+                           os.path.join(videosDirectoryPath, videoFileName),
+                           index)
+        videoFileNames.append(videoFileName)
+    with open(os.path.join(questionsDirectoryPath, "questions.txt"),
+              "w") as questionsFile:
+        writeSyntheticQuestions(course, questionsFile, videoFileNames)
+
+
+class StageTimer:
+    """
+    Times benchmark stages. With traceMemory, every stage is run a second
+    time with tracemalloc on, to record how much Python memory it peaked at
+    and how much of it was still in use, e.g. by what the stage returned,
+    when it finished. Tracing slows Python down a lot, so the timings
+    always come from the untraced run.
+    """
+
+    stages: dict
+    traceMemory: bool
+
+    def __init__(self, traceMemory: bool = False):
+        self.stages = {}
+        self.traceMemory = traceMemory
+
+    def run(self, stageName: str, function, *arguments, **keywordArguments):
+        startTime = time.perf_counter()
+        startCpuTime = time.process_time()
+        result = function(*arguments, **keywordArguments)
+        self.stages[stageName] = {
+            "seconds": time.perf_counter() - startTime,
+            "cpuSeconds": time.process_time() - startCpuTime
+        }
+        if self.traceMemory:
+            tracemalloc.start()
+            try:
+                # Held on to so what it retains is counted.
+                tracedResult = function(*arguments, **keywordArguments)
+                retainedBytes, peakBytes = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            self.stages[stageName].update(peakPythonBytes=peakBytes,
+                                          retainedPythonBytes=retainedBytes)
+        return result
+
+
+def _peakResidentBytes(children: bool = False):
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children
+                              else resource.RUSAGE_SELF).ru_maxrss
+    return peak if platform.system() == "Darwin" else peak * 1024
+
+
+def _perSecond(amount: float, seconds: float):
+    return amount / seconds if seconds else None
+
+
+def validateContentFile(validator: SemanticsValidator,
+                        contentFilePath: str):
+    # Checks a written content.json one interaction at a time, like a
+    # validating build does, and returns the number of problems found.
+    with open(contentFilePath, "r") as contentFile:
+        content = json.loads(contentFile.read())
+    interactions = content["interactiveVideo"]["assets"]["interactions"]
+    content["interactiveVideo"]["assets"]["interactions"] = []
+    problems = validator.checker()(content) or []
+    checkInteraction = validator.checker(
+        "interactiveVideo.assets.interactions.interaction")
+    for interaction in interactions:
+        problems += checkInteraction(interaction) or []
+    return len(problems)
+
+
+def runBenchmark(course: SyntheticCourse, workingDirectoryPath: str,
+                 templatesDirectoryPath: str,
+                 concatMode: ConcatMode = ConcatMode.STREAM_COPY,
+                 encodeWorkers: int = None, skipVideo: bool = False,
+                 traceMemory: bool = False):
+    """
+    Generates a synthetic course, runs every pipeline stage on it and
+    returns the results as a JSON serializable dictionary. traceMemory
+    also measures each stage's Python memory in a second run.
+    """
+    inputsDirectoryPath = os.path.join(workingDirectoryPath, "inputs")
+    outputsDirectoryPath = os.path.join(workingDirectoryPath, "outputs")
+    os.makedirs(outputsDirectoryPath, exist_ok=True)
+    packageTemplateDirectoryPath = os.path.join(
+        templatesDirectoryPath, "template_h5p_package_multiple_choice")
+    contentTemplateFilePath = os.path.join(templatesDirectoryPath,
+                                           "template_content.json")
+    interactionTemplateFilePath = os.path.join(templatesDirectoryPath,
+                                               "template_interaction.json")
+    h5pMetaDataTemplateFilePath = os.path.join(templatesDirectoryPath,
+                                               "template_h5p.json")
+    timer = StageTimer(traceMemory)
+
+    generationStartTime = time.perf_counter()
+    generateSyntheticCourse(course, inputsDirectoryPath)
+    generationSeconds = time.perf_counter() - generationStartTime
+
+    # Starting cold, like a fresh build process would.
+    h5p_generator.templateRegistry.invalidate()
+
+    videos = timer.run(
+        "importVideos", importVideos,
+        inputVideoType="mov",
+        videosDirectoryPath=os.path.join(inputsDirectoryPath, "videos")
+    )
+    questionSets = timer.run(
+        "createQuestionSetsFrom", createQuestionSetsFrom,
+        videos=videos,
+        outputVideoFilePath=None,
+        templatesDirectoryPath=templatesDirectoryPath,
+        questionsDirectoryPath=os.path.join(inputsDirectoryPath, "questions"),
+        outputsDirectoryPath=outputsDirectoryPath
+    )
+    content = Content(questionSets=questionSets)
+    timer.run(
+        "Content.export", content.export,
+        outputFileName="content.json",
+        contentTemplatePath=contentTemplateFilePath,
+        interactionTemplatePath=interactionTemplateFilePath,
+        outputsDirectoryPath=outputsDirectoryPath,
+        videoSource="videos/final_h5p_video.mp4"
+    )
+    # Compiling the semantics is part of the cost.
+    SemanticsValidator._compiled.clear()
+    contentProblems = timer.run(
+        "validateContent", validateContentFile,
+        validator=SemanticsValidator(
+            packageTemplateDirectoryPath,
+            mainLibraryOf(h5p_generator.templateRegistry.load(
+                h5pMetaDataTemplateFilePath))
+        ),
+        contentFilePath=os.path.join(outputsDirectoryPath, "content.json")
+    )
+
+    outputVideoFilePath = None
+    if not skipVideo:
+        outputVideoFilePath = timer.run(
+            "combineVideos", combineVideos,
+            videos=videos,
+            outputVideoFileName="final_h5p_video.mp4",
+            outputsDirectoryPath=outputsDirectoryPath,
+            concatMode=concatMode,
+            encodeWorkers=encodeWorkers
+        )
+
+    packageFilePath = os.path.join(outputsDirectoryPath, "benchmark.h5p")
+    h5p = H5P(contentTemplatePath=contentTemplateFilePath,
+              interactionTemplatePath=interactionTemplateFilePath,
+              h5pMetaDataTemplatePath=h5pMetaDataTemplateFilePath,
+              outputsDirectoryPath=outputsDirectoryPath,
+              videoSource=outputVideoFilePath if outputVideoFilePath
+              else "https://www.youtube.com/watch?v=dk4HSk5wIGg",
+              packageTemplateDirectoryPath=packageTemplateDirectoryPath,
+              libraryResolver=LibraryResolver(packageTemplateDirectoryPath))
+    timer.run("package", h5p.export,
+              content=content,
+              h5pMetaData=H5PMetaData(title="Benchmark"),
+              packageOutput=packageFilePath)
+
+    # The same package again with the libraries spliced in already
+    # compressed from a warm build cache instead of deflated.
+    buildCache = BuildCache(os.path.join(workingDirectoryPath, "cache"))
+    try:
+        h5p.buildCache = buildCache
+        h5p.export(content=content,
+                   h5pMetaData=H5PMetaData(title="Benchmark"),
+                   packageOutput=packageFilePath)
+        timer.run("packageCachedEntries", h5p.export,
+                  content=content,
+                  h5pMetaData=H5PMetaData(title="Benchmark"),
+                  packageOutput=packageFilePath)
+    finally:
+        buildCache.close()
+
+    questions = course.sections * course.questionsPerSection
+    stages = timer.stages
+    stages["importVideos"]["clipsPerSecond"] = _perSecond(
+        course.sections, stages["importVideos"]["seconds"])
+    stages["createQuestionSetsFrom"]["questionsPerSecond"] = _perSecond(
+        questions, stages["createQuestionSetsFrom"]["seconds"])
+    # What the parsed question bank costs to keep in memory.
+    if traceMemory:
+        stages["createQuestionSetsFrom"]["bytesPerQuestion"] = \
+            stages["createQuestionSetsFrom"]["retainedPythonBytes"] \
+            / questions if questions else None
+    contentBytes = os.path.getsize(os.path.join(outputsDirectoryPath,
+                                                "content.json"))
+    stages["Content.export"]["questionsPerSecond"] = _perSecond(
+        questions, stages["Content.export"]["seconds"])
+    stages["Content.export"]["bytes"] = contentBytes
+    stages["validateContent"]["questionsPerSecond"] = _perSecond(
+        questions, stages["validateContent"]["seconds"])
+    stages["validateContent"]["problems"] = contentProblems
+    if outputVideoFilePath:
+        stages["combineVideos"]["videoSecondsPerSecond"] = _perSecond(
+            course.sections * course.clipSeconds,
+            stages["combineVideos"]["seconds"])
+        stages["combineVideos"]["bytes"] = os.path.getsize(
+            outputVideoFilePath)
+    packageBytes = os.path.getsize(packageFilePath)
+    stages["package"]["bytes"] = packageBytes
+    stages["package"]["megabytesPerSecond"] = _perSecond(
+        packageBytes / 1024 ** 2, stages["package"]["seconds"])
+    stages["packageCachedEntries"]["megabytesPerSecond"] = _perSecond(
+        packageBytes / 1024 ** 2, stages["packageCachedEntries"]["seconds"])
+    stages["packageCachedEntries"]["speedup"] = _perSecond(
+        stages["package"]["seconds"],
+        stages["packageCachedEntries"]["seconds"])
+
+    results = {
+        "course": course.toDict(),
+        "questions": questions,
+        "generationSeconds": generationSeconds,
+        "stages": stages,
+        "totalSeconds": sum(stage["seconds"] for stage in stages.values()),
+        "python": platform.python_version(),
+        "platform": platform.platform()
+    }
+    if resource is not None:
+        results["peakResidentBytes"] = _peakResidentBytes()
+        results["peakChildResidentBytes"] = _peakResidentBytes(children=True)
+    return results
+
+
+def printSummary(results: dict):
+    print("{:<24}{:>10}{:>10}{:>14}".format("stage", "seconds", "cpu",
+                                            "peak python"))
+    for stageName, stage in results["stages"].items():
+        peakPython = "{:.1f}MB".format(stage["peakPythonBytes"] / 1024 ** 2) \
+            if "peakPythonBytes" in stage else "-"
+        print("{:<24}{:>10.3f}{:>10.3f}{:>14}".format(
+            stageName, stage["seconds"], stage["cpuSeconds"], peakPython))
+    if "peakResidentBytes" in results:
+        print("Peak RSS {:.1f}MB, ffmpeg children {:.1f}MB".format(
+            results["peakResidentBytes"] / 1024 ** 2,
+            results["peakChildResidentBytes"] / 1024 ** 2))
+    bytesPerQuestion = \
+        results["stages"]["createQuestionSetsFrom"].get("bytesPerQuestion")
+    if bytesPerQuestion:
+        print("{:.0f} bytes per parsed question".format(bytesPerQuestion))
+
+
+def parseArguments(arguments: list = None):
+    parser = argparse.ArgumentParser(
+        description="Benchmarks every stage of the H5P build on a generated "
+                    "course."
+    )
+    parser.add_argument("--sections", type=int, default=10,
+                        help="Number of video: sections, one clip each.")
+    parser.add_argument("--questions-per-section", type=int, default=5)
+    parser.add_argument("--choices", type=int, default=4,
+                        help="Choices per question.")
+    parser.add_argument("--multiple-choice-ratio", type=float, default=0.5,
+                        help="Fraction of questions with several correct "
+                             "choices.")
+    parser.add_argument("--clip-seconds", type=float, default=5.0)
+    parser.add_argument("--clip-size", default="640x360",
+                        help="Clip dimensions as WIDTHxHEIGHT.")
+    parser.add_argument("--no-audio", action="store_true",
+                        help="Generate clips without an audio track.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--concat-mode", choices=["copy", "reencode"],
+                        default="copy")
+    parser.add_argument("--encode-workers", type=int)
+    parser.add_argument("--skip-video", action="store_true",
+                        help="Don't run combineVideos.")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Also measure each stage's peak Python memory "
+                             "with tracemalloc, in a second run of it so "
+                             "the timings aren't slowed down.")
+    parser.add_argument("--templates", default="templates")
+    parser.add_argument("--workdir",
+                        help="Directory for the generated course and "
+                             "outputs. A temporary one is used by default.")
+    parser.add_argument("--output", default="bench_output.json",
+                        help="Where the JSON results are written.")
+    return parser.parse_args(arguments)
+
+
+def main(arguments: list = None):
+    options = parseArguments(arguments)
+    width, height = (int(size) for size in options.clip_size.split("x"))
+    course = SyntheticCourse(
+        sections=options.sections,
+        questionsPerSection=options.questions_per_section,
+        choicesPerQuestion=options.choices,
+        multipleChoiceRatio=options.multiple_choice_ratio,
+        clipSeconds=options.clip_seconds,
+        clipSize=(width, height),
+        withAudio=not options.no_audio,
+        seed=options.seed
+    )
+    concatMode = ConcatMode.STREAM_COPY if options.concat_mode == "copy" \
+        else ConcatMode.REENCODE
+    templatesDirectoryPath = os.path.abspath(options.templates)
+
+    if options.workdir:
+        os.makedirs(options.workdir, exist_ok=True)
+        results = runBenchmark(course, options.workdir,
+                               templatesDirectoryPath, concatMode,
+                               options.encode_workers, options.skip_video,
+                               options.trace_memory)
+    else:
+        with tempfile.TemporaryDirectory() as workingDirectoryPath:
+            results = runBenchmark(course, workingDirectoryPath,
+                                   templatesDirectoryPath, concatMode,
+                                   options.encode_workers,
+                                   options.skip_video, options.trace_memory)
+
+    with open(options.output, "w") as outputFile:
+        outputFile.write(json.dumps(results, indent=2))
+    printSummary(results)
+    print("Wrote {}".format(options.output))
+
+
+if __name__ == "__main__":
+    main()
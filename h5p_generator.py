@@ -1,11 +1,320 @@
 import os
+import io
+import csv
 import json
 import copy
 import re
 import glob
+import argparse
+import subprocess
+import tempfile
+import zipfile
+import zlib
+import time
+import hashlib
+import html
+import posixpath
 import shutil
+import sqlite3
+import concurrent.futures
+import urllib.parse
+import itertools
+import bisect
+import abc
+import filecmp
+import sys
+import threading
+import tracemalloc
+from collections import OrderedDict
+from xml.etree import ElementTree
 from enum import Enum
-from moviepy.editor import VideoFileClip, concatenate_videoclips
+try:
+    import fcntl
+    import resource
+except ImportError:
+    # Windows.
+    fcntl = None
+    resource = None
+try:
+    import latex2mathml
+    import latex2mathml.converter
+except ImportError:
+    # Only needed to pre-render math.
+    latex2mathml = None
+try:
+    import rjsmin
+    import rcssmin
+except ImportError:
+    # Library bundles are only concatenated without them.
+    rjsmin = None
+    rcssmin = None
+from moviepy.editor import VideoFileClip, VideoClip, AudioClip, \
+    concatenate_videoclips
+
+
+class _NoSpan:
+    # What Tracer.span returns while tracing is off, so instrumented code
+    # costs one attribute lookup and a call.
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exceptionType, exception, traceback):
+        return False
+
+    def set(self, **arguments):
+        pass
+
+
+_noSpan = _NoSpan()
+
+
+def _readIOCounters():
+    # Bytes this process read and wrote through system calls, cached or
+    # not. Only Linux has them.
+    try:
+        with open("/proc/self/io", "rb") as ioFile:
+            counters = dict(line.split(b": ") for line in ioFile)
+        return int(counters[b"rchar"]), int(counters[b"wchar"])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+
+def _peakResidentBytes():
+    if resource is None:
+        return 0
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Span:
+    """
+    One timed section of a build, possibly nested in another one.
+    """
+
+    tracer: "Tracer"
+    name: str
+    arguments: dict
+    parent: "Span"
+    path: str
+    peakPythonBytes: int
+
+    def __init__(self, tracer: "Tracer", name: str, arguments: dict,
+                 parent: "Span"):
+        self.tracer = tracer
+        self.name = name
+        self.arguments = arguments
+        self.parent = parent
+        self.path = parent.path + "/" + name if parent else name
+        self.peakPythonBytes = 0
+
+    def set(self, **arguments):
+        """
+        Attaches more arguments, like the number of bytes produced, to the
+        span.
+        """
+        self.arguments.update(arguments)
+
+    def _notePeak(self):
+        # tracemalloc has a single peak, so it's reset whenever a span
+        # starts or ends and every span still open takes the peak so far.
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        span = self
+        while span:
+            span.peakPythonBytes = max(span.peakPythonBytes, peak)
+            span = span.parent
+
+    def __enter__(self):
+        if self.tracer.traceMemory:
+            if self.parent:
+                self.parent._notePeak()
+            else:
+                tracemalloc.reset_peak()
+        self.tracer._stack().append(self)
+        self._startIO = _readIOCounters()
+        self._startCpuTime = time.thread_time()
+        self._startTime = time.perf_counter()
+        return self
+
+    def __exit__(self, exceptionType, exception, traceback):
+        endTime = time.perf_counter()
+        cpuSeconds = time.thread_time() - self._startCpuTime
+        readBytes, writtenBytes = _readIOCounters()
+        if self.tracer.traceMemory:
+            self._notePeak()
+        self.tracer._stack().pop()
+        event = {
+            "name": self.name,
+            "path": self.path,
+            "start": self._startTime - self.tracer.originTime,
+            "seconds": endTime - self._startTime,
+            "cpuSeconds": cpuSeconds,
+            "readBytes": readBytes - self._startIO[0],
+            "writtenBytes": writtenBytes - self._startIO[1],
+            "peakResidentBytes": _peakResidentBytes(),
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "arguments": self.arguments
+        }
+        if self.tracer.traceMemory:
+            event["peakPythonBytes"] = self.peakPythonBytes
+        if exceptionType:
+            event["arguments"]["error"] = exceptionType.__name__
+        self.tracer._record(event)
+        return False
+
+
+class Tracer:
+    """
+    Records nested, timed spans around the stages of a build.
+
+    Tracing is off until enable is called and, while it's off, span hands
+    back a shared do-nothing context manager. Every span records its wall
+    and CPU time, the bytes the process read and wrote while it was open
+    and the process's peak resident memory. With traceMemory, the peak of
+    Python allocations inside each span is traced as well, at a noticeable
+    cost in speed.
+
+    The finished spans can be written as a Chrome trace, for chrome://tracing
+    or Perfetto, or summed up in a table.
+    """
+
+    enabled: bool
+    traceMemory: bool
+    events: list
+    originTime: float
+
+    def __init__(self):
+        self.enabled = False
+        self.traceMemory = False
+        self.events = []
+        self.originTime = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def enable(self, traceMemory: bool = False):
+        self.enabled = True
+        self.traceMemory = traceMemory
+        if traceMemory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def disable(self):
+        self.enabled = False
+        if self.traceMemory:
+            tracemalloc.stop()
+            self.traceMemory = False
+
+    def reset(self):
+        with self._lock:
+            self.events = []
+        self.originTime = time.perf_counter()
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _record(self, event: dict):
+        with self._lock:
+            self.events.append(event)
+
+    def span(self, name: str, **arguments):
+        """
+        Returns a context manager timing the code inside it as a span called
+        name, nested in whichever span this thread is already in. Spans
+        started on other threads aren't nested in anything.
+        """
+        if not self.enabled:
+            return _noSpan
+        stack = self._stack()
+        return Span(self, name, arguments, stack[-1] if stack else None)
+
+    def merge(self, events: list):
+        # Adds spans recorded by another process, e.g. a batch worker.
+        with self._lock:
+            self.events.extend(events)
+
+    def chromeTrace(self):
+        """
+        Returns the spans in the Chrome trace event format.
+        """
+        traceEvents = []
+        for event in self.events:
+            arguments = {key: event[key] for key in
+                         ("cpuSeconds", "readBytes", "writtenBytes",
+                          "peakResidentBytes", "peakPythonBytes")
+                         if key in event}
+            arguments.update(event["arguments"])
+            traceEvents.append({
+                "name": event["name"],
+                "cat": event["path"].partition("/")[0],
+                "ph": "X",
+                "ts": event["start"] * 1e6,
+                "dur": event["seconds"] * 1e6,
+                "pid": event["pid"],
+                "tid": event["tid"],
+                "args": arguments
+            })
+        return {"traceEvents": traceEvents, "displayTimeUnit": "ms"}
+
+    def writeChromeTrace(self, traceFilePath: str):
+        with open(traceFilePath, "w") as traceFile:
+            traceFile.write(json.dumps(self.chromeTrace()))
+
+    def summary(self):
+        """
+        Returns a table of the spans added up by their place in the span
+        tree.
+        """
+        # Children are listed under their parents, in the order they first
+        # started.
+        firstStartTimes = {}
+        for event in self.events:
+            firstStartTimes[event["path"]] = min(
+                event["start"], firstStartTimes.get(event["path"],
+                                                    event["start"]))
+
+        def treeOrder(event: dict):
+            names = event["path"].split("/")
+            return [firstStartTimes.get("/".join(names[:depth + 1]), 0.0)
+                    for depth in range(len(names))]
+
+        totals = OrderedDict()
+        for event in sorted(self.events, key=treeOrder):
+            total = totals.setdefault(event["path"], {
+                "count": 0, "seconds": 0.0, "cpuSeconds": 0.0,
+                "readBytes": 0, "writtenBytes": 0, "peakBytes": 0
+            })
+            total["count"] += 1
+            total["seconds"] += event["seconds"]
+            total["cpuSeconds"] += event["cpuSeconds"]
+            total["readBytes"] += event["readBytes"]
+            total["writtenBytes"] += event["writtenBytes"]
+            total["peakBytes"] = max(total["peakBytes"],
+                                     event.get("peakPythonBytes",
+                                               event["peakResidentBytes"]))
+        peakName = "peak python" if self.traceMemory else "peak rss"
+        lines = ["{:<48}{:>7}{:>10}{:>10}{:>10}{:>10}{:>12}".format(
+            "span", "count", "wall s", "cpu s", "read MB", "write MB",
+            peakName)]
+        for path, total in totals.items():
+            depth = path.count("/")
+            name = "  " * depth + path.rpartition("/")[2]
+            lines.append(
+                "{:<48}{:>7}{:>10.3f}{:>10.3f}{:>10.1f}{:>10.1f}{:>10.1f}MB"
+                .format(name[:47], total["count"], total["seconds"],
+                        total["cpuSeconds"], total["readBytes"] / 1024 ** 2,
+                        total["writtenBytes"] / 1024 ** 2,
+                        total["peakBytes"] / 1024 ** 2))
+        return "\n".join(lines)
+
+
+# Shared by everything in this module. Library callers turn it on with
+# tracer.enable() and read the spans back afterwards.
+tracer = Tracer()
 
 
 class QuestionType(Enum):
@@ -13,39 +322,221 @@ class QuestionType(Enum):
     MULTIPLE_CHOICES = 2
 
 
+class TemplateError(ValueError):
+    """
+    Raised when a template file can't be used as a template.
+    """
+
+
+class TemplateRegistry:
+    """
+    Parse-once store for the JSON templates.
+
+    Each template file is read, parsed and validated the first time it's
+    asked for and then compiled into a builder function made of literal
+    expressions. Calling the builder produces a brand new, independent copy
+    of the template without touching the disk or the JSON parser again, so
+    callers are free to mutate whatever they get back.
+
+    Templates stay cached for the lifetime of the process. Call
+    ``invalidate`` after editing template files on disk.
+    """
+
+    _builders: dict
+    _templates: dict
+    _validatedKeys: dict
+    _digests: dict
+
+    def __init__(self):
+        self._builders = {}
+        self._templates = {}
+        self._validatedKeys = {}
+        self._digests = {}
+        # Templates are loaded on worker threads while the build service
+        # invalidates them, so the caches only change under this lock.
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _rejectConstant(constant: str):
+        # NaN and Infinity aren't valid JSON and can't be compiled back into
+        # literals either.
+        raise ValueError("Unsupported JSON constant {}.".format(constant))
+
+    def _compile(self, templatePath: str):
+        try:
+            with open(templatePath, "r") as templateFile:
+                templateText = templateFile.read()
+            template = json.loads(templateText,
+                                  parse_constant=self._rejectConstant)
+        except (OSError, ValueError) as error:
+            raise TemplateError(
+                "Couldn't load template {}: {}".format(templatePath, error)
+            ) from error
+        if not isinstance(template, dict):
+            raise TemplateError(
+                "Template {} must be a JSON object.".format(templatePath)
+            )
+        # The repr of parsed JSON only contains dict, list, str, int, float,
+        # bool and None literals, so it can be compiled back into an
+        # expression that rebuilds the template from scratch on every call.
+        builderCode = compile("lambda: " + repr(template), templatePath,
+                              "eval")
+        builder = eval(builderCode, {"__builtins__": {}})
+        self._builders[templatePath] = builder
+        self._templates[templatePath] = template
+        self._validatedKeys[templatePath] = set()
+        self._digests[templatePath] = hashlib.sha256(
+            templateText.encode()).hexdigest()
+        return builder
+
+    def _validate(self, templatePath: str, requiredKeys: tuple):
+        validatedKeys = self._validatedKeys[templatePath]
+        for keyPath in requiredKeys:
+            if keyPath in validatedKeys:
+                continue
+            node = self._templates[templatePath]
+            for key in keyPath.split("."):
+                if not isinstance(node, dict) or key not in node:
+                    raise TemplateError(
+                        "Template {} is missing \"{}\".".format(templatePath,
+                                                               keyPath)
+                    )
+                node = node[key]
+            validatedKeys.add(keyPath)
+
+    def load(self, templatePath: str, requiredKeys: tuple = ()):
+        """
+        Returns a fresh copy of the template at templatePath.
+
+        requiredKeys is a list of dotted key paths, like "params.questions",
+        that must exist in the template. They're only checked the first time
+        they're asked for.
+        """
+        with self._lock:
+            builder = self._builders.get(templatePath)
+            if builder is None:
+                with tracer.span("compileTemplate",
+                                 template=os.path.basename(templatePath)):
+                    builder = self._compile(templatePath)
+            if requiredKeys:
+                self._validate(templatePath, requiredKeys)
+        return builder()
+
+    def digest(self, templatePath: str):
+        """
+        Returns a hash of the template file's contents as it was loaded.
+        """
+        with self._lock:
+            if templatePath not in self._digests:
+                self._compile(templatePath)
+            return self._digests[templatePath]
+
+    def invalidate(self, templatePath: str = None):
+        """
+        Drops the cached template at templatePath, or every cached template
+        when no path is given, so it's read from disk again on next load.
+        """
+        with self._lock:
+            if templatePath is None:
+                self._builders.clear()
+                self._templates.clear()
+                self._validatedKeys.clear()
+                self._digests.clear()
+            else:
+                self._builders.pop(templatePath, None)
+                self._templates.pop(templatePath, None)
+                self._validatedKeys.pop(templatePath, None)
+                self._digests.pop(templatePath, None)
+
+
+# Shared by everything in this module so each template is parsed once per
+# process.
+templateRegistry = TemplateRegistry()
+
+
 class Choice:
+    # Slots keep large question banks small, and interning makes every
+    # repeated text, like "True" or "None of the above", one shared string.
+    __slots__ = ("text", "type")
+
     text: str
     type: bool
 
     def __init__(self, choice: str, isCorrect: bool):
-        self.text = choice
+        self.text = sys.intern(choice)
         self.type = isCorrect
 
     def isCorrect(self):
         return True if self.type else False
 
 
+class QuestionKind:
+    """
+    A question type together with the template its questions are built
+    from. There's one shared instance per combination, so questions hold a
+    reference to it instead of their own copy of the template path.
+    """
+
+    __slots__ = ("questionType", "templatePath")
+
+    questionType: QuestionType
+    templatePath: str
+
+    # (question type, template path) -> QuestionKind.
+    _kinds = {}
+
+    def __init__(self, questionType: QuestionType, templatePath: str):
+        self.questionType = questionType
+        self.templatePath = templatePath
+
+    @staticmethod
+    def of(questionType: QuestionType, templatePath: str):
+        kind = QuestionKind._kinds.get((questionType, templatePath))
+        if kind is None:
+            kind = QuestionKind(questionType, sys.intern(templatePath))
+            QuestionKind._kinds[(questionType, templatePath)] = kind
+        return kind
+
+
 class Question:
+    __slots__ = ("question", "choices")
+
     question: str
-    choices: list
+    # Tuple of Choices.
+    choices: tuple
 
     def __init__(self, question: str, choices: list):
         self.question = question
-        self.choices = choices
+        self.choices = tuple(choices)
+
+    def fingerprintData(self):
+        # Everything convertToDict depends on, used to key the build cache.
+        return [self.question, [[choice.text, choice.isCorrect()]
+                                for choice in self.choices]]
 
 
 class SingleChoiceQuestion(Question):
-    questionType: QuestionType
-    _templatePath: str
+    __slots__ = ("kind",)
+
+    kind: QuestionKind
 
     def __init__(self, question: str, choices: list, templatePath: str):
         self.question = question
-        self.choices = choices
-        self.questionType = QuestionType.SINGLE_CHOICE
-        self._templatePath = templatePath
+        self.choices = tuple(choices)
+        self.kind = QuestionKind.of(QuestionType.SINGLE_CHOICE, templatePath)
+
+    @property
+    def questionType(self):
+        return self.kind.questionType
+
+    def fingerprintData(self):
+        return [self.questionType.value,
+                templateRegistry.digest(self.kind.templatePath)] \
+            + Question.fingerprintData(self)
 
     @staticmethod
-    def _convertChoicesToList(question: str, choices: list):
+    def _convertChoicesToList(question: str, choices: tuple,
+                              renderText=None):
         formattedChoicesList = []
         mainTemplate = {
             "subContentId": "",
@@ -56,60 +547,66 @@ class SingleChoiceQuestion(Question):
                 "<p><another-choice></p>\n"
             ]
         }
-        metaData = {
-            "subContentId": ""
-        }
-
         mainTemplate["question"] = question
 
-        # Rearranging choices so the answer choice is the first element.
-        for choice in choices:
+        # Putting the answer choice first, in a new sequence so the
+        # question's own choices are left alone.
+        for index, choice in enumerate(choices):
             if choice.isCorrect():
-                # Taking the correction choice and moving it to the index 0
-                # of the choices list.
-                choices.insert(0, choices.pop(choices.index(choice)))
+                choices = (choice,) + tuple(choices[:index]) \
+                    + tuple(choices[index + 1:])
                 break
 
         # Creating a list of choices in template format.
         formattedChoices = []
         for choice in choices:
             choiceTemplate = "<p>{}</p>\n"
-            formattedChoices.append(choiceTemplate.format(choice.text))
+            formattedChoices.append(choiceTemplate.format(
+                renderText(choice.text) if renderText else choice.text))
 
         mainTemplate["answers"] = formattedChoices
 
         formattedChoicesList.append(mainTemplate)
-        formattedChoicesList.append(metaData)
 
         return formattedChoicesList
 
-    def convertToDict(self):
-        with open(self._templatePath, "r") as templateFile:
-            template = json.loads(templateFile.read())
-            template["params"]["question"] = "<p>{}</p>\n".format(
-                self.question)
-            # Getting rid of default contents by replacing the whole thing.
-            # Also need to pass in the "question" because of the formatting
-            # of the template.
-            template["params"]["choices"] = self._convertChoicesToList(
-                self.question,
-                self.choices
-            )
-            return template
+    def convertToDict(self, renderText=None):
+        # renderText, when given, rewrites question and choice text, like
+        # MathRenderer.renderText.
+        question = renderText(self.question) if renderText \
+            else self.question
+        template = templateRegistry.load(self.kind.templatePath, ("params",))
+        # Getting rid of default contents by replacing the whole thing.
+        template["params"]["choices"] = self._convertChoicesToList(
+            question,
+            self.choices,
+            renderText
+        )
+        return template
 
 
 class MultipleChoicesQuestion(Question):
-    questionType: QuestionType
-    _templatePath: str
+    __slots__ = ("kind",)
+
+    kind: QuestionKind
 
     def __init__(self, question: str, choices: list, templatePath: str):
         self.question = question
-        self.choices = choices
-        self.questionType = QuestionType.MULTIPLE_CHOICES
-        self._templatePath = templatePath
+        self.choices = tuple(choices)
+        self.kind = QuestionKind.of(QuestionType.MULTIPLE_CHOICES,
+                                    templatePath)
+
+    @property
+    def questionType(self):
+        return self.kind.questionType
+
+    def fingerprintData(self):
+        return [self.questionType.value,
+                templateRegistry.digest(self.kind.templatePath)] \
+            + Question.fingerprintData(self)
 
     @staticmethod
-    def _convertChoiceToDict(choice: Choice):
+    def _convertChoiceToDict(choice: Choice, renderText=None):
         template = {
             "text": "<div><correct-answer-choice></div>\n",
             "correct": False,
@@ -119,83 +616,501 @@ class MultipleChoicesQuestion(Question):
                 "notChosenFeedback": ""
             }
         }
-        template["text"] = choice.text
+        template["text"] = renderText(choice.text) if renderText \
+            else choice.text
         template["correct"] = choice.type
         return template
 
-    def convertToDict(self):
-        with open(self._templatePath, "r") as templateFile:
-            template = json.loads(templateFile.read())
-            for choice in self.choices:
-                template["params"]["answers"].append(
-                    self._convertChoiceToDict(choice)
-                )
-            return template
+    def convertToDict(self, renderText=None):
+        template = templateRegistry.load(self.kind.templatePath,
+                                         ("params.answers",))
+        template["params"]["question"] = "<p>{}</p>\n".format(
+            renderText(self.question) if renderText else self.question)
+        # Replacing the template's own sample answers.
+        template["params"]["answers"] = [
+            self._convertChoiceToDict(choice, renderText)
+            for choice in self.choices
+        ]
+        return template
 
 
 class QuestionSet:
     """
     Question set per video.
+
+    Interactive Video doesn't allow H5P.QuestionSet as an interaction, so a
+    question set becomes one interaction per action: each run of single
+    choice questions shares an H5P.SingleChoiceSet, and each multiple
+    choices question is an H5P.MultiChoice of its own.
     """
 
+    __slots__ = ("questions", "startTime", "endTime")
+
     questions: list
     startTime: float
     endTime: float
-    templatePath: str
 
-    def __init__(self, templatePath: str, questions: list = None,
-                 startTime: float = 0.0, endTime: float = 0.0):
+    def __init__(self, questions: list = None, startTime: float = 0.0,
+                 endTime: float = 0.0):
         self.questions = questions if questions else []
         self.startTime = startTime
         self.endTime = endTime
-        self.templatePath = templatePath
 
-    def convertToDict(self):
-        with open(self.templatePath, "r") as templateFile:
-            template = json.loads(templateFile.read())
-            for question in self.questions:
-                template["params"]["questions"].append(
-                    question.convertToDict())
-            return template
+    def fingerprint(self, *extraData):
+        """
+        Returns a hash of everything that goes into this question set's
+        interactions, plus extraData.
+        """
+        fingerprintData = [
+            self.startTime,
+            self.endTime,
+            [question.fingerprintData() for question in self.questions],
+            list(extraData)
+        ]
+        return hashlib.sha256(
+            json.dumps(fingerprintData).encode()).hexdigest()
+
+    def actionQuestions(self):
+        """
+        Returns a list with the questions of each action, in order.
+        """
+        groups = []
+        for question in self.questions:
+            if groups and isinstance(question, SingleChoiceQuestion) \
+                    and isinstance(groups[-1][-1], SingleChoiceQuestion) \
+                    and question.kind is groups[-1][-1].kind:
+                groups[-1].append(question)
+            else:
+                groups.append([question])
+        return groups
+
+    def convertToActions(self, renderText=None):
+        actions = []
+        for questions in self.actionQuestions():
+            action = questions[0].convertToDict(renderText)
+            for question in questions[1:]:
+                action["params"]["choices"].extend(
+                    question.convertToDict(renderText)["params"]["choices"])
+            actions.append(action)
+        return actions
+
+
+# TeX in question and choice text: $$...$$ and \[...\] display math,
+# $...$ and \(...\) inline math, and bare commands like \alpha with their
+# arguments, subscripts and superscripts. Like in pandoc, inline $ math
+# can't start or end with a space, so "$5 and $6" stays text.
+_texPattern = re.compile(
+    r"\$\$(?P<display>.+?)\$\$"
+    r"|\\\[(?P<bracketDisplay>.+?)\\\]"
+    r"|(?<![\\$])\$(?P<inline>[^\s$](?:[^$]*?[^\s$\\])?)\$(?!\d)"
+    r"|\\\((?P<parenInline>.+?)\\\)"
+    r"|(?P<bare>\\[A-Za-z]+(?:\s*(?:\{[^{}]*\}|[_^](?:\{[^{}]*\}|\w)))*)",
+    re.DOTALL
+)
+# Expressions worth starting worker processes for.
+_parallelMathExpressions = 64
+
+
+def _texExpression(match):
+    # (expression, display) of a _texPattern match.
+    for group, display in (("display", True), ("bracketDisplay", True),
+                           ("inline", False), ("parenInline", False)):
+        if match.group(group) is not None:
+            return match.group(group).strip(), display
+    return match.group("bare"), False
+
+
+def _renderTeX(expression: tuple):
+    # Runs in worker processes. Returns an (expression, display) pair as
+    # the player's MathDisplay typesets it, or None and why it couldn't be
+    # rendered.
+    tex, display = expression
+    try:
+        mathML = latex2mathml.converter.convert(
+            tex, display="block" if display else "inline")
+    except Exception as error:
+        return None, "{}: {}".format(type(error).__name__, error)
+    if "\\" in mathML:
+        # latex2mathml passes commands it doesn't know through as text.
+        return None, "unknown command"
+    # H5P strips MathML from question text, so the TeX is kept, in the
+    # delimiters MathDisplay looks for. It's HTML, so < and & are escaped.
+    return ("\\[{}\\]" if display else "\\({}\\)").format(
+        html.escape(tex, quote=False)), None
+
+
+class MathRenderer:
+    """
+    Checks the TeX in question and choice text at build time and rewrites
+    it into the \\( \\) and \\[ \\] delimiters H5P's MathDisplay typesets,
+    so bare commands like \\alpha and $ math show up as math in the player.
+    H5P strips MathML and images from question text, so the typesetting
+    itself is left to MathDisplay.
+
+    Renders are memoized by expression, for the renderer's lifetime and in
+    the build cache, since the same symbols come up throughout a course.
+    prerender renders the expressions that aren't cached yet in parallel.
+    Expressions that can't be rendered are left as they are, with a warning
+    in warnings.
+    """
+
+    buildCache: "BuildCache"
+    workers: int
+    # Identifies the renderer in cache keys, so upgrading it renders again.
+    cacheTag: str
+    # Why each expression that couldn't be rendered was left as it is.
+    warnings: list
+
+    def __init__(self, buildCache: "BuildCache" = None, workers: int = None):
+        if latex2mathml is None:
+            raise ImportError("Pre-rendering math needs latex2mathml. "
+                              "Install it with pip install latex2mathml.")
+        self.buildCache = buildCache
+        self.workers = workers if workers else os.cpu_count() or 1
+        self.cacheTag = "latex2mathml {} mathdisplay".format(
+            getattr(latex2mathml, "__version__", ""))
+        self.warnings = []
+        # (expression, display) -> rendered TeX, or None if it can't be
+        # rendered.
+        self._renders = {}
+
+    @staticmethod
+    def expressions(text: str):
+        """
+        Returns the (expression, display) pairs of the TeX in text.
+        """
+        if "\\" not in text and "$" not in text:
+            return []
+        return [_texExpression(match) for match in _texPattern.finditer(text)]
+
+    def prerender(self, expressions):
+        """
+        Renders every expression in expressions, an iterable of (expression,
+        display) pairs, that isn't rendered or cached yet.
+
+        Returns the warnings about the expressions that couldn't be
+        rendered, which are also added to warnings.
+        """
+        missing = [expression for expression in dict.fromkeys(expressions)
+                   if expression not in self._renders]
+        if self.buildCache:
+            uncached = []
+            for expression in missing:
+                rendered = self.buildCache.get("math", self._cacheKey(
+                    expression))
+                if rendered is None:
+                    uncached.append(expression)
+                else:
+                    self._renders[expression] = rendered.decode()
+            missing = uncached
+        if not missing:
+            return []
+        with tracer.span("renderMath", expressions=len(missing)):
+            if self.workers > 1 and len(missing) >= _parallelMathExpressions:
+                with concurrent.futures.ProcessPoolExecutor(
+                        max_workers=self.workers) as executor:
+                    renders = list(executor.map(
+                        _renderTeX, missing,
+                        chunksize=max(1, len(missing) // (self.workers * 4))))
+            else:
+                renders = [_renderTeX(expression) for expression in missing]
+        warnings = []
+        for expression, (rendered, error) in zip(missing, renders):
+            self._renders[expression] = rendered
+            if rendered is None:
+                warnings.append("Leaving {} as it is, it couldn't be "
+                                "rendered: {}".format(expression[0], error))
+            elif self.buildCache:
+                self.buildCache.put("math", self._cacheKey(expression),
+                                    rendered.encode())
+        self.warnings.extend(warnings)
+        return warnings
+
+    def _cacheKey(self, expression: tuple):
+        return BuildCache.key(self.cacheTag, expression[0], expression[1])
+
+    def renderText(self, text: str):
+        """
+        Returns text with its TeX in MathDisplay's delimiters.
+        """
+        if "\\" not in text and "$" not in text:
+            return text
+
+        def render(match):
+            expression = _texExpression(match)
+            if expression not in self._renders:
+                self.prerender([expression])
+            rendered = self._renders[expression]
+            return rendered if rendered is not None else match.group(0)
+        return _texPattern.sub(render, text)
+
+
+# Placeholder for the interactions while content.json is streamed. The
+# control characters keep it from ever matching real content.
+_interactionsMarker = "\x00interactions\x00"
+# "library": "H5P.MultiChoice 1.14" in serialized content.
+_libraryStringPattern = re.compile(
+    r'"library": "([^" ]+) (\d+)\.(\d+)"'
+)
+
+
+# Interaction titles of the libraries question sets are made of, as the
+# Interactive Video editor names them.
+_actionTitles = {"H5P.SingleChoiceSet": "Single Choice Set",
+                 "H5P.MultiChoice": "Multiple Choice"}
+# How far apart, in percent of the video's width, the interactions of one
+# question set are.
+interactionSpacing = 6
+
+
+# Video mime types by container file extension.
+_videoMimeTypes = {".mp4": "video/mp4", ".m4v": "video/mp4",
+                   ".webm": "video/webm", ".ogv": "video/ogg",
+                   ".ogg": "video/ogg", ".mov": "video/quicktime"}
+
+
+def videoMimeType(videoSource: str):
+    # Anything that isn't a known video file, like a YouTube link, is left to
+    # the YouTube player.
+    extension = os.path.splitext(
+        urllib.parse.urlparse(videoSource).path)[1].lower()
+    return _videoMimeTypes.get(extension, "video/YouTube")
 
 
 # textqti parser creates questionsets and passes them to content.
 class Content:
     # Add more to customize more field, but for now, only do questions.
     questionSets: list
+    buildCache: "BuildCache"
+    mathRenderer: "MathRenderer"
 
-    def __init__(self, questionSets: list):
+    def __init__(self, questionSets: list, buildCache: "BuildCache" = None,
+                 mathRenderer: "MathRenderer" = None):
         self.questionSets = questionSets
+        # Interactions of unchanged question sets come from here instead of
+        # being generated again.
+        self.buildCache = buildCache
+        # Pre-renders the math in question and choice text, when given.
+        self.mathRenderer = mathRenderer
+
+    def _iterQuestionSets(self):
+        # Question sets may be parsed lazily, so fetching each one is its
+        # own span.
+        if not tracer.enabled:
+            yield from self.questionSets
+            return
+        questionSets = iter(self.questionSets)
+        while True:
+            with tracer.span("parseQuestionSet"):
+                questionSet = next(questionSets, None)
+            if questionSet is None:
+                return
+            yield questionSet
+
+    def _interactionsJSON(self, questionSet: QuestionSet,
+                          interactionTemplatePath: str,
+                          interactionTemplateDigest: str, span):
+        # A question set's interactions serialized as they're written into
+        # the interactions list, separated by ", ".
+        renderText = self.mathRenderer.renderText if self.mathRenderer \
+            else None
+        if not self.buildCache:
+            return ", ".join(json.dumps(interaction) for interaction
+                             in self.convertQuestionSetToInteractions(
+                                 questionSet=questionSet,
+                                 interactionTemplatePath=(
+                                     interactionTemplatePath),
+                                 renderText=renderText))
+        key = questionSet.fingerprint(interactionTemplateDigest) \
+            if not self.mathRenderer else questionSet.fingerprint(
+                interactionTemplateDigest, self.mathRenderer.cacheTag)
+        cachedInteractions = self.buildCache.get("questionSets", key)
+        if cachedInteractions is not None:
+            span.set(cached=True)
+            return cachedInteractions.decode()
+        interactionsJSON = ", ".join(
+            json.dumps(interaction) for interaction
+            in self.convertQuestionSetToInteractions(
+                questionSet=questionSet,
+                interactionTemplatePath=interactionTemplatePath,
+                renderText=renderText))
+        self.buildCache.put("questionSets", key, interactionsJSON.encode())
+        return interactionsJSON
+
+    def _iterInteractionsJSON(self, interactionTemplatePath: str,
+                              checkInteraction=None):
+        # Serialized interactions, one question set at a time. Each one is
+        # checked with checkInteraction, when given, before it's yielded.
+        interactionTemplateDigest = None
+        if self.buildCache:
+            interactionTemplateDigest = templateRegistry.digest(
+                interactionTemplatePath)
+        for index, questionSet in enumerate(self._iterQuestionSets()):
+            with tracer.span("interaction",
+                             questions=len(questionSet.questions)) as span:
+                interactionsJSON = self._interactionsJSON(
+                    questionSet, interactionTemplatePath,
+                    interactionTemplateDigest, span)
+                problems = []
+                if checkInteraction and interactionsJSON:
+                    interactions = json.loads(
+                        "[{}]".format(interactionsJSON))
+                    for interactionIndex, interaction in enumerate(
+                            interactions):
+                        problems.extend(
+                            (interactionIndex, path, message)
+                            for path, message
+                            in checkInteraction(interaction) or [])
+            if problems:
+                raise ContentValidationError(self._describeProblems(
+                    index, questionSet, problems))
+            yield interactionsJSON
+
+    @staticmethod
+    def _describeProblems(index: int, questionSet: QuestionSet,
+                          problems: list):
+        # Points at the question each problem is in, when it's in one.
+        actionQuestions = questionSet.actionQuestions()
+        lines = []
+        for interactionIndex, path, message in problems:
+            location = "Question set {} at {}s".format(index + 1,
+                                                      questionSet.startTime)
+            questions = actionQuestions[interactionIndex]
+            question = None
+            if path[:3] == ("action", "params", "choices") and len(path) > 3 \
+                    and path[3] < len(questions):
+                question = questions[path[3]]
+            elif path[:1] == ("action",) and len(questions) == 1:
+                question = questions[0]
+            if question is not None:
+                location += ", question {} \"{}\"".format(
+                    questionSet.questions.index(question) + 1,
+                    question.question)
+            lines.append("{}: {}".format(
+                location, SemanticsValidator.describe([(path, message)])))
+        return "\n".join(lines)
 
     @staticmethod
-    def convertQuestionSetToInteraction(questionSet: QuestionSet,
-                                     interactionTemplatePath: str):
-        with open(interactionTemplatePath, "r") as templateFile:
-            interaction = json.loads(templateFile.read())
-            interaction["action"] = questionSet.convertToDict()
+    def convertQuestionSetToInteractions(questionSet: QuestionSet,
+                                         interactionTemplatePath: str,
+                                         renderText=None):
+        interactions = []
+        for actionIndex, action in enumerate(
+                questionSet.convertToActions(renderText)):
+            interaction = templateRegistry.load(interactionTemplatePath,
+                                                ("duration", "x"))
+            interaction["action"] = action
+            interaction["libraryTitle"] = _actionTitles.get(
+                action["library"].split(" ")[0], interaction["libraryTitle"])
+            # Side by side, so the buttons of one question set don't cover
+            # each other.
+            interaction["x"] = (interaction["x"] + actionIndex
+                                * interactionSpacing) % 100
             interaction["duration"]["from"] = questionSet.startTime
             interaction["duration"]["to"] = questionSet.endTime
-            return interaction
+            interactions.append(interaction)
+        return interactions
+
+    @staticmethod
+    def _loadSkeleton(contentTemplatePath: str, videoSource):
+        # Everything in content.json except the generated interactions.
+        content = templateRegistry.load(
+            contentTemplatePath,
+            ("interactiveVideo.assets.interactions",
+             "interactiveVideo.video.files")
+        )
+        # Setting video source.
+        videoFiles = content["interactiveVideo"]["video"]["files"]
+        if isinstance(videoSource, str):
+            videoFiles[0]["path"] = videoSource
+            videoFiles[0]["mime"] = videoMimeType(videoSource)
+            return content
+        # Alternative renditions, which the player offers as qualities.
+        videoFileTemplate = videoFiles.pop(0)
+        videoFiles[:0] = [
+            dict(videoFileTemplate, path=path, mime=videoMimeType(path),
+                 quality={"level": level, "label": label})
+            for level, (path, label) in enumerate(videoSource)
+        ]
+        return content
+
+    def toDict(self, contentTemplatePath: str, interactionTemplatePath: str,
+               videoSource):
+        content = self._loadSkeleton(contentTemplatePath, videoSource)
+        interactions = content["interactiveVideo"]["assets"]["interactions"]
+        for interactionsJSON in self._iterInteractionsJSON(
+                interactionTemplatePath):
+            interactions.extend(json.loads("[{}]".format(interactionsJSON)))
+        return content
+
+    def writeJSON(self, outputFile, contentTemplatePath: str,
+                  interactionTemplatePath: str, videoSource,
+                  validator: "SemanticsValidator" = None):
+        """
+        Writes content.json to a text file object piece by piece, producing
+        exactly what json.dumps(toDict(...)) would. Only one question set's
+        interaction is in memory at a time, and none of them are kept, so
+        questionSets can just as well be a generator.
+
+        videoSource is the video's path or URL, or a list of (path, label)
+        pairs of alternative renditions.
+
+        With a validator, the content is checked against its libraries'
+        semantics as it's written, one interaction at a time, and a
+        ContentValidationError is raised at the first one that's invalid.
+
+        Returns the directory names of the libraries the content uses.
+        """
+        content = self._loadSkeleton(contentTemplatePath, videoSource)
+        checkInteraction = None
+        if validator:
+            with tracer.span("validateContent"):
+                problems = validator.checker()(content)
+            if problems:
+                raise ContentValidationError("{}: {}".format(
+                    contentTemplatePath, SemanticsValidator.describe(
+                        problems)))
+            checkInteraction = validator.checker(
+                "interactiveVideo.assets.interactions.interaction")
+        interactions = content["interactiveVideo"]["assets"]["interactions"]
+        hasTemplateInteractions = bool(interactions)
+        # Serializing the skeleton with a marker where the generated
+        # interactions go and streaming them in between the two halves.
+        interactions.append(_interactionsMarker)
+        skeletonJSON = json.dumps(content)
+        libraries = set(findContentLibraries(content))
+        head, _, tail = skeletonJSON.partition(json.dumps(_interactionsMarker))
+        if hasTemplateInteractions:
+            # The marker was preceded by a separator.
+            head = head[:-len(", ")]
+        outputFile.write(head)
+        separator = ", " if hasTemplateInteractions else ""
+        for interactionsJSON in self._iterInteractionsJSON(
+                interactionTemplatePath, checkInteraction):
+            if not interactionsJSON:
+                continue
+            outputFile.write(separator)
+            outputFile.write(interactionsJSON)
+            separator = ", "
+            libraries.update(
+                libraryDirectoryName(machineName, majorVersion, minorVersion)
+                for machineName, majorVersion, minorVersion
+                in _libraryStringPattern.findall(interactionsJSON)
+            )
+        outputFile.write(tail)
+        return libraries
 
     def export(self, outputFileName: str, contentTemplatePath: str, interactionTemplatePath: str,
                outputsDirectoryPath: str, videoSource: str):
         outputFilePath = os.path.join(outputsDirectoryPath, outputFileName)
-        with open(contentTemplatePath, "r") as templateFile, open(
-                outputFilePath, "w") as outputFile:
-            content = json.loads(templateFile.read())
-            for questionSet in self.questionSets:
-                content["interactiveVideo"]["assets"]["interactions"].append(
-                    self.convertQuestionSetToInteraction(
-                        questionSet=questionSet,
-                        interactionTemplatePath=interactionTemplatePath
-                    )
-                )
-            # Setting video source.
-            content["interactiveVideo"]["video"]["files"][0]["path"] = videoSource # Wrong. Needs to be relative.
-            mime = "video/mp4" if ".mp4" in videoSource else "video/YouTube"
-            content["interactiveVideo"]["video"]["files"][0]["mime"] = mime
-
-            outputFile.write(json.dumps(content))
+        with tracer.span("writeContentJSON"), \
+                open(outputFilePath, "w") as outputFile:
+            self.writeJSON(
+                outputFile=outputFile,
+                contentTemplatePath=contentTemplatePath,
+                interactionTemplatePath=interactionTemplatePath,
+                videoSource=videoSource # Wrong. Needs to be relative.
+            )
 
 
 class H5PMetaData:
@@ -204,380 +1119,4143 @@ class H5PMetaData:
     def __init__(self, title: str):
         self.title = title
 
+    def toDict(self, h5pMetaDataTemplatePath: str):
+        h5pMetaData = templateRegistry.load(h5pMetaDataTemplatePath)
+        h5pMetaData["title"] = self.title
+        return h5pMetaData
+
     def export(self, outputFileName: str, h5pMetaDataTemplatePath: str, outputsDirectoryPath: str):
         outputFilePath = os.path.join(outputsDirectoryPath, outputFileName)
-        with open(h5pMetaDataTemplatePath, "r") as templateFile, open(
-                outputFilePath, "w") as outputFile:
-            h5pMetaData = json.loads(templateFile.read())
-            h5pMetaData["title"] = self.title
+        h5pMetaData = self.toDict(h5pMetaDataTemplatePath)
+        with open(outputFilePath, "w") as outputFile:
             outputFile.write(json.dumps(h5pMetaData))
 
 
-# Take care of the json things and everything.
-class H5P:
-    contentTemplatePath: str
-    interactionTemplatePath: str
-    h5pMetaDataTemplatePath: str
-    outputsDirectoryPath: str
-    videoSource: str
+class LibraryError(ValueError):
+    """
+    Raised when a library needed by the content isn't in the package
+    template or its library.json can't be read.
+    """
 
-    def __init__(self, contentTemplatePath: str, interactionTemplatePath: str,
-                 h5pMetaDataTemplatePath: str, outputsDirectoryPath: str,
-                 videoSource: str):
-        self.contentTemplatePath = contentTemplatePath
-        self.interactionTemplatePath = interactionTemplatePath
-        self.h5pMetaDataTemplatePath = h5pMetaDataTemplatePath
-        self.outputsDirectoryPath = outputsDirectoryPath
-        self.videoSource = videoSource
 
-    # Take data and create json files and from templates and whatnot.
-    def export(self, content: Content, h5pMetaData: H5PMetaData):
-        content.export(
-            outputFileName="content.json",
-            contentTemplatePath=self.contentTemplatePath,
-            interactionTemplatePath=self.interactionTemplatePath,
-            outputsDirectoryPath=self.outputsDirectoryPath,
-            videoSource=self.videoSource
-        )
-        h5pMetaData.export(
-            outputFileName="h5p.json",
-            h5pMetaDataTemplatePath=self.h5pMetaDataTemplatePath,
-            outputsDirectoryPath=self.outputsDirectoryPath
-        )
+def listLibraryFiles(libraryDirectoryPath: str):
+    """
+    Returns the paths of every file in a library directory by their "/"
+    separated path relative to it, in a stable order.
+    """
+    filePaths = {}
+    for directoryPath, directoryNames, fileNames in os.walk(
+            libraryDirectoryPath):
+        directoryNames.sort()
+        for fileName in sorted(fileNames):
+            filePath = os.path.join(directoryPath, fileName)
+            filePaths[os.path.relpath(
+                filePath, libraryDirectoryPath).replace(os.sep, "/")] = \
+                filePath
+    return filePaths
 
 
-def importVideos(inputVideoType,
-                 videosDirectoryPath
-                 ):
-    videoFileNames = glob.glob(
-        os.path.join(
-            videosDirectoryPath,
-            "*." + inputVideoType
-        )
-    )
-    videoFileNames.sort()
-    videos = []
-    for videoFileName in videoFileNames:
-        video = VideoFileClip(videoFileName)
-        videos.append(video)
-    return videos
+def libraryDirectoryName(machineName: str, majorVersion: int,
+                         minorVersion: int):
+    # H5P keeps every library in a "<machineName>-<major>.<minor>" directory.
+    return "{}-{}.{}".format(machineName, majorVersion, minorVersion)
 
 
-def combineVideos(videos,
-                  outputVideoFileName,
-                  outputsDirectoryPath
-                  ):
-    finalVideo = concatenate_videoclips(videos)
-    outputVideoFilePath = os.path.join(
-        outputsDirectoryPath,
-        outputVideoFileName
-    )
-    finalVideo.write_videofile(outputVideoFilePath)
-    return outputVideoFilePath
+def mainLibraryOf(h5pMetaDataDict: dict):
+    """
+    Returns h5p.json's main library with the version it depends on, like
+    "H5P.InteractiveVideo 1.21", or None when the version isn't listed.
+    """
+    for dependency in h5pMetaDataDict.get("preloadedDependencies", []):
+        if dependency["machineName"] == h5pMetaDataDict.get("mainLibrary"):
+            return "{} {}.{}".format(dependency["machineName"],
+                                     dependency["majorVersion"],
+                                     dependency["minorVersion"])
+    return None
 
 
-def determineQuestionTypeFrom(answerChoices: list):
-    numberOfCorrectAnswers = 0
-    for answerChoice in answerChoices:
-        if answerChoice.isCorrect():
-            numberOfCorrectAnswers += 1
-            if numberOfCorrectAnswers > 1:
-                break
-    return QuestionType.SINGLE_CHOICE if numberOfCorrectAnswers == 1 else QuestionType.MULTIPLE_CHOICES
+def findContentLibraries(node):
+    """
+    Yields the directory names of the libraries referenced by "library"
+    strings, like "H5P.MultiChoice 1.14", anywhere in generated content.
+    """
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key == "library" and isinstance(value, str):
+                machineName, _, version = value.partition(" ")
+                majorVersion, _, minorVersion = version.partition(".")
+                yield libraryDirectoryName(machineName, majorVersion,
+                                           minorVersion)
+            else:
+                yield from findContentLibraries(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from findContentLibraries(value)
 
 
-def createQuestionSetsFrom(videos: list,
-                           outputVideoFilePath: str,
-                           templatesDirectoryPath: str,
-                           questionsDirectoryPath: str,
-                           outputsDirectoryPath: str
-                           ):
-    # Go through the questions from the questions.txt and create a list of
-    # QuestionSets.
+class LibraryResolver:
+    """
+    Works out which libraries of a package template a piece of content
+    actually needs.
 
-    singleChoiceTemplateFileName = "template_question_single_choice.json"
-    singleChoiceTemplateFilePath = os.path.join(
-        templatesDirectoryPath,
-        singleChoiceTemplateFileName
-    )
-    multipleChoicesTemplateFileName = "template_question_multiple_choices.json"
-    multipleChoicesTemplateFilePath = os.path.join(
-        templatesDirectoryPath,
-        multipleChoicesTemplateFileName
-    )
-    questionSetTemplateFileName = "template_question_set.json"
-    questionSetTemplateFilePath = os.path.join(
-        templatesDirectoryPath,
-        questionSetTemplateFileName
-    )
-    contentTemplateFileName = "template_content.json"
-    contentTemplateFilePath = os.path.join(
-        templatesDirectoryPath,
-        contentTemplateFileName
-    )
+    The dependency graph is read from every library.json in the template
+    once and reused until one of those files changes. Graphs are shared by
+    every resolver in the process and, when cacheFilePath is given, saved
+    to disk so later builds can skip parsing them too.
+    """
 
-    questionsFileName = "questions.txt"
-    questionsFilePath = os.path.join(
-        questionsDirectoryPath,
-        questionsFileName
-    )
+    packageTemplateDirectoryPath: str
+    cacheFilePath: str
 
-    # Importing templates as dictionaries. May not need this.
-    with open(singleChoiceTemplateFilePath, "r") as templateFile:
-        singleChoiceTemplate = json.loads(templateFile.read())
-    with open(multipleChoicesTemplateFilePath, "r") as templateFile:
-        multipleChoicesTemplate = json.loads(templateFile.read())
-    with open(contentTemplateFilePath, "r") as templateFile:
-        contentTemplate = json.loads(templateFile.read())
+    # Package template directory path -> (fingerprint, graph).
+    _graphs = {}
 
-    # Creating QuestionSets.
-    with open(questionsFilePath, "r") as questionsFile:
-        collectingQuestions = False
-        videoTime = 0.0
-        questionSet = None
-        questionSets = []
-        while True:
-            # For each line
-            # If Line is video, start collecting stuff in a data structure.
-                # If the line doesn't start with video, file error.
-            # As the questions are being collected, if a new video line appears,
-            # save the current questions and the video and continue with the
-            # new video and questions.
-            # Stop collecting when there are no more questions.
-
-            # submit questions when it's either video or end of file.
-
-            line = questionsFile.readline()
-            if line:
-                line = line.replace("\n", "")
-            else:
-                # FIX ME: It's not clean. Duplicate code.
-                # Add the previous question set to the list if there was one.
-                if questionSet:
-                    questionSet.startTime = videoTime
-                    # This value should be a constant.
-                    videoTime += 2
-                    questionSet.endTime = videoTime
-                    questionSets.append(questionSet)
-                break
-            if "video:" in line:
-                # Add the previous question set to the list if there was one.
-                if questionSet:
-                    questionSet.startTime = videoTime
-                    # This value should be a constant.
-                    videoTime += 2
-                    questionSet.endTime = videoTime
-                    questionSets.append(questionSet)
-                videoFileName = line.replace("video:", "").strip()
-                firstVideoFileName = videos[0].filename.split("/")[-1]
-                # Checking to make sure the video we're dealing with is the
-                # correct one.
-                if firstVideoFileName == videoFileName:
-                    videoTime += videos[0].duration
-                    videos.pop(0)
-                # Collecting questions for current video.
-                questionSet = QuestionSet(
-                    templatePath=questionSetTemplateFilePath
-                )
-                collectingQuestions = True
-            elif collectingQuestions:
-                # Checking if it's a question.
-                if re.search("(\d+\.)", line):
-                    # Getting question title.
-                    questionNumberToRemove = re.search(
-                        "(\d+\.)",
-                        line
-                    ).group(0)
-                    questionTitle = line.replace(
-                        questionNumberToRemove,
-                        ""
-                    ).strip()
-
-                    # Going through the question choices.
-                    answerChoices = []
-                    while True:
-                        lastPosition = questionsFile.tell()
-                        potentialQuestionChoice = questionsFile.readline()
-                        # Checking if the current line is valid for reading in
-                        # choices or start creating new question and adding it
-                        # to question set.
-                        processQuestion = False
-                        if potentialQuestionChoice:
-                            potentialQuestionChoice = potentialQuestionChoice.replace(
-                                "\n",
-                                ""
-                            )
-                            # New video found.
-                            if "video:" in potentialQuestionChoice:
-                                questionsFile.seek(lastPosition)
-                                collectingQuestions = False
-                                processQuestion = True
-                            # New question found.
-                            elif re.search("(\d+\.)", potentialQuestionChoice):
-                                questionsFile.seek(lastPosition)
-                                processQuestion = True
-                            elif potentialQuestionChoice == "":
-                                continue
-                        else:
-                            # This is the last question to be processed.
-                            processQuestion = True
-                        # Saving choices if it's not time to process the
-                        # question and the choices as a whole.
-                        if not processQuestion:
-                            if re.search("([\[ \S]+[\]\)])",
-                                         potentialQuestionChoice):
-                                # Marked "choice": some-value and "isAnswer": Boolean
-                                answerChoice = {}
-                                # Marking them if they're the correct answer.
-                                answerChoice["isAnswer"] = True if re.search(
-                                    "(\*.*[\]\)])",
-                                    potentialQuestionChoice
-                                ) else False
-                                # Removing the from component of the answer choice.
-                                answerChoiceOptionValueToRemove = re.search(
-                                    "([\[ \S]+[\]\)])",
-                                    potentialQuestionChoice
-                                ).group(0)
-                                answerChoice[
-                                    "choice"] = potentialQuestionChoice.replace(
-                                    answerChoiceOptionValueToRemove,
-                                    ""
-                                ).strip()
-                                answerChoices.append(
-                                    Choice(
-                                        choice=answerChoice["choice"],
-                                        isCorrect=answerChoice["isAnswer"]
-                                    )
-                                )
-                                continue
-                        else:
-                            questionType = determineQuestionTypeFrom(
-                                answerChoices=answerChoices
-                            )
-                            if questionType == QuestionType.SINGLE_CHOICE:
-                                singleChoiceQuestion = SingleChoiceQuestion(
-                                    question=questionTitle,
-                                    choices=answerChoices,
-                                    templatePath=singleChoiceTemplateFilePath
-                                )
-                                questionSet.questions.append(singleChoiceQuestion)
-                            elif questionType == QuestionType.MULTIPLE_CHOICES:
-                                multipleChoicesQuestion = MultipleChoicesQuestion(
-                                    question=questionTitle,
-                                    choices=answerChoices,
-                                    templatePath=multipleChoicesTemplateFilePath
-                                )
-                                questionSet.questions.append(
-                                    multipleChoicesQuestion)
-                            else:
-                                print(questionType)
-                                exit("This question type isn't supported.")
-                            break
-        return questionSets
-
-
-def main():
-    # Directories.
-    # Creating system paths based on the local OS.
-    workingDirectory = os.getcwd()
-
-    useTestData = False
-    if useTestData:
-        inputsDirectory = "test_inputs/"
-    else:
-        inputsDirectory = "inputs/"
+    def __init__(self, packageTemplateDirectoryPath: str,
+                 cacheFilePath: str = None):
+        self.packageTemplateDirectoryPath = packageTemplateDirectoryPath
+        self.cacheFilePath = cacheFilePath
 
-    videosDirectory = "videos/"
-    inputVideoType = "mov"
-    videosDirectoryPath = os.path.join(
-        workingDirectory,
-        inputsDirectory,
-        videosDirectory
-    )
+    def _libraryFilePaths(self):
+        libraryFilePaths = {}
+        for directoryName in sorted(os.listdir(
+                self.packageTemplateDirectoryPath)):
+            libraryFilePath = os.path.join(self.packageTemplateDirectoryPath,
+                                           directoryName, "library.json")
+            if os.path.isfile(libraryFilePath):
+                libraryFilePaths[directoryName] = libraryFilePath
+        return libraryFilePaths
 
-    templatesDirectory = "templates/"
-    templatesDirectoryPath = os.path.join(
-        workingDirectory,
-        templatesDirectory
-    )
+    @staticmethod
+    def _fingerprint(libraryFilePaths: dict):
+        fingerprint = []
+        for directoryName, libraryFilePath in libraryFilePaths.items():
+            fileStatus = os.stat(libraryFilePath)
+            fingerprint.append([directoryName, fileStatus.st_mtime_ns,
+                                fileStatus.st_size])
+        return fingerprint
 
-    outputsDirectory = "h5p/content/"
-    outputVideoName = "final_h5p_video.mp4"  # Only mp4 is supported for now.
-    outputsDirectoryPath = os.path.join(
-        workingDirectory,
-        outputsDirectory
-    )
+    @staticmethod
+    def _parseGraph(libraryFilePaths: dict):
+        # Library directory name -> directory names of the libraries it
+        # needs at runtime. Editor dependencies are left out on purpose.
+        graph = {}
+        for directoryName, libraryFilePath in libraryFilePaths.items():
+            try:
+                with open(libraryFilePath, "r") as libraryFile:
+                    library = json.loads(libraryFile.read())
+            except (OSError, ValueError) as error:
+                raise LibraryError("Couldn't read {}: {}".format(
+                    libraryFilePath, error)) from error
+            graph[directoryName] = [
+                libraryDirectoryName(dependency["machineName"],
+                                     dependency["majorVersion"],
+                                     dependency["minorVersion"])
+                for dependencyType in ("preloadedDependencies",
+                                       "dynamicDependencies")
+                for dependency in library.get(dependencyType, [])
+            ]
+        return graph
 
-    questionsDirectory = "questions"
-    questionsDirectoryPath = os.path.join(
-        workingDirectory,
-        inputsDirectory,
-        questionsDirectory
-    )
+    def _loadCachedGraph(self, fingerprint: list):
+        if not self.cacheFilePath or not os.path.isfile(self.cacheFilePath):
+            return None
+        try:
+            with open(self.cacheFilePath, "r") as cacheFile:
+                cache = json.loads(cacheFile.read())
+        except (OSError, ValueError):
+            return None
+        if cache.get("fingerprint") != fingerprint:
+            return None
+        return cache.get("graph")
 
-    # Templates.
-    interactionTemplateFileName = "template_interaction.json"
-    interactionTemplateFilePath = os.path.join(
-        templatesDirectoryPath,
-        interactionTemplateFileName
-    )
+    def _saveCachedGraph(self, fingerprint: list, graph: dict):
+        if not self.cacheFilePath:
+            return
+        # Builds running in parallel may share the cache file.
+        partialCacheFilePath = "{}.{}.partial".format(self.cacheFilePath,
+                                                      os.getpid())
+        with open(partialCacheFilePath, "w") as cacheFile:
+            cacheFile.write(json.dumps({"fingerprint": fingerprint,
+                                        "graph": graph}))
+        os.replace(partialCacheFilePath, self.cacheFilePath)
 
-    contentTemplateFileName = "template_content.json"
-    contentTemplateFilePath = os.path.join(
-        templatesDirectoryPath,
-        contentTemplateFileName
-    )
+    def graph(self):
+        libraryFilePaths = self._libraryFilePaths()
+        fingerprint = self._fingerprint(libraryFilePaths)
+        cached = self._graphs.get(self.packageTemplateDirectoryPath)
+        if cached and cached[0] == fingerprint:
+            return cached[1]
+        with tracer.span("libraryGraph") as span:
+            graph = self._loadCachedGraph(fingerprint)
+            span.set(cached=graph is not None)
+            if graph is None:
+                graph = self._parseGraph(libraryFilePaths)
+                self._saveCachedGraph(fingerprint, graph)
+        self._graphs[self.packageTemplateDirectoryPath] = (fingerprint, graph)
+        return graph
 
-    h5pMetaDataTemplateFileName = "template_h5p.json"
-    h5pMetaDataTemplateFilePath = os.path.join(
-        templatesDirectoryPath,
-        h5pMetaDataTemplateFileName
-    )
+    def resolve(self, rootLibraries):
+        """
+        Returns the set of library directory names needed by rootLibraries,
+        including everything they depend on.
+        """
+        graph = self.graph()
+        resolvedLibraries = set()
+        pendingLibraries = list(rootLibraries)
+        while pendingLibraries:
+            directoryName = pendingLibraries.pop()
+            if directoryName in resolvedLibraries:
+                continue
+            if directoryName not in graph:
+                raise LibraryError(
+                    "Library {} isn't in {}.".format(
+                        directoryName, self.packageTemplateDirectoryPath)
+                )
+            resolvedLibraries.add(directoryName)
+            pendingLibraries.extend(graph[directoryName])
+        return resolvedLibraries
 
-    # Creating h5p directory.
-    h5pTemplateDirectory = "template_h5p_package_multiple_choice/"
-    source = os.path.join(templatesDirectoryPath, h5pTemplateDirectory)
-    destination = os.path.join(workingDirectory, "h5p/")
-    # Checking if the directory already exists.
-    if os.path.isdir(destination):
-        shutil.rmtree(destination)
-    shutil.copytree(source, destination)
 
-    # Import videos.
-    videos = importVideos(
-        inputVideoType=inputVideoType,
-        videosDirectoryPath=videosDirectoryPath
+class ContentValidationError(ValueError):
+    """
+    Raised when generated content doesn't match the semantics.json of the
+    libraries it uses, which H5P would reject or quietly alter on upload.
+    """
+
+
+# Tags H5P allows in every html text field on top of the field's own, and
+# the ones it lets in along with some of those.
+_htmlBaseTags = ("div", "span", "p", "br")
+_htmlImpliedTags = {
+    "table": ("tr", "td", "th", "colgroup", "thead", "tbody", "tfoot"),
+    "strong": ("b",),
+    "em": ("i",),
+    "ul": ("li",),
+    "ol": ("li",),
+    "del": ("s",),
+    "strike": ("s",)
+}
+_htmlTagPattern = re.compile(r"</?([a-zA-Z][a-zA-Z0-9-]*)")
+# Keys file objects may have besides path, mime and copyright.
+_fileFieldKeys = {
+    "image": ("width", "height", "originalImage"),
+    "video": ("width", "height", "codecs", "quality", "metadata"),
+    "audio": (),
+    "file": ()
+}
+_libraryValueKeys = frozenset(("library", "params", "subContentId",
+                               "metadata"))
+
+
+def _jsonTypeName(value):
+    if isinstance(value, bool):
+        return "a boolean"
+    if isinstance(value, (int, float)):
+        return "a number"
+    if isinstance(value, str):
+        return "text"
+    if isinstance(value, list):
+        return "a list"
+    if isinstance(value, dict):
+        return "an object"
+    return "null"
+
+
+def _problem(message: str):
+    return [((), message)]
+
+
+def _nestedProblems(key, problems: list):
+    return [((key,) + path, message) for path, message in problems]
+
+
+class SemanticsValidator:
+    """
+    Checks content against the semantics.json of the libraries in a package
+    template, the same way H5P does when content is uploaded.
+
+    Each library's semantics are compiled once into nested check functions,
+    which are shared by every validator in the process and only compiled
+    again when semantics.json changes. A check function takes a value and
+    returns None when it's valid, or a list of (path, message) problems
+    where path is a tuple of keys and list indices leading to the offending
+    value.
+    """
+
+    packageTemplateDirectoryPath: str
+    mainLibrary: str
+
+    # semantics.json path -> (fingerprint, semantics, params check).
+    _compiled = {}
+
+    def __init__(self, packageTemplateDirectoryPath: str, mainLibrary: str):
+        self.packageTemplateDirectoryPath = packageTemplateDirectoryPath
+        # The library content.json is the params of, like
+        # "H5P.InteractiveVideo 1.21".
+        self.mainLibrary = mainLibrary
+        # Library -> (semantics, params check), for this validator's
+        # lifetime, so semantics.json is only looked at once per build.
+        self._libraries = {}
+
+    def _library(self, library: str):
+        compiledLibrary = self._libraries.get(library)
+        if compiledLibrary is not None:
+            return compiledLibrary
+        machineName, _, version = library.partition(" ")
+        majorVersion, _, minorVersion = version.partition(".")
+        semanticsFilePath = os.path.join(
+            self.packageTemplateDirectoryPath,
+            libraryDirectoryName(machineName, majorVersion, minorVersion),
+            "semantics.json"
+        )
+        try:
+            fileStatus = os.stat(semanticsFilePath)
+        except OSError:
+            raise LibraryError("Library {} has no semantics.json in {}."
+                               .format(library,
+                                       self.packageTemplateDirectoryPath))
+        fingerprint = (fileStatus.st_mtime_ns, fileStatus.st_size)
+        cached = self._compiled.get(semanticsFilePath)
+        if cached and cached[0] == fingerprint:
+            compiledLibrary = cached[1:]
+        else:
+            with tracer.span("compileSemantics", library=library):
+                try:
+                    with open(semanticsFilePath, "r") as semanticsFile:
+                        semantics = json.loads(semanticsFile.read())
+                except (OSError, ValueError) as error:
+                    raise LibraryError("Couldn't read {}: {}".format(
+                        semanticsFilePath, error)) from error
+                compiledLibrary = (semantics, self._compileGroup(
+                    {"fields": semantics}, flatten=False))
+            self._compiled[semanticsFilePath] = (fingerprint,) \
+                + compiledLibrary
+        self._libraries[library] = compiledLibrary
+        return compiledLibrary
+
+    def checker(self, fieldPath: str = "", library: str = None):
+        """
+        Returns the check function of a library's params, the main
+        library's by default, or of the field at fieldPath in them. Fields
+        are named by dotted semantics names, so the items of the
+        interactions list are "interactiveVideo.assets.interactions.
+        interaction".
+        """
+        semantics, check = self._library(library if library
+                                         else self.mainLibrary)
+        if not fieldPath:
+            return check
+        field = {"fields": semantics}
+        for name in fieldPath.split("."):
+            children = field.get("fields", []) + (
+                [field["field"]] if "field" in field else [])
+            field = next((child for child in children
+                          if child.get("name") == name), None)
+            if field is None:
+                raise LibraryError("{} has no field {}.".format(
+                    library if library else self.mainLibrary, fieldPath))
+        return self._compileField(field)
+
+    @staticmethod
+    def describe(problems: list):
+        # One "path: message" line per problem.
+        lines = []
+        for path, message in problems:
+            location = ""
+            for key in path:
+                location += "[{}]".format(key) if isinstance(key, int) \
+                    else ("." if location else "") + key
+            lines.append("{}: {}".format(location if location else "value",
+                                         message))
+        return "\n".join(lines)
+
+    def _compileField(self, field: dict):
+        compileField = getattr(
+            self, "_compile" + field.get("type", "").title(), None)
+        if compileField is None:
+            # Types H5P doesn't check either.
+            return lambda value: None
+        return compileField(field)
+
+    @staticmethod
+    def _compileText(field: dict):
+        maxLength = field.get("maxLength")
+        pattern = None
+        if "regexp" in field:
+            pattern = re.compile(
+                field["regexp"]["pattern"],
+                re.IGNORECASE if "i" in field["regexp"].get("modifiers", "")
+                else 0
+            )
+        allowedTags = None
+        if "tags" in field:
+            allowedTags = set(_htmlBaseTags).union(field["tags"])
+            for tag in field["tags"]:
+                allowedTags.update(_htmlImpliedTags.get(tag, ()))
+
+        def checkText(value):
+            if not isinstance(value, str):
+                return _problem("should be text, not {}".format(
+                    _jsonTypeName(value)))
+            if maxLength is not None and len(value) > maxLength:
+                return _problem("is longer than {} characters".format(
+                    maxLength))
+            if pattern and not pattern.search(value):
+                return _problem("doesn't match {}".format(pattern.pattern))
+            if "<" not in value:
+                return None
+            tags = {tag.lower() for tag in _htmlTagPattern.findall(value)}
+            if allowedTags is None:
+                if tags:
+                    return _problem("is plain text, so its markup would be "
+                                    "shown escaped")
+                return None
+            disallowedTags = tags - allowedTags
+            if disallowedTags:
+                return _problem("has tags H5P would strip: {}".format(
+                    ", ".join("<{}>".format(tag)
+                              for tag in sorted(disallowedTags))))
+            return None
+        return checkText
+
+    @staticmethod
+    def _compileNumber(field: dict):
+        minimum = field.get("min")
+        maximum = field.get("max")
+
+        def checkNumber(value):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                return _problem("should be a number, not {}".format(
+                    _jsonTypeName(value)))
+            if minimum is not None and value < minimum:
+                return _problem("is below the minimum of {}".format(minimum))
+            if maximum is not None and value > maximum:
+                return _problem("is above the maximum of {}".format(maximum))
+            return None
+        return checkNumber
+
+    @staticmethod
+    def _compileBoolean(field: dict):
+        def checkBoolean(value):
+            if not isinstance(value, bool):
+                return _problem("should be a boolean, not {}".format(
+                    _jsonTypeName(value)))
+            return None
+        return checkBoolean
+
+    @staticmethod
+    def _compileSelect(field: dict):
+        options = frozenset(option["value"]
+                            for option in field.get("options", []))
+        allowedOptions = ", ".join(sorted(json.dumps(option)
+                                          for option in options))
+        multiple = field.get("multiple", False)
+
+        def checkSelect(value):
+            values = value if multiple and isinstance(value, list) \
+                else [value]
+            for selected in values:
+                if not isinstance(selected, (str, int, float)) \
+                        or selected not in options:
+                    return _problem("{} isn't one of {}".format(
+                        json.dumps(selected), allowedOptions))
+            return None
+        return checkSelect
+
+    def _compileList(self, field: dict):
+        minimum = field.get("min")
+        maximum = field.get("max")
+        checkItem = self._compileField(field["field"])
+
+        def checkList(value):
+            if not isinstance(value, list):
+                return _problem("should be a list, not {}".format(
+                    _jsonTypeName(value)))
+            if minimum is not None and len(value) < minimum:
+                return _problem("has fewer than {} items".format(minimum))
+            if maximum is not None and len(value) > maximum:
+                return _problem("has more than {} items".format(maximum))
+            problems = None
+            for index, item in enumerate(value):
+                itemProblems = checkItem(item)
+                if itemProblems:
+                    problems = (problems if problems else []) \
+                        + _nestedProblems(index, itemProblems)
+            return problems
+        return checkList
+
+    def _compileGroup(self, field: dict, flatten: bool = True):
+        fields = field.get("fields", [])
+        if len(fields) == 1 and flatten and not field.get("isSubContent"):
+            # H5P stores a group of one field as that field's value.
+            return self._compileField(fields[0])
+        checks = {child["name"]: self._compileField(child)
+                  for child in fields}
+        isSubContent = field.get("isSubContent", False)
+
+        def checkGroup(value):
+            if not isinstance(value, dict):
+                return _problem("should be an object, not {}".format(
+                    _jsonTypeName(value)))
+            problems = None
+            for key, child in value.items():
+                check = checks.get(key)
+                if check is None:
+                    if isSubContent and key == "subContentId":
+                        continue
+                    childProblems = _problem(
+                        "isn't in the semantics, so H5P would drop it")
+                else:
+                    childProblems = check(child)
+                if childProblems:
+                    problems = (problems if problems else []) \
+                        + _nestedProblems(key, childProblems)
+            return problems
+        return checkGroup
+
+    def _compileLibrary(self, field: dict):
+        options = frozenset(field.get("options", []))
+        allowedLibraries = ", ".join(sorted(options))
+        # Library -> params check, filled in as libraries turn up, so
+        # libraries that are never used are never compiled.
+        paramsChecks = {}
+
+        def checkLibrary(value):
+            if not isinstance(value, dict):
+                return _problem("should be an object, not {}".format(
+                    _jsonTypeName(value)))
+            library = value.get("library")
+            problems = None
+            if library not in options:
+                problems = _nestedProblems("library", _problem(
+                    "{} isn't one of the allowed libraries {}".format(
+                        json.dumps(library), allowedLibraries)))
+                # Its params are still checked, so everything wrong with
+                # the value is reported at once.
+                if not isinstance(library, str):
+                    return problems
+            for key in value.keys() - _libraryValueKeys:
+                problems = (problems if problems else []) + _nestedProblems(
+                    key, _problem("isn't in the semantics, so H5P would "
+                                  "drop it"))
+            checkParams = paramsChecks.get(library)
+            if checkParams is None:
+                checkParams = paramsChecks[library] = self._library(
+                    library)[1]
+            paramsProblems = checkParams(value.get("params", {}))
+            if paramsProblems:
+                problems = (problems if problems else []) \
+                    + _nestedProblems("params", paramsProblems)
+            return problems
+        return checkLibrary
+
+    @staticmethod
+    def _compileFile(field: dict):
+        fileType = field.get("type")
+        validKeys = frozenset(("path", "mime", "copyright")
+                              + _fileFieldKeys.get(fileType, ()))
+
+        def checkFile(value):
+            if not isinstance(value, dict):
+                return _problem("should be an object, not {}".format(
+                    _jsonTypeName(value)))
+            if not isinstance(value.get("path"), str):
+                return _problem("has no path")
+            if "mime" in value and not isinstance(value["mime"], str):
+                return _problem("has a mime type that isn't text")
+            unknownKeys = value.keys() - validKeys
+            if unknownKeys:
+                return _problem("has keys H5P would drop: {}".format(
+                    ", ".join(sorted(unknownKeys))))
+            return None
+
+        if fileType == "image" or fileType == "file":
+            return checkFile
+
+        # Videos and audio are lists of alternative files.
+        def checkFiles(value):
+            if not isinstance(value, list):
+                return _problem("should be a list, not {}".format(
+                    _jsonTypeName(value)))
+            problems = None
+            for index, item in enumerate(value):
+                itemProblems = checkFile(item)
+                if itemProblems:
+                    problems = (problems if problems else []) \
+                        + _nestedProblems(index, itemProblems)
+            return problems
+        return checkFiles
+
+    _compileImage = _compileFile
+    _compileVideo = _compileFile
+    _compileAudio = _compileFile
+
+
+# Linux's FICLONE ioctl, which makes a copy-on-write clone of a file on file
+# systems like Btrfs and XFS.
+_ficlone = 0x40049409
+
+
+def cloneFile(sourceFilePath: str, destinationFilePath: str):
+    """
+    Copies a file, sharing its blocks with the original where the file
+    system supports reflinks.
+    """
+    if fcntl is not None:
+        try:
+            with open(sourceFilePath, "rb") as sourceFile, \
+                    open(destinationFilePath, "wb") as destinationFile:
+                fcntl.ioctl(destinationFile.fileno(), _ficlone,
+                            sourceFile.fileno())
+            return
+        except OSError:
+            pass
+    shutil.copyfile(sourceFilePath, destinationFilePath)
+
+
+def linkOrCloneFile(sourceFilePath: str, destinationFilePath: str):
+    """
+    Hard links a file, or clones it when that isn't possible, e.g. across
+    file systems. Whoever writes to either path later has to replace the
+    file rather than overwrite it in place.
+    """
+    try:
+        os.link(sourceFilePath, destinationFilePath)
+    except OSError:
+        cloneFile(sourceFilePath, destinationFilePath)
+
+
+def _isSameFile(filePath: str, otherFilePath: str):
+    try:
+        return os.path.samefile(filePath, otherFilePath)
+    except OSError:
+        return False
+
+
+def _sameFileContents(filePath: str, otherFilePath: str):
+    try:
+        if os.path.getsize(filePath) != os.path.getsize(otherFilePath):
+            return False
+    except OSError:
+        return False
+    return filecmp.cmp(filePath, otherFilePath, shallow=False)
+
+
+class StagingError(ValueError):
+    """
+    Raised instead of staging into a directory that has files a previous
+    stage didn't put there, since they would be removed.
+    """
+
+
+class LibraryStore:
+    """
+    Content-addressed store of library files that unpacked packages are
+    staged from.
+
+    Each file is stored once under the hash of its contents, whichever
+    libraries use it, and a manifest per library directory, like
+    "H5P.MultiChoice-1.14", lists the hashes of its files. A library is only
+    hashed again when one of its files changes. Staged files are hard links
+    to the stored ones, or reflinks or copies where that's not possible, so
+    any number of unpacked packages take about the space of one.
+    """
+
+    storeDirectoryPath: str
+    # Lists the files a stage put into its directory. The next stage only
+    # ever removes those.
+    stageManifestFileName = ".h5p_stage.json"
+
+    def __init__(self, storeDirectoryPath: str):
+        self.storeDirectoryPath = storeDirectoryPath
+        os.makedirs(os.path.join(storeDirectoryPath, "objects"),
+                    exist_ok=True)
+        os.makedirs(os.path.join(storeDirectoryPath, "libraries"),
+                    exist_ok=True)
+
+    def objectFilePath(self, digest: str):
+        return os.path.join(self.storeDirectoryPath, "objects", digest[:2],
+                            digest[2:])
+
+    def addFile(self, filePath: str):
+        """
+        Stores a file's contents and returns their hash.
+        """
+        fileHash = hashlib.sha256()
+        with open(filePath, "rb") as hashedFile:
+            for chunk in iter(lambda: hashedFile.read(1024 * 1024), b""):
+                fileHash.update(chunk)
+        digest = fileHash.hexdigest()
+        objectFilePath = self.objectFilePath(digest)
+        if not os.path.exists(objectFilePath):
+            # Stored files are copies so editing the original can't change
+            # them, and read only since they're shared by every staging.
+            os.makedirs(os.path.dirname(objectFilePath), exist_ok=True)
+            partialObjectFilePath = "{}.{}.partial".format(objectFilePath,
+                                                           os.getpid())
+            cloneFile(filePath, partialObjectFilePath)
+            os.chmod(partialObjectFilePath, 0o444)
+            os.replace(partialObjectFilePath, objectFilePath)
+        return digest
+
+    def addLibrary(self, libraryDirectoryPath: str):
+        """
+        Stores every file of a library directory and returns their hashes
+        by path relative to the directory.
+        """
+        filePaths = listLibraryFiles(libraryDirectoryPath)
+        fingerprint = LibraryResolver._fingerprint(filePaths)
+
+        manifestFilePath = os.path.join(
+            self.storeDirectoryPath, "libraries",
+            os.path.basename(os.path.normpath(libraryDirectoryPath)) + ".json"
+        )
+        try:
+            with open(manifestFilePath, "r") as manifestFile:
+                manifest = json.loads(manifestFile.read())
+            if manifest["fingerprint"] == fingerprint:
+                return manifest["files"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+        with tracer.span("storeLibrary",
+                         library=os.path.basename(libraryDirectoryPath)):
+            files = {relativePath: self.addFile(filePath)
+                     for relativePath, filePath in filePaths.items()}
+        partialManifestFilePath = "{}.{}.partial".format(manifestFilePath,
+                                                         os.getpid())
+        with open(partialManifestFilePath, "w") as manifestFile:
+            manifestFile.write(json.dumps({"fingerprint": fingerprint,
+                                           "files": files}))
+        os.replace(partialManifestFilePath, manifestFilePath)
+        return files
+
+    @classmethod
+    def stagedFilePaths(cls, directoryPath: str):
+        """
+        Returns the relative paths the last stage into directoryPath put
+        there, or an empty set if it doesn't exist or is empty. Raises
+        StagingError if it has files but was never staged into.
+        """
+        try:
+            with open(os.path.join(directoryPath, cls.stageManifestFileName),
+                      encoding="utf-8") as manifestFile:
+                return set(json.load(manifestFile))
+        except FileNotFoundError:
+            pass
+        except ValueError as error:
+            raise StagingError("{} has an unreadable {}: {}".format(
+                directoryPath, cls.stageManifestFileName, error))
+        if os.path.isdir(directoryPath) and os.listdir(directoryPath):
+            raise StagingError(
+                "{} isn't empty and wasn't staged into before. Stage into "
+                "an empty or new directory.".format(directoryPath))
+        return set()
+
+    @classmethod
+    def recordStage(cls, directoryPath: str, relativePaths: set):
+        """
+        Records relativePaths as staged into directoryPath, which is
+        created if needed.
+        """
+        os.makedirs(directoryPath, exist_ok=True)
+        manifestFilePath = os.path.join(directoryPath,
+                                        cls.stageManifestFileName)
+        partialFilePath = "{}.{}.partial".format(manifestFilePath,
+                                                 os.getpid())
+        with open(partialFilePath, "w", encoding="utf-8") as manifestFile:
+            json.dump(sorted(relativePaths), manifestFile)
+        os.replace(partialFilePath, manifestFilePath)
+
+    @classmethod
+    def stage(cls, directoryPath: str, sourceFilePaths: dict,
+              keptFilePaths: set = frozenset(),
+              stagedFilePaths: set = None):
+        """
+        Makes directoryPath hold the files in sourceFilePaths, a dictionary
+        of "/" separated relative paths to the files they should be linked
+        to, plus the relative paths in keptFilePaths, which are left as
+        they are.
+
+        Only files that changed are replaced, each by an atomic rename, so
+        anything reading the directory at the same time sees either the old
+        or the new version of a file and never a partly written one. Files
+        the previous stage put there that aren't wanted anymore are removed
+        afterwards, and nothing else. stagedFilePaths are those files when
+        the caller already read them with stagedFilePaths(). Returns how
+        many files were replaced.
+        """
+        if stagedFilePaths is None:
+            stagedFilePaths = cls.stagedFilePaths(directoryPath)
+        wantedFilePaths = set(sourceFilePaths) | set(keptFilePaths)
+        # Recorded first, so files from a stage that's interrupted are
+        # still removed by the next one.
+        cls.recordStage(directoryPath, stagedFilePaths | wantedFilePaths)
+        replacedFiles = 0
+        for relativePath, sourceFilePath in sourceFilePaths.items():
+            filePath = os.path.join(directoryPath, *relativePath.split("/"))
+            if _isSameFile(filePath, sourceFilePath):
+                continue
+            os.makedirs(os.path.dirname(filePath), exist_ok=True)
+            partialFilePath = "{}.{}.partial".format(filePath, os.getpid())
+            if os.path.exists(partialFilePath):
+                os.remove(partialFilePath)
+            try:
+                # Even identical files are swapped for links so they stop
+                # taking up space of their own.
+                os.link(sourceFilePath, partialFilePath)
+            except OSError:
+                # Copies are only worth making for files that changed.
+                if _sameFileContents(filePath, sourceFilePath):
+                    continue
+                cloneFile(sourceFilePath, partialFilePath)
+            os.replace(partialFilePath, filePath)
+            replacedFiles += 1
+
+        for relativePath in sorted(stagedFilePaths - wantedFilePaths):
+            filePath = os.path.join(directoryPath, *relativePath.split("/"))
+            try:
+                os.remove(filePath)
+            except FileNotFoundError:
+                continue
+            # Directories the stage left empty go too.
+            parentDirectoryPath = os.path.dirname(filePath)
+            while parentDirectoryPath != directoryPath \
+                    and not os.listdir(parentDirectoryPath):
+                os.rmdir(parentDirectoryPath)
+                parentDirectoryPath = os.path.dirname(parentDirectoryPath)
+        cls.recordStage(directoryPath, wantedFilePaths)
+        return replacedFiles
+
+
+# url(...) references in stylesheets.
+_cssURLPattern = re.compile(
+    r"""url\(\s*(?P<quote>['"]?)(?P<url>[^'")]*)(?P=quote)\s*\)""")
+_fontFacePattern = re.compile(r"@font-face\s*\{[^}]*\}", re.IGNORECASE)
+# A src declaration in a @font-face rule and the fonts it lists.
+_fontSourcePattern = re.compile(r"\bsrc\s*:(?P<sources>[^;}]*);?",
+                                re.IGNORECASE)
+_fontSourceEntryPattern = re.compile(
+    r"(?:url\([^)]*\)|local\([^)]*\))(?:\s*format\([^)]*\))?", re.IGNORECASE)
+_fontFormatPattern = re.compile(r"format\(\s*['\"]?(?P<format>[\w-]+)",
+                                re.IGNORECASE)
+# Font formats every browser H5P supports loads. The others, like eot and
+# svg fonts, are only there for browsers that are long gone.
+_webFontFormats = ("woff2", "woff")
+# Bumped whenever bundles come out differently, so they're made again.
+_libraryBundleVersion = 2
+_bundledScriptName = "h5p-bundle.min.js"
+_bundledStyleName = "h5p-bundle.min.css"
+
+
+def _splitURL(url: str):
+    # ("fonts/a.woff", "?v=4#a") for "fonts/a.woff?v=4#a".
+    match = re.search(r"[?#]", url)
+    return (url[:match.start()], url[match.start():]) if match else (url, "")
+
+
+def _isRelativeURL(url: str):
+    return bool(url) and not url.startswith(("data:", "#", "/")) \
+        and ":" not in _splitURL(url)[0]
+
+
+def _rebaseStyle(style: str, styleDirectory: str):
+    # Rewrites the relative URLs of a stylesheet in styleDirectory so they
+    # work from the library's root directory.
+    if not styleDirectory:
+        return style
+
+    def rebase(match):
+        url = match.group("url").strip()
+        if not _isRelativeURL(url):
+            return match.group(0)
+        path, suffix = _splitURL(url)
+        return "url({0}{1}{2}{0})".format(
+            match.group("quote"),
+            posixpath.normpath(posixpath.join(styleDirectory, path)), suffix)
+    return _cssURLPattern.sub(rebase, style)
+
+
+def _fontEntryFormat(entry: str):
+    match = _fontFormatPattern.search(entry)
+    if match:
+        return match.group("format").lower()
+    match = _cssURLPattern.search(entry)
+    if match:
+        return posixpath.splitext(_splitURL(match.group("url"))[0])[1][
+            1:].lower()
+    return None
+
+
+def _pruneFontFormats(style: str, droppedURLs: set):
+    # Drops every font of a @font-face rule that isn't a web font format,
+    # when it has one, and adds the URLs of the dropped fonts to
+    # droppedURLs.
+
+    def pruneFontFace(fontFaceMatch):
+        fontFace = fontFaceMatch.group(0)
+        if not any(_fontEntryFormat(entry) in _webFontFormats
+                   for entry in _fontSourceEntryPattern.findall(fontFace)):
+            return fontFace
+
+        def pruneSources(sourceMatch):
+            keptEntries = []
+            for entry in _fontSourceEntryPattern.findall(
+                    sourceMatch.group("sources")):
+                if entry.lower().startswith("local(") \
+                        or _fontEntryFormat(entry) in _webFontFormats:
+                    keptEntries.append(entry)
+                    continue
+                droppedURLs.update(match.group("url").strip()
+                                   for match in _cssURLPattern.finditer(
+                                       entry))
+            if not keptEntries:
+                # Like the src: url(x.eot) declaration for old IE.
+                return ""
+            return "src: {};".format(", ".join(keptEntries))
+        return _fontSourcePattern.sub(pruneSources, fontFace)
+    return _fontFacePattern.sub(pruneFontFace, style)
+
+
+class LibraryBundler:
+    """
+    Minifies and concatenates each library's preloaded scripts and styles
+    into one file each, so players load a library with at most two
+    requests instead of one per file. Fonts only old browsers can use are
+    dropped along with their @font-face sources, and library.json is
+    rewritten to match. Its patch version is bumped too, so sites that
+    already have the unbundled library install the bundled one over it
+    rather than keeping theirs, whose files the bundled library.json
+    doesn't list.
+
+    Scripts and styles are minified with rjsmin and rcssmin when they're
+    installed and only concatenated otherwise. Bundled libraries are kept
+    as directories in bundlesDirectoryPath and only bundled again when one
+    of their files changes.
+    """
+
+    bundlesDirectoryPath: str
+    # Library directory name -> (bytes, bundled bytes, requests, bundled
+    # requests) of every library bundled or looked up.
+    statistics: dict
+
+    def __init__(self, bundlesDirectoryPath: str):
+        self.bundlesDirectoryPath = bundlesDirectoryPath
+        self.statistics = {}
+
+    @staticmethod
+    def _preloadedRequests(libraryFilePath: str):
+        with open(libraryFilePath, "r", encoding="utf-8") as libraryFile:
+            library = json.loads(libraryFile.read())
+        return len(library.get("preloadedJs", [])) \
+            + len(library.get("preloadedCss", []))
+
+    def bundle(self, libraryDirectoryPath: str):
+        """
+        Returns the path of the bundled copy of a library directory, or of
+        the directory itself when it can't be bundled.
+        """
+        directoryName = os.path.basename(os.path.normpath(
+            libraryDirectoryPath))
+        filePaths = listLibraryFiles(libraryDirectoryPath)
+        if "library.json" not in filePaths:
+            return libraryDirectoryPath
+        key = BuildCache.key(_libraryBundleVersion, rjsmin is not None,
+                             LibraryResolver._fingerprint(filePaths))
+        bundleDirectoryPath = os.path.join(self.bundlesDirectoryPath,
+                                           key[:24], directoryName)
+        if not os.path.isdir(bundleDirectoryPath):
+            with tracer.span("bundleLibrary", library=directoryName):
+                if not self._bundle(filePaths, bundleDirectoryPath):
+                    return libraryDirectoryPath
+        bundledFilePaths = listLibraryFiles(bundleDirectoryPath)
+        self.statistics[directoryName] = (
+            sum(os.path.getsize(filePath)
+                for filePath in filePaths.values()),
+            sum(os.path.getsize(filePath)
+                for filePath in bundledFilePaths.values()),
+            self._preloadedRequests(filePaths["library.json"]),
+            self._preloadedRequests(bundledFilePaths["library.json"])
+        )
+        return bundleDirectoryPath
+
+    @staticmethod
+    def _bundle(filePaths: dict, bundleDirectoryPath: str):
+        # Writes the bundled library and returns whether it could be.
+        with open(filePaths["library.json"], "r",
+                  encoding="utf-8") as libraryFile:
+            library = json.loads(libraryFile.read())
+        scripts = [entry["path"] for entry in library.get("preloadedJs", [])]
+        styles = [entry["path"] for entry in library.get("preloadedCss", [])]
+        if any(path not in filePaths for path in scripts + styles) \
+                or _bundledScriptName in filePaths \
+                or _bundledStyleName in filePaths:
+            # Libraries that don't ship the files they list are left alone.
+            return False
+
+        def read(path: str):
+            with open(filePaths[path], "r", encoding="utf-8") as sourceFile:
+                return sourceFile.read().lstrip("\ufeff")
+
+        # Path relative to the library -> contents of the generated files.
+        bundledFiles = {}
+        if scripts:
+            # The semicolons keep files that don't end in one from running
+            # into the next.
+            bundledFiles[_bundledScriptName] = ";\n".join(
+                rjsmin.jsmin(read(path), keep_bang_comments=True) if rjsmin
+                else read(path) for path in scripts)
+            library["preloadedJs"] = [{"path": _bundledScriptName}]
+        droppedURLs = set()
+        if styles:
+            bundledStyles = []
+            for path in styles:
+                style = _pruneFontFormats(
+                    _rebaseStyle(read(path), posixpath.dirname(path)),
+                    droppedURLs)
+                bundledStyles.append(
+                    rcssmin.cssmin(style, keep_bang_comments=True)
+                    if rcssmin else style)
+            bundledFiles[_bundledStyleName] = "\n".join(bundledStyles)
+            library["preloadedCss"] = [{"path": _bundledStyleName}]
+        library["patchVersion"] = library.get("patchVersion", 0) + 1
+        bundledFiles["library.json"] = json.dumps(library, indent=2)
+
+        droppedPaths = set(scripts + styles)
+        # Fonts are only dropped when nothing else refers to them.
+        bundledText = "".join(bundledFiles.values())
+        for url in droppedURLs:
+            path = posixpath.normpath(_splitURL(url)[0])
+            if path in filePaths and posixpath.basename(path) \
+                    not in bundledText:
+                droppedPaths.add(path)
+
+        partialDirectoryPath = "{}.{}.partial".format(bundleDirectoryPath,
+                                                      os.getpid())
+        shutil.rmtree(partialDirectoryPath, ignore_errors=True)
+        for path, filePath in filePaths.items():
+            if path in droppedPaths or path in bundledFiles:
+                continue
+            destinationFilePath = os.path.join(partialDirectoryPath, path)
+            os.makedirs(os.path.dirname(destinationFilePath), exist_ok=True)
+            cloneFile(filePath, destinationFilePath)
+        for path, contents in bundledFiles.items():
+            destinationFilePath = os.path.join(partialDirectoryPath, path)
+            os.makedirs(os.path.dirname(destinationFilePath), exist_ok=True)
+            with open(destinationFilePath, "w",
+                      encoding="utf-8") as bundledFile:
+                bundledFile.write(contents)
+        try:
+            os.rename(partialDirectoryPath, bundleDirectoryPath)
+        except OSError:
+            # Another build bundled the same library first.
+            shutil.rmtree(partialDirectoryPath, ignore_errors=True)
+            if not os.path.isdir(bundleDirectoryPath):
+                raise
+        return True
+
+    def describe(self):
+        # What bundling saved across every library bundled or looked up.
+        statistics = list(self.statistics.values())
+        bytesBefore = sum(entry[0] for entry in statistics)
+        bytesAfter = sum(entry[1] for entry in statistics)
+        return "{} libraries went from {:.1f} MB to {:.1f} MB ({:.0f}% " \
+               "smaller) and from {} to {} script and style " \
+               "requests{}".format(
+                   len(statistics), bytesBefore / 1024 ** 2,
+                   bytesAfter / 1024 ** 2,
+                   100 * (1 - bytesAfter / bytesBefore) if bytesBefore
+                   else 0,
+                   sum(entry[2] for entry in statistics),
+                   sum(entry[3] for entry in statistics),
+                   "" if rjsmin else ", without minifying as rjsmin and "
+                                     "rcssmin aren't installed")
+
+
+def _compressEntries(files: list):
+    # Deflates library files exactly like ZipFile.write would and returns
+    # them as one blob: a JSON index line followed by the compressed data of
+    # every file, back to back.
+    index = []
+    compressedData = []
+    for filePath, archiveName in files:
+        zipInfo = zipfile.ZipInfo.from_file(filePath, archiveName)
+        with open(filePath, "rb") as libraryFile:
+            data = libraryFile.read()
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
+                                      zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        index.append([archiveName, list(zipInfo.date_time),
+                      zipInfo.external_attr, zlib.crc32(data),
+                      len(compressed), len(data)])
+        compressedData.append(compressed)
+    return json.dumps(index).encode() + b"\n" + b"".join(compressedData)
+
+
+def _iterCompressedEntries(entries: bytes):
+    # Reverses _compressEntries, yielding a ZipInfo and compressed data per
+    # file.
+    indexLine, _, compressedData = entries.partition(b"\n")
+    offset = 0
+    for archiveName, dateTime, externalAttr, crc, compressSize, fileSize \
+            in json.loads(indexLine):
+        zipInfo = zipfile.ZipInfo(archiveName, tuple(dateTime))
+        zipInfo.external_attr = externalAttr
+        zipInfo.compress_type = zipfile.ZIP_DEFLATED
+        zipInfo.CRC = crc
+        zipInfo.compress_size = compressSize
+        zipInfo.file_size = fileSize
+        yield zipInfo, compressedData[offset:offset + compressSize]
+        offset += compressSize
+
+
+# The ZipFile internals _writeCompressedEntry splices entries in with.
+_zipFileInternals = ("_lock", "_seekable", "_writing", "_writecheck",
+                     "_didModify", "fp", "start_dir", "filelist",
+                     "NameToInfo")
+
+
+def _canSpliceEntries(package: zipfile.ZipFile, zipInfo: zipfile.ZipInfo):
+    # Whether this zipfile has the internals the splice needs, and the entry
+    # is one the splice's local header can describe.
+    return all(hasattr(package, name) for name in _zipFileInternals) \
+        and hasattr(zipInfo, "FileHeader") and not package._writing \
+        and max(zipInfo.file_size, zipInfo.compress_size) < zipfile.ZIP64_LIMIT
+
+
+def _writeCompressedEntry(package: zipfile.ZipFile, zipInfo: zipfile.ZipInfo,
+                          compressedData: bytes):
+    # zipfile can't add data that's already compressed, so this does what
+    # ZipFile.write does minus the compression: the local header, the data,
+    # and the record the central directory is written from on close. Where
+    # zipfile's internals differ, the data is inflated and written through
+    # ZipFile.open instead, which compresses it again.
+    if not _canSpliceEntries(package, zipInfo):
+        with package.open(zipInfo, "w") as entry:
+            entry.write(zlib.decompress(compressedData, -15))
+        return
+    with package._lock:
+        if package._seekable:
+            package.fp.seek(package.start_dir)
+        zipInfo.header_offset = package.fp.tell()
+        package._writecheck(zipInfo)
+        package._didModify = True
+        package.fp.write(zipInfo.FileHeader(False))
+        package.fp.write(compressedData)
+        package.start_dir = package.fp.tell()
+        package.filelist.append(zipInfo)
+        package.NameToInfo[zipInfo.filename] = zipInfo
+
+
+# Take care of the json things and everything.
+class H5P:
+    contentTemplatePath: str
+    interactionTemplatePath: str
+    h5pMetaDataTemplatePath: str
+    outputsDirectoryPath: str
+    # A path or URL, or a list of (path, label) pairs of alternative
+    # renditions.
+    videoSource: object
+    packageTemplateDirectoryPath: str
+    libraryResolver: LibraryResolver
+    buildCache: "BuildCache"
+    validateContent: bool
+    libraryBundler: LibraryBundler
+
+    def __init__(self, contentTemplatePath: str, interactionTemplatePath: str,
+                 h5pMetaDataTemplatePath: str, outputsDirectoryPath: str,
+                 videoSource, packageTemplateDirectoryPath: str = None,
+                 libraryResolver: LibraryResolver = None,
+                 buildCache: "BuildCache" = None,
+                 validateContent: bool = False,
+                 libraryBundler: LibraryBundler = None):
+        self.contentTemplatePath = contentTemplatePath
+        self.interactionTemplatePath = interactionTemplatePath
+        self.h5pMetaDataTemplatePath = h5pMetaDataTemplatePath
+        self.outputsDirectoryPath = outputsDirectoryPath
+        self.videoSource = videoSource
+        # Directory holding the libraries that get packaged with the content.
+        self.packageTemplateDirectoryPath = packageTemplateDirectoryPath
+        # Decides which of the template's libraries go into packages. Every
+        # library is packaged when there's no resolver.
+        self.libraryResolver = libraryResolver
+        # Libraries' files are only compressed once and then copied into
+        # packages from here, already compressed.
+        self.buildCache = buildCache
+        # Checks content.json against the packaged libraries' semantics
+        # while it's written.
+        self.validateContent = validateContent
+        # Libraries are packaged from their bundled copies, when given.
+        self.libraryBundler = libraryBundler
+
+    def _semanticsValidator(self):
+        if not self.validateContent:
+            return None
+        mainLibrary = mainLibraryOf(
+            templateRegistry.load(self.h5pMetaDataTemplatePath))
+        if mainLibrary is None:
+            raise LibraryError(
+                "{} doesn't list the version of its main library.".format(
+                    self.h5pMetaDataTemplatePath))
+        return SemanticsValidator(self.packageTemplateDirectoryPath,
+                                  mainLibrary)
+
+    def _resolveLibraries(self, h5pMetaDataDict: dict,
+                          contentLibraries: set):
+        # Starting from the main library and the libraries the content uses,
+        # and rewriting h5p.json so it only lists what's packaged.
+        dependencies = h5pMetaDataDict.get("preloadedDependencies", [])
+        rootLibraries = [
+            libraryDirectoryName(dependency["machineName"],
+                                 dependency["majorVersion"],
+                                 dependency["minorVersion"])
+            for dependency in dependencies
+            if dependency["machineName"] == h5pMetaDataDict.get("mainLibrary")
+        ]
+        rootLibraries.extend(contentLibraries)
+        libraries = self.libraryResolver.resolve(rootLibraries)
+
+        packagedDependencies = [
+            dependency for dependency in dependencies
+            if libraryDirectoryName(dependency["machineName"],
+                                    dependency["majorVersion"],
+                                    dependency["minorVersion"]) in libraries
+        ]
+        listedLibraries = {libraryDirectoryName(dependency["machineName"],
+                                                dependency["majorVersion"],
+                                                dependency["minorVersion"])
+                           for dependency in packagedDependencies}
+        for directoryName in sorted(libraries - listedLibraries):
+            machineName, _, version = directoryName.rpartition("-")
+            majorVersion, _, minorVersion = version.partition(".")
+            packagedDependencies.append({
+                "machineName": machineName,
+                "majorVersion": int(majorVersion),
+                "minorVersion": int(minorVersion)
+            })
+        h5pMetaDataDict["preloadedDependencies"] = packagedDependencies
+        return libraries
+
+    def _libraryDirectoryPath(self, directoryName: str):
+        libraryDirectoryPath = os.path.join(
+            self.packageTemplateDirectoryPath, directoryName)
+        if self.libraryBundler:
+            return self.libraryBundler.bundle(libraryDirectoryPath)
+        return libraryDirectoryPath
+
+    def _iterLibraryFiles(self, libraries: set = None):
+        # Everything in the package template, or only the given library
+        # directories, except its own h5p.json and content, which are
+        # generated. Sorted so packages are reproducible.
+        directoryNames = []
+        for name in sorted(os.listdir(self.packageTemplateDirectoryPath)):
+            filePath = os.path.join(self.packageTemplateDirectoryPath, name)
+            if os.path.isdir(filePath):
+                if name != "content" and (libraries is None
+                                          or name in libraries):
+                    directoryNames.append(name)
+            elif name != "h5p.json":
+                yield filePath, name
+        for directoryName in directoryNames:
+            for relativePath, filePath in listLibraryFiles(
+                    self._libraryDirectoryPath(directoryName)).items():
+                yield filePath, directoryName + "/" + relativePath
+
+    def _packagedVideos(self):
+        # Local videos are stored in the package and referenced relative to
+        # its content directory. URLs are used as they are. Returns the
+        # (file path, path in content) pairs of the videos to store and the
+        # video source for content.json.
+        videoSources = [(self.videoSource, None)] \
+            if isinstance(self.videoSource, str) else self.videoSource
+        storedVideos = []
+        contentVideoSources = []
+        for videoSource, label in videoSources:
+            if os.path.isfile(videoSource):
+                contentVideoSource = "videos/" + os.path.basename(videoSource)
+                storedVideos.append((videoSource, contentVideoSource))
+                videoSource = contentVideoSource
+            contentVideoSources.append((videoSource, label))
+        if isinstance(self.videoSource, str):
+            return storedVideos, contentVideoSources[0][0]
+        return storedVideos, contentVideoSources
+
+    def _compressedEntries(self, directoryName: str, files: list):
+        # A library's files compressed, from the build cache when none of
+        # them changed since they were last compressed.
+        key = self.buildCache.key(
+            directoryName,
+            [[archiveName, self.buildCache.hashFile(filePath)]
+             for filePath, archiveName in files]
+        )
+        entries = self.buildCache.get("libraryEntries", key)
+        if entries is None:
+            with tracer.span("deflateLibrary", library=directoryName):
+                entries = _compressEntries(files)
+            self.buildCache.put("libraryEntries", key, entries)
+        return _iterCompressedEntries(entries)
+
+    def _writePackage(self, packageFile, content: Content,
+                      h5pMetaData: H5PMetaData):
+        storedVideos, videoSource = self._packagedVideos()
+        with zipfile.ZipFile(packageFile, "w",
+                             compression=zipfile.ZIP_DEFLATED) as package:
+            # content.json is streamed into the archive first because
+            # h5p.json depends on the libraries it turns out to use.
+            with tracer.span("writeContentJSON"), \
+                    package.open("content/content.json", "w") as contentMember, \
+                    io.TextIOWrapper(contentMember,
+                                     encoding="utf-8") as contentFile:
+                contentLibraries = content.writeJSON(
+                    outputFile=contentFile,
+                    contentTemplatePath=self.contentTemplatePath,
+                    interactionTemplatePath=self.interactionTemplatePath,
+                    videoSource=videoSource,
+                    validator=self._semanticsValidator()
+                )
+            h5pMetaDataDict = h5pMetaData.toDict(
+                self.h5pMetaDataTemplatePath)
+            libraries = None
+            if self.libraryResolver:
+                libraries = self._resolveLibraries(h5pMetaDataDict,
+                                                   contentLibraries)
+            package.writestr("h5p.json", json.dumps(h5pMetaDataDict))
+            for videoFilePath, contentVideoSource in storedVideos:
+                # Videos are already compressed, so they're only stored.
+                with tracer.span("storeVideo",
+                                 bytes=os.path.getsize(videoFilePath)):
+                    package.write(videoFilePath,
+                                  "content/" + contentVideoSource,
+                                  compress_type=zipfile.ZIP_STORED)
+            with tracer.span("compressLibraries") as span:
+                libraryFiles = 0
+                for directoryName, files in itertools.groupby(
+                        self._iterLibraryFiles(libraries),
+                        lambda libraryFile: libraryFile[1].split("/")[0]):
+                    if not self.buildCache:
+                        for filePath, archiveName in files:
+                            package.write(filePath, archiveName)
+                            libraryFiles += 1
+                        continue
+                    for zipInfo, compressedData in self._compressedEntries(
+                            directoryName, list(files)):
+                        _writeCompressedEntry(package, zipInfo,
+                                              compressedData)
+                        libraryFiles += 1
+                span.set(files=libraryFiles)
+
+    def exportDirectory(self, content: Content, h5pMetaData: H5PMetaData,
+                        directoryPath: str, libraryStore: LibraryStore):
+        """
+        Unpacks the package into directoryPath, e.g. for a preview server,
+        with the libraries staged from libraryStore. Files that didn't
+        change are left alone and the rest are swapped in one at a time, so
+        the directory can be served while it's updated. Files an earlier
+        export put there that the package doesn't have anymore are removed.
+        Raises StagingError if directoryPath has files it didn't export.
+        """
+        keptFilePaths = {"h5p.json", "content/content.json"}
+        stagedFilePaths = libraryStore.stagedFilePaths(directoryPath) \
+            | keptFilePaths
+        libraryStore.recordStage(directoryPath, stagedFilePaths)
+        storedVideos, videoSource = self._packagedVideos()
+        contentDirectoryPath = os.path.join(directoryPath, "content")
+        os.makedirs(contentDirectoryPath, exist_ok=True)
+
+        def writeAtomically(filePath: str, write):
+            partialFilePath = "{}.{}.partial".format(filePath, os.getpid())
+            try:
+                with open(partialFilePath, "w",
+                          encoding="utf-8") as outputFile:
+                    result = write(outputFile)
+                os.replace(partialFilePath, filePath)
+            finally:
+                if os.path.exists(partialFilePath):
+                    os.remove(partialFilePath)
+            return result
+
+        with tracer.span("writeContentJSON"):
+            contentLibraries = writeAtomically(
+                os.path.join(contentDirectoryPath, "content.json"),
+                lambda outputFile: content.writeJSON(
+                    outputFile=outputFile,
+                    contentTemplatePath=self.contentTemplatePath,
+                    interactionTemplatePath=self.interactionTemplatePath,
+                    videoSource=videoSource,
+                    validator=self._semanticsValidator()
+                )
+            )
+        h5pMetaDataDict = h5pMetaData.toDict(self.h5pMetaDataTemplatePath)
+        libraries = None
+        if self.libraryResolver:
+            libraries = self._resolveLibraries(h5pMetaDataDict,
+                                               contentLibraries)
+        writeAtomically(os.path.join(directoryPath, "h5p.json"),
+                        lambda outputFile: outputFile.write(
+                            json.dumps(h5pMetaDataDict)))
+
+        with tracer.span("stageLibraries") as span:
+            sourceFilePaths = {}
+            for videoFilePath, contentVideoSource in storedVideos:
+                sourceFilePaths["content/" + contentVideoSource] = \
+                    videoFilePath
+            for directoryName in sorted(os.listdir(
+                    self.packageTemplateDirectoryPath)):
+                templateFilePath = os.path.join(
+                    self.packageTemplateDirectoryPath, directoryName)
+                if directoryName in ("content", "h5p.json"):
+                    continue
+                if os.path.isfile(templateFilePath):
+                    sourceFilePaths[directoryName] = \
+                        libraryStore.objectFilePath(
+                            libraryStore.addFile(templateFilePath))
+                    continue
+                if libraries is not None and directoryName not in libraries:
+                    continue
+                for relativePath, digest in libraryStore.addLibrary(
+                        self._libraryDirectoryPath(directoryName)).items():
+                    sourceFilePaths[directoryName + "/" + relativePath] = \
+                        libraryStore.objectFilePath(digest)
+            replacedFiles = libraryStore.stage(
+                directoryPath, sourceFilePaths, keptFilePaths,
+                stagedFilePaths)
+            span.set(files=len(sourceFilePaths), replacedFiles=replacedFiles)
+
+    # Take data and create json files and from templates and whatnot.
+    def export(self, content: Content, h5pMetaData: H5PMetaData,
+               packageOutput=None):
+        """
+        Writes content.json and h5p.json into outputsDirectoryPath or, when
+        packageOutput is given, streams a complete .h5p package to it in one
+        pass. packageOutput can be a file path or a writable file object.
+        """
+        if packageOutput is None:
+            content.export(
+                outputFileName="content.json",
+                contentTemplatePath=self.contentTemplatePath,
+                interactionTemplatePath=self.interactionTemplatePath,
+                outputsDirectoryPath=self.outputsDirectoryPath,
+                videoSource=self.videoSource
+            )
+            h5pMetaData.export(
+                outputFileName="h5p.json",
+                h5pMetaDataTemplatePath=self.h5pMetaDataTemplatePath,
+                outputsDirectoryPath=self.outputsDirectoryPath
+            )
+            return
+
+        if not isinstance(packageOutput, str):
+            with tracer.span("writePackage"):
+                self._writePackage(packageOutput, content, h5pMetaData)
+            return
+        # Writing next to the destination and moving it into place so a
+        # failed build never leaves a truncated package behind.
+        partialPackagePath = packageOutput + ".partial"
+        try:
+            with tracer.span("writePackage") as span:
+                with open(partialPackagePath, "wb") as packageFile:
+                    self._writePackage(packageFile, content, h5pMetaData)
+                span.set(bytes=os.path.getsize(partialPackagePath))
+            os.replace(partialPackagePath, packageOutput)
+        finally:
+            if os.path.exists(partialPackagePath):
+                os.remove(partialPackagePath)
+
+
+class ConcatMode(Enum):
+    # Decode every frame with moviepy and encode the whole timeline again.
+    REENCODE = 1
+    # Remux the clips' packets as they are, re-encoding only the clips that
+    # don't match the others.
+    STREAM_COPY = 2
+
+
+class VideoProbe:
+    """
+    Stream parameters of a video file, read from its container headers.
+    """
+
+    filename: str
+    duration: float
+    videoCodec: str
+    pixelFormat: str
+    width: int
+    height: int
+    fps: str
+    timeBase: str
+    audioCodec: str
+    audioSampleRate: int
+    audioChannelLayout: str
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.duration = 0.0
+        self.videoCodec = None
+        self.pixelFormat = None
+        self.width = 0
+        self.height = 0
+        self.fps = None
+        self.timeBase = None
+        self.audioCodec = None
+        self.audioSampleRate = 0
+        self.audioChannelLayout = None
+
+    def streamSignature(self):
+        # Clips can only be stream copied into one file when all of these
+        # match.
+        return (self.videoCodec, self.pixelFormat, self.width, self.height,
+                self.fps, self.timeBase, self.audioCodec,
+                self.audioSampleRate, self.audioChannelLayout)
+
+
+class ConcatReport:
+    """
+    Describes how combineVideos produced the output video.
+    """
+
+    mode: ConcatMode
+    outputVideoFilePath: str
+    copiedClips: list
+    reencodedClips: list
+    reason: str
+    segments: int
+    workers: int
+    encodeSeconds: float
+    encodeCPUSeconds: float
+    cachedClips: int
+
+    def __init__(self, mode: ConcatMode, outputVideoFilePath: str,
+                 copiedClips: list = None, reencodedClips: list = None,
+                 reason: str = ""):
+        self.mode = mode
+        self.outputVideoFilePath = outputVideoFilePath
+        self.copiedClips = copiedClips if copiedClips else []
+        self.reencodedClips = reencodedClips if reencodedClips else []
+        self.reason = reason
+        # Filled in when segments are encoded in parallel. encodeSeconds is
+        # the wall time and encodeCPUSeconds the CPU time the encoders used,
+        # or None where that can't be measured.
+        self.segments = 0
+        self.workers = 1
+        self.encodeSeconds = 0.0
+        self.encodeCPUSeconds = None
+        # Re-encoded clips or segments that came from the build cache.
+        self.cachedClips = 0
+
+    @property
+    def parallelEfficiency(self):
+        """
+        The share of the CPUs the encoders kept busy, or None if the CPU
+        time is unknown.
+        """
+        if self.encodeCPUSeconds is None or not self.encodeSeconds:
+            return None
+        return self.encodeCPUSeconds / (self.encodeSeconds
+                                        * (os.cpu_count() or 1))
+
+    def describe(self):
+        if self.mode == ConcatMode.STREAM_COPY:
+            description = "Stream copied {} clip(s), re-encoded {} " \
+                          "mismatched clip(s)".format(
+                              len(self.copiedClips),
+                              len(self.reencodedClips))
+        else:
+            description = "Re-encoded all {} clip(s)".format(
+                len(self.reencodedClips))
+        if self.segments:
+            description += " as {} segment(s) on {} worker(s) in " \
+                           "{:.1f}s".format(self.segments, self.workers,
+                                            self.encodeSeconds)
+            if self.parallelEfficiency is not None:
+                description += " using {:.1f}s of CPU time, {:.0%} of {} " \
+                               "CPU(s)".format(self.encodeCPUSeconds,
+                                               self.parallelEfficiency,
+                                               os.cpu_count() or 1)
+        if self.cachedClips:
+            description += ", {} of them from the build cache".format(
+                self.cachedClips)
+        if self.reason:
+            description += " ({})".format(self.reason)
+        return "{} into {}".format(description, self.outputVideoFilePath)
+
+
+_durationPattern = re.compile(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)")
+_videoStreamPattern = re.compile(
+    r"Stream #\d+:\d+.*?: Video: (?P<codec>\w+)[^,]*, "
+    r"(?P<pixelFormat>\w+)(?:\([^)]*\))?, (?P<width>\d+)x(?P<height>\d+)"
+    r"(?:.*?, (?P<fps>[\d.]+k?) fps)?(?:.*?, (?P<timeBase>[\d.]+k?) tbn)?"
+)
+_audioStreamPattern = re.compile(
+    r"Stream #\d+:\d+.*?: Audio: (?P<codec>\w+)[^,]*, "
+    r"(?P<sampleRate>\d+) Hz, (?P<channelLayout>[^,]+)"
+)
+
+# Codecs the mp4 muxer takes as they are and the encoders used to conform
+# mismatched clips to them.
+_mp4VideoEncoders = {
+    "h264": "libx264",
+    "hevc": "libx265",
+    "mpeg4": "mpeg4"
+}
+_mp4AudioEncoders = {
+    "aac": "aac",
+    "mp3": "libmp3lame"
+}
+
+
+def _ffmpegBinary():
+    # Same ffmpeg moviepy uses, so there's nothing extra to install.
+    from moviepy.config import get_setting
+    return get_setting("FFMPEG_BINARY")
+
+
+def _runFFmpeg(arguments: list):
+    completedProcess = subprocess.run(
+        [_ffmpegBinary(), "-hide_banner", "-loglevel", "error", "-y"]
+        + arguments,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE
+    )
+    if completedProcess.returncode != 0:
+        raise RuntimeError("ffmpeg failed: {}".format(
+            completedProcess.stderr.decode(errors="replace").strip()))
+
+
+def _rateArgument(rate: str):
+    # ffmpeg prints large rates like 90000 as "90k".
+    if rate.endswith("k"):
+        return str(int(float(rate[:-1]) * 1000))
+    return rate
+
+
+def probeVideo(videoFilePath: str):
+    """
+    Reads the duration and stream parameters of a video from its container
+    headers without decoding anything.
+    """
+    # "ffmpeg -i" with no output prints the input's headers and exits.
+    completedProcess = subprocess.run(
+        [_ffmpegBinary(), "-hide_banner", "-i", videoFilePath],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE
+    )
+    headers = completedProcess.stderr.decode(errors="replace")
+    probe = VideoProbe(videoFilePath)
+    match = _durationPattern.search(headers)
+    if not match:
+        raise RuntimeError("Couldn't read the headers of {}.".format(
+            videoFilePath))
+    hours, minutes, seconds = match.groups()
+    probe.duration = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    match = _videoStreamPattern.search(headers)
+    if match:
+        probe.videoCodec = match.group("codec")
+        probe.pixelFormat = match.group("pixelFormat")
+        probe.width = int(match.group("width"))
+        probe.height = int(match.group("height"))
+        probe.fps = match.group("fps")
+        probe.timeBase = match.group("timeBase")
+    match = _audioStreamPattern.search(headers)
+    if match:
+        probe.audioCodec = match.group("codec")
+        probe.audioSampleRate = int(match.group("sampleRate"))
+        probe.audioChannelLayout = match.group("channelLayout").strip()
+    return probe
+
+
+class KeyframeIndex:
+    """
+    Presentation times, in seconds, of a video's keyframes. Players can only
+    seek straight to a keyframe; anywhere else they have to decode forward
+    from the keyframe before it first.
+    """
+
+    times: list
+
+    def __init__(self, times: list):
+        self.times = sorted(times)
+
+    def snap(self, time: float, maxShift: float, latest: float = None):
+        # Returns the keyframe closest to time, or time itself when there's
+        # none within maxShift of it. Keyframes after latest are skipped.
+        times = self.times if latest is None \
+            else self.times[:bisect.bisect_right(self.times, latest)]
+        index = bisect.bisect_left(times, time)
+        candidates = times[max(0, index - 1):index + 1]
+        if not candidates:
+            return time
+        keyframeTime = min(candidates,
+                           key=lambda candidate: abs(candidate - time))
+        return keyframeTime if abs(keyframeTime - time) <= maxShift \
+            else time
+
+
+_timeBasePattern = re.compile(r"#tb 0: (\d+)/(\d+)")
+
+
+def readKeyframeIndex(videoFilePath: str):
+    """
+    Returns the KeyframeIndex of a video's first video stream. Only the
+    packets are read, nothing is decoded.
+    """
+    # framecrc prints a line per packet and adds "F=<flags>" to every one
+    # that isn't just a keyframe.
+    process = subprocess.Popen(
+        [_ffmpegBinary(), "-hide_banner", "-loglevel", "error",
+         "-i", videoFilePath, "-map", "0:v:0", "-c", "copy",
+         "-f", "framecrc", "-"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL
+    )
+    timeBase = None
+    times = []
+    with process.stdout:
+        for line in process.stdout:
+            line = line.decode()
+            if line.startswith("#"):
+                match = _timeBasePattern.match(line)
+                if match:
+                    timeBase = int(match.group(1)) / int(match.group(2))
+                continue
+            fields = [field.strip() for field in line.split(",")]
+            flags = 1
+            if fields[-1].startswith("F="):
+                flags = int(fields[-1][2:], 16)
+            if flags & 1 and timeBase and fields[2].lstrip("-").isdigit():
+                times.append(round(int(fields[2]) * timeBase, 3))
+    if process.wait() != 0 or timeBase is None:
+        raise RuntimeError("Couldn't read the packets of {}.".format(
+            videoFilePath))
+    return KeyframeIndex(times)
+
+
+class VideoReaderPool:
+    """
+    Hands out moviepy readers for video files, keeping at most
+    maxOpenClips of them open at a time.
+
+    Clips are opened the first time frames are needed from them and the
+    least recently used ones are closed, along with their ffmpeg processes,
+    once there are too many. A closed clip is simply reopened if it's needed
+    again later.
+    """
+
+    maxOpenClips: int
+    _clips: OrderedDict
+
+    def __init__(self, maxOpenClips: int = 4):
+        self.maxOpenClips = max(1, maxOpenClips)
+        self._clips = OrderedDict()
+
+    def clip(self, filename: str):
+        clip = self._clips.get(filename)
+        if clip is not None:
+            self._clips.move_to_end(filename)
+            return clip
+        clip = VideoFileClip(filename)
+        self._clips[filename] = clip
+        while len(self._clips) > self.maxOpenClips:
+            _, leastRecentlyUsedClip = self._clips.popitem(last=False)
+            leastRecentlyUsedClip.close()
+        return clip
+
+    def close(self):
+        while self._clips:
+            _, clip = self._clips.popitem()
+            clip.close()
+
+
+# Used by combineVideos unless it's given a pool of its own.
+videoReaderPool = VideoReaderPool()
+
+
+def openPooledClip(probe: VideoProbe, readerPool: VideoReaderPool = None):
+    """
+    Returns a moviepy clip for a probed video that only borrows a real
+    reader from the pool while frames are being read from it.
+    """
+    readerPool = readerPool if readerPool else videoReaderPool
+    filename = probe.filename
+
+    # Building the clips by hand because passing make_frame to the
+    # constructors reads the first frame straight away.
+    clip = VideoClip()
+    clip.make_frame = lambda t: readerPool.clip(filename).get_frame(t)
+    clip.size = (probe.width, probe.height)
+    clip.fps = float(_rateArgument(probe.fps)) if probe.fps else None
+    clip.duration = clip.end = probe.duration
+    if probe.audioCodec:
+        audio = AudioClip()
+        audio.make_frame = lambda t: readerPool.clip(
+            filename).audio.get_frame(t)
+        # moviepy always reads audio as 44.1 kHz stereo.
+        audio.fps = 44100
+        audio.nchannels = 2
+        audio.duration = audio.end = probe.duration
+        clip.audio = audio
+    return clip
+
+
+def importVideos(inputVideoType,
+                 videosDirectoryPath
+                 ):
+    # Only the container headers are read here. Nothing is decoded until
+    # combineVideos actually needs frames.
+    videoFileNames = glob.glob(
+        os.path.join(
+            videosDirectoryPath,
+            "*." + inputVideoType
+        )
+    )
+    videoFileNames.sort()
+    videos = []
+    with tracer.span("importVideos", clips=len(videoFileNames)):
+        for videoFileName in videoFileNames:
+            with tracer.span("probeVideo",
+                             clip=os.path.basename(videoFileName)):
+                video = probeVideo(videoFileName)
+            videos.append(video)
+    return videos
+
+
+def _conformArguments(probe: VideoProbe, reference: VideoProbe,
+                      outputVideoFilePath: str):
+    # Re-encodes a clip with the reference clip's stream parameters so its
+    # packets can be concatenated with the reference's.
+    arguments = ["-i", probe.filename]
+    if reference.audioCodec and not probe.audioCodec:
+        # Filling in silence so every clip has the same streams.
+        arguments += [
+            "-f", "lavfi", "-i",
+            "anullsrc=r={}:cl={}".format(reference.audioSampleRate,
+                                         reference.audioChannelLayout),
+            "-shortest"
+        ]
+    arguments += [
+        "-map", "0:v:0",
+        "-vf", "scale={}:{},fps={},format={}".format(
+            reference.width, reference.height,
+            _rateArgument(reference.fps), reference.pixelFormat),
+        "-c:v", _mp4VideoEncoders[reference.videoCodec]
+    ]
+    if reference.timeBase:
+        arguments += ["-video_track_timescale",
+                      _rateArgument(reference.timeBase)]
+    if reference.audioCodec:
+        arguments += [
+            "-map", "1:a:0" if not probe.audioCodec else "0:a:0",
+            "-c:a", _mp4AudioEncoders[reference.audioCodec],
+            "-ar", str(reference.audioSampleRate),
+            "-ac", "1" if reference.audioChannelLayout == "mono" else "2"
+        ]
+    else:
+        arguments += ["-an"]
+    return arguments + [outputVideoFilePath]
+
+
+def _concatenateByStreamCopy(videoFilePaths: list, outputVideoFilePath: str,
+                             workingDirectoryPath: str):
+    # The concat demuxer reads the packets of each file in turn, so nothing
+    # gets decoded.
+    listFilePath = os.path.join(workingDirectoryPath, "concat.txt")
+    with open(listFilePath, "w") as listFile:
+        for videoFilePath in videoFilePaths:
+            listFile.write("file '{}'\n".format(
+                os.path.abspath(videoFilePath).replace("'", "'\\''")))
+    _runFFmpeg(["-f", "concat", "-safe", "0", "-i", listFilePath,
+                "-c", "copy"] + _fastStartArguments + [outputVideoFilePath])
+
+
+# Puts the moov atom at the start of mp4 files so players can start before
+# the whole file is downloaded.
+_fastStartArguments = ["-movflags", "+faststart"]
+
+
+def _clipEnds(videos: list):
+    # Where every clip ends in the combined video, which is where
+    # interactions can be placed.
+    return list(itertools.accumulate(video.duration for video in videos))
+
+
+def _keyframeTimes(times: list, duration: float, fps: float = None,
+                   atEnd: bool = True):
+    # The times, out of the given ones, to force keyframes at in a video of
+    # duration seconds. Encoders only force them on frames starting at or
+    # after a time, so a time at the very end is moved onto the last frame,
+    # unless atEnd is off because whatever comes next starts with one.
+    lastFrameTime = duration - 1.5 / fps if fps else duration
+    keyframeTimes = set()
+    for time in times:
+        if time <= 0 or time > duration + 0.001:
+            continue
+        if time >= duration - 0.001 and not atEnd:
+            continue
+        keyframeTimes.add(round(float(min(time, lastFrameTime)), 6))
+    return sorted(keyframeTime for keyframeTime in keyframeTimes
+                  if keyframeTime > 0)
+
+
+def _keyframeArguments(times: list):
+    # Makes the encoder start a new GOP at each of the times.
+    if not times:
+        return []
+    return ["-force_key_frames", ",".join(repr(time) for time in times)]
+
+
+# Encoder settings shared by every re-encoded segment, so the segments can
+# be joined by stream copy afterwards.
+_segmentVideoArguments = ["-c:v", "libx264", "-preset", "medium",
+                          "-crf", "23", "-pix_fmt", "yuv420p",
+                          "-video_track_timescale", "90000"]
+_segmentAudioArguments = ["-c:a", "aac", "-b:a", "128k", "-ar", "44100",
+                          "-ac", "2"]
+
+
+def _timedFFmpeg(arguments: list, spanName: str = "encodeSegment"):
+    startTime = time.perf_counter()
+    with tracer.span(spanName, output=os.path.basename(arguments[-1])):
+        _runFFmpeg(arguments)
+    return time.perf_counter() - startTime
+
+
+def _encodingKey(buildCache: "BuildCache", arguments: list):
+    # An ffmpeg job's cache key, made from its input's contents rather than
+    # its path and everything but its output.
+    inputFilePath = arguments[arguments.index("-i") + 1]
+    return buildCache.key(buildCache.hashFile(inputFilePath),
+                          [argument for argument in arguments[:-1]
+                           if argument != inputFilePath])
+
+
+def _runCachedFFmpegJobs(jobs: list, workers: int, stage: str,
+                         buildCache: "BuildCache" = None,
+                         spanName: str = "encodeSegment"):
+    # Runs the jobs whose outputs aren't in the build cache yet and caches
+    # them. Returns the run times of the jobs that ran and how many came
+    # from the cache.
+    if not buildCache:
+        return _runFFmpegJobs(jobs, workers, spanName), 0
+    keys = [_encodingKey(buildCache, arguments) for arguments in jobs]
+    missingJobs = [(key, arguments) for key, arguments in zip(keys, jobs)
+                   if not buildCache.getFile(stage, key, arguments[-1])]
+    seconds = _runFFmpegJobs([arguments for _, arguments in missingJobs],
+                             workers, spanName)
+    for key, arguments in missingJobs:
+        buildCache.putFile(stage, key, arguments[-1])
+    return seconds, len(jobs) - len(missingJobs)
+
+
+def _childCPUSeconds():
+    # CPU time used by the finished child processes, like ffmpeg, or None
+    # where that can't be measured.
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _encodeWorkerCount(encodeWorkers: int = None):
+    # The number of encoders run at once when encodeWorkers isn't given.
+    return encodeWorkers if encodeWorkers else os.cpu_count() or 1
+
+
+def _runFFmpegJobs(jobs: list, workers: int,
+                   spanName: str = "encodeSegment"):
+    # Each job is its own ffmpeg process, so threads are enough to keep
+    # `workers` of them running at once. Returns every job's run time.
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers) as executor:
+        return list(executor.map(
+            lambda arguments: _timedFFmpeg(arguments, spanName), jobs))
+
+
+def _segmentJobs(probes: list, chunkSeconds: float, workers: int,
+                 workingDirectoryPath: str, keyframeTimes: list = ()):
+    # Every clip, or every chunkSeconds long piece of a clip, becomes one
+    # job encoding it with the same size, frame rate and encoder settings.
+    # Segments start with a keyframe, and keyframes are forced at the
+    # keyframeTimes of the combined video that fall inside them.
+    width, height = probes[0].width, probes[0].height
+    fps = max(float(_rateArgument(probe.fps)) for probe in probes
+              if probe.fps)
+    hasAudio = any(probe.audioCodec for probe in probes)
+    # Splitting the CPUs between the encoders running at the same time.
+    threads = max(1, (os.cpu_count() or 1) // workers)
+
+    jobs = []
+    segmentFilePaths = []
+    clipStartTime = 0.0
+    for probeIndex, probe in enumerate(probes):
+        startTime = 0.0
+        while True:
+            duration = probe.duration - startTime
+            if chunkSeconds:
+                duration = min(duration, chunkSeconds)
+            segmentFilePath = os.path.join(
+                workingDirectoryPath,
+                "segment{:06d}.mp4".format(len(segmentFilePaths))
+            )
+            arguments = ["-ss", repr(startTime), "-i", probe.filename]
+            if hasAudio and not probe.audioCodec:
+                arguments += ["-f", "lavfi",
+                              "-i", "anullsrc=r=44100:cl=stereo"]
+            # Cutting the output rather than the input so the chunk ends
+            # exactly on time after the frame rate conversion.
+            arguments += [
+                "-t", repr(duration),
+                "-map", "0:v:0",
+                "-vf", "scale={}:{},setsar=1,fps={}".format(width, height,
+                                                           repr(fps)),
+                "-threads", str(threads)
+            ] + _segmentVideoArguments + _keyframeArguments(_keyframeTimes(
+                [time - clipStartTime - startTime for time in keyframeTimes],
+                duration, fps,
+                atEnd=probeIndex == len(probes) - 1
+                and probe.duration - startTime - duration < 0.001))
+            if hasAudio:
+                arguments += ["-map",
+                              "0:a:0" if probe.audioCodec else "1:a:0"]
+                arguments += _segmentAudioArguments
+            else:
+                arguments += ["-an"]
+            jobs.append(arguments + [segmentFilePath])
+            segmentFilePaths.append(segmentFilePath)
+            startTime += duration
+            if probe.duration - startTime < 0.001:
+                break
+        clipStartTime += probe.duration
+    return jobs, segmentFilePaths
+
+
+def _encodeSegmentsInParallel(probes: list, outputVideoFilePath: str,
+                              outputsDirectoryPath: str, workers: int,
+                              chunkSeconds: float,
+                              buildCache: "BuildCache" = None,
+                              keyframeTimes: list = ()):
+    # Peak memory only depends on the number of workers since each encoder
+    # streams its own segment from disk to disk. Segments of clips that
+    # were encoded the same way before come from the build cache.
+    startTime = time.perf_counter()
+    # Counts every child process that finishes meanwhile, which are only
+    # the encoders unless other builds run in the same process.
+    startCPUSeconds = _childCPUSeconds()
+    with tempfile.TemporaryDirectory(
+            dir=outputsDirectoryPath) as workingDirectoryPath:
+        jobs, segmentFilePaths = _segmentJobs(probes, chunkSeconds, workers,
+                                              workingDirectoryPath,
+                                              keyframeTimes)
+        _, cachedSegments = _runCachedFFmpegJobs(jobs, workers, "segment",
+                                                 buildCache)
+        endCPUSeconds = _childCPUSeconds()
+        with tracer.span("concatenateByStreamCopy"):
+            _concatenateByStreamCopy(segmentFilePaths, outputVideoFilePath,
+                                     workingDirectoryPath)
+    report = ConcatReport(ConcatMode.REENCODE, outputVideoFilePath,
+                          reencodedClips=[probe.filename for probe in probes])
+    report.segments = len(jobs)
+    report.workers = workers
+    report.encodeSeconds = time.perf_counter() - startTime
+    if startCPUSeconds is not None:
+        report.encodeCPUSeconds = endCPUSeconds - startCPUSeconds
+    report.cachedClips = cachedSegments
+    return report
+
+
+def _probeVideos(videos: list):
+    return [video if isinstance(video, VideoProbe)
+            else probeVideo(video.filename) for video in videos]
+
+
+def _streamCopyVideos(probes: list, outputVideoFilePath: str,
+                      outputsDirectoryPath: str, workers: int = 1,
+                      buildCache: "BuildCache" = None):
+    # Returns a report, or None when the clips can't be stream copied.
+    # The most common stream parameters are the reference everything else
+    # is conformed to, so the fewest clips need re-encoding. Clips conformed
+    # to the same reference before come from the build cache.
+    signatures = [probe.streamSignature() for probe in probes]
+    referenceSignature = max(signatures, key=signatures.count)
+    reference = probes[signatures.index(referenceSignature)]
+    if reference.videoCodec not in _mp4VideoEncoders or (
+            reference.audioCodec
+            and reference.audioCodec not in _mp4AudioEncoders):
+        return None
+
+    copiedClips = []
+    reencodedClips = []
+    with tempfile.TemporaryDirectory(
+            dir=outputsDirectoryPath) as workingDirectoryPath:
+        concatFilePaths = []
+        conformJobs = []
+        for index, probe in enumerate(probes):
+            if probe.streamSignature() == referenceSignature:
+                concatFilePaths.append(probe.filename)
+                copiedClips.append(probe.filename)
+                continue
+            conformedFilePath = os.path.join(workingDirectoryPath,
+                                             "{}.mp4".format(index))
+            conformJobs.append(_conformArguments(probe, reference,
+                                                 conformedFilePath))
+            concatFilePaths.append(conformedFilePath)
+            reencodedClips.append(probe.filename)
+        _, cachedClips = _runCachedFFmpegJobs(conformJobs, workers,
+                                              "conformedClip", buildCache,
+                                              spanName="conformClip")
+        with tracer.span("concatenateByStreamCopy"):
+            _concatenateByStreamCopy(concatFilePaths, outputVideoFilePath,
+                                     workingDirectoryPath)
+    report = ConcatReport(ConcatMode.STREAM_COPY, outputVideoFilePath,
+                          copiedClips, reencodedClips)
+    report.cachedClips = cachedClips
+    return report
+
+
+def _concatenateVideos(videos, outputVideoFilePath: str,
+                       outputsDirectoryPath: str, concatMode: ConcatMode,
+                       readerPool: VideoReaderPool, encodeWorkers: int,
+                       chunkSeconds: float, buildCache: "BuildCache",
+                       keyframeTimes: list):
+    reason = ""
+    if concatMode == ConcatMode.STREAM_COPY:
+        try:
+            report = _streamCopyVideos(
+                probes=_probeVideos(videos),
+                outputVideoFilePath=outputVideoFilePath,
+                outputsDirectoryPath=outputsDirectoryPath,
+                workers=encodeWorkers,
+                buildCache=buildCache
+            )
+            if report:
+                return report
+            reason = "codecs can't be stream copied into mp4"
+        except RuntimeError as error:
+            reason = "stream copy failed: {}".format(error)
+    if encodeWorkers > 1 and all(isinstance(video, VideoProbe)
+                                 for video in videos):
+        report = _encodeSegmentsInParallel(
+            probes=videos,
+            outputVideoFilePath=outputVideoFilePath,
+            outputsDirectoryPath=outputsDirectoryPath,
+            workers=encodeWorkers,
+            chunkSeconds=chunkSeconds,
+            buildCache=buildCache,
+            keyframeTimes=keyframeTimes
+        )
+        report.reason = reason
+        return report
+    readerPool = readerPool if readerPool else videoReaderPool
+    clips = [openPooledClip(video, readerPool)
+             if isinstance(video, VideoProbe) else video
+             for video in videos]
+    try:
+        with tracer.span("moviepyEncode", clips=len(clips)):
+            finalVideo = concatenate_videoclips(clips)
+            finalVideo.write_videofile(
+                outputVideoFilePath,
+                ffmpeg_params=_fastStartArguments
+                + _keyframeArguments(_keyframeTimes(
+                    keyframeTimes, finalVideo.duration, finalVideo.fps))
+            )
+    finally:
+        readerPool.close()
+    return ConcatReport(ConcatMode.REENCODE, outputVideoFilePath,
+                        reencodedClips=[video.filename for video in videos],
+                        reason=reason)
+
+
+def concatenateVideos(videos,
+                      outputVideoFileName,
+                      outputsDirectoryPath,
+                      concatMode: ConcatMode = ConcatMode.REENCODE,
+                      readerPool: VideoReaderPool = None,
+                      encodeWorkers: int = None,
+                      chunkSeconds: float = 60.0,
+                      buildCache: "BuildCache" = None,
+                      keyframeTimes: list = None
+                      ):
+    """
+    Combines the videos into a single video and returns a ConcatReport
+    saying how it was done.
+
+    videos can be VideoProbes from importVideos or moviepy clips. When
+    re-encoding probes, every clip, split into chunkSeconds long chunks, is
+    encoded by up to encodeWorkers ffmpeg processes at once (defaults to the
+    number of CPUs) and the pieces are joined by stream copy. With one
+    worker, or moviepy clips, the timeline is encoded by moviepy in one go.
+
+    With a buildCache, clips and segments that were re-encoded the same way
+    before aren't encoded again, so changing one clip only re-encodes that
+    clip.
+
+    Re-encoding forces keyframes at keyframeTimes, the times in the
+    combined video interactions start at, which default to the end of
+    every clip. Stream copied clips keep their own keyframes.
+    """
+    encodeWorkers = _encodeWorkerCount(encodeWorkers)
+    if keyframeTimes is None:
+        keyframeTimes = _clipEnds(videos)
+    outputVideoFilePath = os.path.join(
+        outputsDirectoryPath,
+        outputVideoFileName
+    )
+    with tracer.span("concatenateVideos", clips=len(videos)) as span:
+        report = _concatenateVideos(videos, outputVideoFilePath,
+                                    outputsDirectoryPath, concatMode,
+                                    readerPool, encodeWorkers, chunkSeconds,
+                                    buildCache, keyframeTimes)
+        span.set(mode=report.mode.name,
+                 copiedClips=len(report.copiedClips),
+                 reencodedClips=len(report.reencodedClips))
+    return report
+
+
+def combineVideos(videos,
+                  outputVideoFileName,
+                  outputsDirectoryPath,
+                  concatMode: ConcatMode = ConcatMode.REENCODE,
+                  readerPool: VideoReaderPool = None,
+                  encodeWorkers: int = None,
+                  chunkSeconds: float = 60.0,
+                  buildCache: "BuildCache" = None,
+                  keyframeTimes: list = None
+                  ):
+    report = concatenateVideos(
+        videos=videos,
+        outputVideoFileName=outputVideoFileName,
+        outputsDirectoryPath=outputsDirectoryPath,
+        concatMode=concatMode,
+        readerPool=readerPool,
+        encodeWorkers=encodeWorkers,
+        chunkSeconds=chunkSeconds,
+        buildCache=buildCache,
+        keyframeTimes=keyframeTimes
+    )
+    print(report.describe())
+    return report.outputVideoFilePath
+
+
+# Video bitrates in kbit/s of the usual rendition heights. Other heights get
+# one in proportion to their number of pixels.
+_renditionVideoBitrates = {1080: 5000, 720: 2800, 480: 1400, 360: 800,
+                           240: 400}
+
+
+def _renditionJobs(probe: VideoProbe, heights: list, workers: int,
+                   keyframeTimes: list = None):
+    # Returns (height, encoding arguments, output path) for every height
+    # below the video's own, tallest first. The arguments leave out the
+    # input and output so they can key the build cache. Keyframes are
+    # forced at keyframeTimes so every rendition seeks to them as quickly
+    # as the full video.
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    keyframeArguments = _keyframeArguments(_keyframeTimes(
+        keyframeTimes or [], probe.duration,
+        float(_rateArgument(probe.fps)) if probe.fps else None))
+    stem = os.path.splitext(probe.filename)[0]
+    jobs = []
+    for height in sorted(set(heights), reverse=True):
+        if height >= probe.height:
+            continue
+        bitrate = _renditionVideoBitrates.get(
+            height, int(2800 * (height / 720) ** 2))
+        arguments = [
+            "-vf", "scale=-2:{}".format(height),
+            "-c:v", "libx264", "-preset", "medium", "-pix_fmt", "yuv420p",
+            "-b:v", "{}k".format(bitrate),
+            "-maxrate", "{}k".format(bitrate * 3 // 2),
+            "-bufsize", "{}k".format(bitrate * 2),
+            "-threads", str(threads)
+        ] + keyframeArguments
+        if probe.audioCodec:
+            arguments += ["-c:a", "aac", "-b:a", "96k"]
+        else:
+            arguments += ["-an"]
+        jobs.append((height, arguments + _fastStartArguments,
+                     "{}_{}p.mp4".format(stem, height)))
+    return jobs
+
+
+def determineQuestionTypeFrom(answerChoices: list):
+    numberOfCorrectAnswers = 0
+    for answerChoice in answerChoices:
+        if answerChoice.isCorrect():
+            numberOfCorrectAnswers += 1
+            if numberOfCorrectAnswers > 1:
+                break
+    return QuestionType.SINGLE_CHOICE if numberOfCorrectAnswers == 1 else QuestionType.MULTIPLE_CHOICES
+
+
+class QuestionsParseError(ValueError):
+    """
+    Raised when the questions file doesn't follow the questions format.
+    Carries the name of the source and the line the problem was found on,
+    when the source has lines to point at.
+    """
+
+    sourceName: str
+    lineNumber: int
+
+    def __init__(self, message: str, sourceName: str, lineNumber: int = None):
+        super().__init__("{}, line {}: {}".format(sourceName, lineNumber,
+                                                  message)
+                         if lineNumber is not None
+                         else "{}: {}".format(sourceName, message))
+        self.sourceName = sourceName
+        self.lineNumber = lineNumber
+
+
+class QuestionEventType(Enum):
+    VIDEO = 1
+    QUESTION = 2
+    CHOICE = 3
+
+
+class QuestionEvent:
+    """
+    A single meaningful line of the questions file.
+
+    text is the video file name for VIDEO events, the question title for
+    QUESTION events and the choice text for CHOICE events. isCorrect is only
+    meaningful for CHOICE events.
+    """
+
+    eventType: QuestionEventType
+    text: str
+    isCorrect: bool
+    lineNumber: int
+
+    def __init__(self, eventType: QuestionEventType, text: str,
+                 lineNumber: int, isCorrect: bool = False):
+        self.eventType = eventType
+        self.text = text
+        self.lineNumber = lineNumber
+        self.isCorrect = isCorrect
+
+
+# "video: 1.mov" or "Video: 1.mov"
+_videoLinePattern = re.compile(r"^\s*video:\s*(?P<text>.*?)\s*$",
+                               re.IGNORECASE)
+# "1. What is 2+3?"
+_questionLinePattern = re.compile(r"^\s*\d+\.\s*(?P<text>.*?)\s*$")
+# "[*] Triceratops", "[ ] Smilodon fatalis", "[x] Mammoth", "*c) 5",
+# "a)  6", "(a) 7" or "*(b) 8". Only a "*" marks a choice as correct.
+_choiceLinePattern = re.compile(
+    r"^\s*(?P<star>\*)?\s*(?:\[(?P<box>[^\]]*)\]|\(?(?P<label>[\w*]+)\))"
+    r"\s*(?P<text>.*?)\s*$"
+)
+
+
+def tokenizeQuestions(lines, sourceName: str = "questions.txt"):
+    """
+    Lazily turns the lines of a questions file into QuestionEvents.
+
+    lines can be any iterable of strings, like an open file, sys.stdin or a
+    pipe. It's only read forward, one line at a time, so nothing needs to be
+    seekable and the whole file is never held in memory.
+    """
+    for lineNumber, line in enumerate(lines, start=1):
+        if not line or line.isspace():
+            continue
+        match = _videoLinePattern.match(line)
+        if match:
+            yield QuestionEvent(QuestionEventType.VIDEO, match.group("text"),
+                                lineNumber)
+            continue
+        match = _questionLinePattern.match(line)
+        if match:
+            yield QuestionEvent(QuestionEventType.QUESTION,
+                                match.group("text"), lineNumber)
+            continue
+        match = _choiceLinePattern.match(line)
+        if match:
+            isCorrect = "*" in "".join(
+                match.group(name) or "" for name in ("star", "box", "label"))
+            yield QuestionEvent(QuestionEventType.CHOICE, match.group("text"),
+                                lineNumber, isCorrect)
+            continue
+        raise QuestionsParseError(
+            "Expected a \"video:\" line, a numbered question or an answer "
+            "choice but found \"{}\". Other lines aren't skipped, so notes "
+            "and stray text have to be removed.".format(line.rstrip("\n")),
+            sourceName,
+            lineNumber
+        )
+
+
+def _createQuestion(questionTitle: str, answerChoices: list,
+                    singleChoiceTemplateFilePath: str,
+                    multipleChoicesTemplateFilePath: str):
+    questionType = determineQuestionTypeFrom(answerChoices=answerChoices)
+    if questionType == QuestionType.SINGLE_CHOICE:
+        return SingleChoiceQuestion(
+            question=questionTitle,
+            choices=answerChoices,
+            templatePath=singleChoiceTemplateFilePath
+        )
+    return MultipleChoicesQuestion(
+        question=questionTitle,
+        choices=answerChoices,
+        templatePath=multipleChoicesTemplateFilePath
+    )
+
+
+# Seconds an interaction is shown for, unless a course says otherwise.
+interactionWindowSeconds = 2.0
+
+
+def iterQuestionSets(events, videos: list, templatesDirectoryPath: str,
+                     sourceName: str = "questions.txt",
+                     keyframeIndex: KeyframeIndex = None,
+                     windowSeconds: float = interactionWindowSeconds):
+    """
+    Builds a QuestionSet per "video:" section out of the events coming from
+    tokenizeQuestions, or a QuestionImporter, and yields each one as soon
+    as its section ends.
+
+    Each question set is shown for windowSeconds from the end of its video,
+    or up to the end of the combined video for the last one. With the
+    combined video's keyframeIndex, it starts on the nearest keyframe
+    instead, so players seek to it without decoding.
+    """
+    singleChoiceTemplateFilePath = os.path.join(
+        templatesDirectoryPath,
+        "template_question_single_choice.json"
+    )
+    multipleChoicesTemplateFilePath = os.path.join(
+        templatesDirectoryPath,
+        "template_question_multiple_choices.json"
+    )
+
+    videoTime = 0.0
+    videoIndex = 0
+    questionSet = None
+    questionEvent = None
+    answerChoices = []
+
+    # Question sets are shown in full before the combined video ends, so
+    # the last one starts windowSeconds before the end instead of at it.
+    videoDuration = sum(video.duration for video in videos)
+    latestStartTime = max(0.0, videoDuration - windowSeconds)
+
+    def placeQuestionSet():
+        time = min(videoTime, latestStartTime)
+        startTime = keyframeIndex.snap(time, windowSeconds, latestStartTime) \
+            if keyframeIndex else time
+        questionSet.startTime = startTime
+        questionSet.endTime = min(startTime + windowSeconds, videoDuration)
+
+    def finishQuestion():
+        if not answerChoices:
+            raise QuestionsParseError(
+                "Question \"{}\" has no answer choices.".format(
+                    questionEvent.text),
+                sourceName,
+                questionEvent.lineNumber
+            )
+        if not any(choice.isCorrect() for choice in answerChoices):
+            raise QuestionsParseError(
+                "Question \"{}\" has no correct answer.".format(
+                    questionEvent.text),
+                sourceName,
+                questionEvent.lineNumber
+            )
+        questionSet.questions.append(
+            _createQuestion(questionEvent.text, answerChoices,
+                            singleChoiceTemplateFilePath,
+                            multipleChoicesTemplateFilePath)
+        )
+
+    for event in events:
+        if event.eventType == QuestionEventType.VIDEO:
+            if questionEvent:
+                finishQuestion()
+                questionEvent = None
+            # Submitting the previous question set if there was one.
+            if questionSet:
+                placeQuestionSet()
+                yield questionSet
+            # Finding the video among the ones that haven't had questions
+            # yet, so videos without any are skipped over.
+            for index in range(videoIndex, len(videos)):
+                if os.path.basename(videos[index].filename) == event.text:
+                    for video in videos[videoIndex:index + 1]:
+                        videoTime += video.duration
+                    videoIndex = index + 1
+                    break
+            else:
+                if any(os.path.basename(video.filename) == event.text
+                       for video in videos[:videoIndex]):
+                    raise QuestionsParseError(
+                        "Video \"{}\" already had a section or comes "
+                        "after the section of a video played after it. "
+                        "Sections have to be in the order the videos are "
+                        "played.".format(event.text),
+                        sourceName,
+                        event.lineNumber
+                    )
+                raise QuestionsParseError(
+                    "Video \"{}\" isn't one of the videos: {}.".format(
+                        event.text, ", ".join(os.path.basename(video.filename)
+                                              for video in videos)),
+                    sourceName,
+                    event.lineNumber
+                )
+            # Collecting questions for current video.
+            questionSet = QuestionSet()
+        elif event.eventType == QuestionEventType.QUESTION:
+            if not questionSet:
+                raise QuestionsParseError(
+                    "Question found before the first \"video:\" line.",
+                    sourceName,
+                    event.lineNumber
+                )
+            if questionEvent:
+                finishQuestion()
+            questionEvent = event
+            answerChoices = []
+        else:
+            if not questionEvent:
+                raise QuestionsParseError(
+                    "Answer choice found before any question.",
+                    sourceName,
+                    event.lineNumber
+                )
+            answerChoices.append(
+                Choice(choice=event.text, isCorrect=event.isCorrect)
+            )
+
+    if questionEvent:
+        finishQuestion()
+    if questionSet:
+        placeQuestionSet()
+        yield questionSet
+
+
+def createQuestionSetsFrom(videos: list,
+                           outputVideoFilePath: str,
+                           templatesDirectoryPath: str,
+                           questionsDirectoryPath: str,
+                           outputsDirectoryPath: str,
+                           questionsFile=None
+                           ):
+    # Go through the questions from the questions.txt and create a list of
+    # QuestionSets. questionsFile can be passed in to read the questions from
+    # an already open stream, like stdin, instead.
+    if questionsFile is not None:
+        sourceName = getattr(questionsFile, "name", "<stream>")
+        return list(iterQuestionSets(
+            events=tokenizeQuestions(questionsFile, sourceName),
+            videos=videos,
+            templatesDirectoryPath=templatesDirectoryPath,
+            sourceName=sourceName
+        ))
+
+    questionsFilePath = os.path.join(
+        questionsDirectoryPath,
+        "questions.txt"
     )
+    with open(questionsFilePath, "r") as questionsFile:
+        return list(iterQuestionSets(
+            events=tokenizeQuestions(questionsFile, questionsFilePath),
+            videos=videos,
+            templatesDirectoryPath=templatesDirectoryPath,
+            sourceName=questionsFilePath
+        ))
 
-    # Combine videos in to a single video.
-    outputVideoFilePath = combineVideos(
-        videos=videos,
-        outputVideoFileName=outputVideoName,
-        outputsDirectoryPath=outputsDirectoryPath
+
+class QuestionItem:
+    """
+    One question of a question bank, together with the identifier of the
+    video section it belongs to.
+    """
+
+    __slots__ = ("section", "question", "choices", "lineNumber")
+
+    section: str
+    question: str
+    # List of (text, isCorrect) pairs.
+    choices: list
+    # None for sources without lines to point at.
+    lineNumber: int
+
+    def __init__(self, section: str, question: str, choices: list,
+                 lineNumber: int = None):
+        self.section = section
+        self.question = question
+        self.choices = choices
+        self.lineNumber = lineNumber
+
+
+class QuestionImporter(abc.ABC):
+    """
+    Reads a questions file into the QuestionEvents iterQuestionSets builds
+    question sets from.
+
+    Importers for question banks only need to implement iterItems, which
+    yields a QuestionItem per question. Items are matched to videos by
+    their section, which is the video's file name with or without its
+    extension, and are read forward only, so banks of any size are
+    imported in flat memory. Importers are picked by file extension, see
+    registerQuestionImporter.
+    """
+
+    # Name of the column, attribute or field holding an item's section.
+    sectionKey: str
+
+    def __init__(self, sectionKey: str = "video"):
+        self.sectionKey = sectionKey
+
+    def open(self, filePath: str):
+        return open(filePath, "r")
+
+    @abc.abstractmethod
+    def iterItems(self, sourceFile, sourceName: str):
+        """
+        Yields a QuestionItem per question in the open questions file.
+        """
+
+    def events(self, sourceFile, sourceName: str, videos: list):
+        """
+        Lazily turns the open questions file into QuestionEvents, with a
+        VIDEO event starting each section.
+        """
+        # Video file names by the sections that refer to them.
+        videoNames = {}
+        for index, video in enumerate(videos):
+            fileName = os.path.basename(video.filename)
+            videoNames.setdefault(fileName, (index, fileName))
+            videoNames.setdefault(os.path.splitext(fileName)[0],
+                                  (index, fileName))
+        sectionIndex = -1
+        sectionName = None
+        for item in self.iterItems(sourceFile, sourceName):
+            if not item.section:
+                raise QuestionsParseError(
+                    "Question \"{}\" has no {}.".format(item.question,
+                                                        self.sectionKey),
+                    sourceName,
+                    item.lineNumber
+                )
+            videoName = videoNames.get(item.section.strip())
+            if videoName is None:
+                raise QuestionsParseError(
+                    "Question \"{}\" is for {} \"{}\", which isn't one of "
+                    "the videos: {}.".format(
+                        item.question, self.sectionKey, item.section,
+                        ", ".join(os.path.basename(video.filename)
+                                  for video in videos)),
+                    sourceName,
+                    item.lineNumber
+                )
+            index, fileName = videoName
+            if index < sectionIndex:
+                # Sections are streamed, so they can't be put back in order.
+                raise QuestionsParseError(
+                    "Question \"{}\" is for {}, but it comes after the "
+                    "questions for {}. Questions have to be sorted by video, "
+                    "in the order the videos are played.".format(
+                        item.question, fileName, sectionName),
+                    sourceName,
+                    item.lineNumber
+                )
+            if index > sectionIndex:
+                sectionIndex = index
+                sectionName = fileName
+                yield QuestionEvent(QuestionEventType.VIDEO, fileName,
+                                    item.lineNumber)
+            yield QuestionEvent(QuestionEventType.QUESTION, item.question,
+                                item.lineNumber)
+            for text, isCorrect in item.choices:
+                yield QuestionEvent(QuestionEventType.CHOICE, text,
+                                    item.lineNumber, isCorrect)
+
+
+class TextQuestionImporter(QuestionImporter):
+    """
+    Reads questions.txt files, whose "video:" lines already start the
+    sections.
+    """
+
+    def iterItems(self, sourceFile, sourceName: str):
+        section = None
+        item = None
+        for event in tokenizeQuestions(sourceFile, sourceName):
+            if event.eventType == QuestionEventType.VIDEO:
+                section = event.text
+            elif event.eventType == QuestionEventType.QUESTION:
+                if item:
+                    yield item
+                item = QuestionItem(section, event.text, [],
+                                    event.lineNumber)
+            elif item:
+                item.choices.append((event.text, event.isCorrect))
+            else:
+                raise QuestionsParseError(
+                    "Answer choice found before any question.",
+                    sourceName,
+                    event.lineNumber
+                )
+        if item:
+            yield item
+
+    def events(self, sourceFile, sourceName: str, videos: list):
+        # The sections are already in the file, so its events are passed on
+        # as they are.
+        return tokenizeQuestions(sourceFile, sourceName)
+
+
+def _xmlName(element):
+    # Tag without its namespace.
+    return element.tag.rpartition("}")[2]
+
+
+def _xmlText(element, skippedNames: tuple = ()):
+    # All the text in element, with its whitespace collapsed, except the
+    # text in children named one of skippedNames.
+    texts = [element.text or ""]
+    for child in element:
+        if _xmlName(child) not in skippedNames:
+            texts.append(_xmlText(child, skippedNames))
+        texts.append(child.tail or "")
+    return " ".join("".join(texts).split())
+
+
+class QTIQuestionImporter(QuestionImporter):
+    """
+    Reads the choice questions of QTI 1.2 <item>s and QTI 2.1
+    <assessmentItem>s, like the question banks LMSs export.
+
+    An item's section is the item attribute named sectionKey, or in QTI 1.2
+    its qtimetadata field of that name, and otherwise the attribute of the
+    innermost enclosing section that has one. Keys like "section.title"
+    only look at the sections, so every QTI 1.2 <section> maps to the video
+    its title names.
+
+    The XML is parsed incrementally and every item is dropped from the tree
+    as soon as it's read, so only one item is in memory at a time.
+    """
+
+    _sectionNames = ("section", "assessmentSection")
+
+    def open(self, filePath: str):
+        return open(filePath, "rb")
+
+    def iterItems(self, sourceFile, sourceName: str):
+        # Open elements, outermost first, and the attributes of the open
+        # sections.
+        elements = []
+        sections = []
+        # Tags without their namespaces, looked up for every element.
+        names = {}
+        parser = ElementTree.iterparse(sourceFile, events=("start", "end"))
+        try:
+            for event, element in parser:
+                name = names.get(element.tag)
+                if name is None:
+                    name = names[element.tag] = _xmlName(element)
+                if event == "start":
+                    elements.append(element)
+                    if name in self._sectionNames:
+                        sections.append(element.attrib)
+                    continue
+                elements.pop()
+                if name in self._sectionNames:
+                    sections.pop()
+                    continue
+                if name == "item":
+                    yield self._qti12Item(element, sections)
+                elif name == "assessmentItem":
+                    yield self._qti21Item(element, sections)
+                else:
+                    continue
+                element.clear()
+                if elements:
+                    elements[-1].remove(element)
+        except ElementTree.ParseError as error:
+            raise QuestionsParseError(
+                "Isn't well-formed XML: {}.".format(error),
+                sourceName,
+                error.position[0]
+            ) from error
+
+    def _section(self, item, sections: list, metadata: dict = None):
+        section = None
+        sectionKey = self.sectionKey
+        if sectionKey.startswith("section."):
+            sectionKey = sectionKey[len("section."):]
+        else:
+            section = item.get(sectionKey)
+            if section is None and metadata:
+                section = metadata.get(sectionKey)
+        if section is None:
+            section = next((attributes[sectionKey]
+                            for attributes in reversed(sections)
+                            if sectionKey in attributes), None)
+        return section
+
+    def _qti12Item(self, item, sections: list):
+        metadata = {}
+        questionTexts = []
+        # (ident, text) pairs.
+        choices = []
+        correctIdents = set()
+        for element in item:
+            name = _xmlName(element)
+            if name == "itemmetadata":
+                for field in element.iter():
+                    if _xmlName(field) == "qtimetadatafield":
+                        fieldParts = {_xmlName(part): _xmlText(part)
+                                      for part in field}
+                        metadata[fieldParts.get("fieldlabel")] = \
+                            fieldParts.get("fieldentry")
+            elif name == "presentation":
+                self._readQTI12Presentation(element, questionTexts, choices)
+            elif name == "resprocessing":
+                for condition in element.iter():
+                    if _xmlName(condition) == "respcondition" \
+                            and self._awardsScore(condition):
+                        self._collectCorrectIdents(condition, correctIdents)
+        return QuestionItem(
+            section=self._section(item, sections, metadata),
+            question=" ".join(questionTexts) if questionTexts
+            else item.get("title", ""),
+            choices=[(text, ident in correctIdents)
+                     for ident, text in choices]
+        )
+
+    def _readQTI12Presentation(self, element, questionTexts: list,
+                               choices: list):
+        for child in element:
+            name = _xmlName(child)
+            if name == "response_label":
+                choices.append((child.get("ident"), _xmlText(child)))
+            elif name == "mattext":
+                questionTexts.append(_xmlText(child))
+            else:
+                self._readQTI12Presentation(child, questionTexts, choices)
+
+    @staticmethod
+    def _awardsScore(condition):
+        for setvar in condition:
+            if _xmlName(setvar) == "setvar" \
+                    and setvar.get("action", "Set") in ("Set", "Add"):
+                try:
+                    return float(setvar.text) > 0
+                except (TypeError, ValueError):
+                    return False
+        return False
+
+    def _collectCorrectIdents(self, element, correctIdents: set):
+        # The choices a scoring condition requires. The ones it requires
+        # not to be chosen are under <not>.
+        for child in element:
+            name = _xmlName(child)
+            if name == "varequal":
+                correctIdents.add((child.text or "").strip())
+            elif name != "not":
+                self._collectCorrectIdents(child, correctIdents)
+
+    def _qti21Item(self, item, sections: list):
+        correctIdentifiers = set()
+        questionTexts = []
+        # (identifier, text) pairs.
+        choices = []
+        for element in item:
+            name = _xmlName(element)
+            if name == "responseDeclaration":
+                for value in element.iter():
+                    if _xmlName(value) == "value":
+                        correctIdentifiers.add((value.text or "").strip())
+            elif name == "itemBody":
+                for child in element.iter():
+                    childName = _xmlName(child)
+                    if childName == "prompt":
+                        questionTexts.append(_xmlText(child))
+                    elif childName == "simpleChoice":
+                        choices.append((child.get("identifier"), _xmlText(
+                            child, ("feedbackInline",))))
+                if not questionTexts:
+                    # Without a prompt, the question is the body's text
+                    # around the interaction.
+                    questionTexts.append(_xmlText(
+                        element, ("choiceInteraction", "feedbackBlock",
+                                  "modalFeedback")))
+        return QuestionItem(
+            section=self._section(item, sections),
+            question=" ".join(text for text in questionTexts if text)
+            or item.get("title", ""),
+            choices=[(text, identifier in correctIdentifiers)
+                     for identifier, text in choices]
+        )
+
+
+class CSVQuestionImporter(QuestionImporter):
+    """
+    Reads question banks with a row per question and a header row naming
+    the columns. Questions are in the "question" column, their choices in
+    the columns whose names start with "choice", in order, and their
+    section in the sectionKey column.
+
+    Correct choices are listed in a "correct" column, by number or letter,
+    like "2" or "a, c", or otherwise marked with a leading "*" like in
+    questions.txt.
+    """
+
+    def open(self, filePath: str):
+        # utf-8-sig drops the byte order mark spreadsheets start files with.
+        return open(filePath, "r", newline="", encoding="utf-8-sig")
+
+    def iterItems(self, sourceFile, sourceName: str):
+        reader = csv.reader(sourceFile)
+        header = next(reader, None)
+        if header is None:
+            return
+        columns = [name.strip().lower() for name in header]
+        for requiredName in ("question", self.sectionKey.lower()):
+            if requiredName not in columns:
+                raise QuestionsParseError(
+                    "There's no \"{}\" column.".format(requiredName),
+                    sourceName,
+                    1
+                )
+        questionColumn = columns.index("question")
+        sectionColumn = columns.index(self.sectionKey.lower())
+        correctColumn = columns.index("correct") if "correct" in columns \
+            else None
+        choiceColumns = [index for index, name in enumerate(columns)
+                         if name.startswith("choice")]
+        for row in reader:
+            if not any(cell and not cell.isspace() for cell in row):
+                continue
+            row += [""] * (len(columns) - len(row))
+            question = row[questionColumn].strip()
+            choiceTexts = [row[index].strip() for index in choiceColumns]
+            correct = row[correctColumn].strip() \
+                if correctColumn is not None else ""
+            if correct:
+                correctIndices = self._correctIndices(
+                    correct, question, len(choiceTexts), sourceName,
+                    reader.line_num)
+                choices = [(text, index in correctIndices)
+                           for index, text in enumerate(choiceTexts)]
+            else:
+                choices = [(text[1:].lstrip(), True) if text.startswith("*")
+                           else (text, False) for text in choiceTexts]
+            yield QuestionItem(
+                section=row[sectionColumn],
+                question=question,
+                choices=[(text, isCorrect) for text, isCorrect in choices
+                         if text],
+                lineNumber=reader.line_num
+            )
+
+    @staticmethod
+    def _correctIndices(correct: str, question: str, choiceCount: int,
+                        sourceName: str, lineNumber: int):
+        indices = set()
+        for answer in re.split(r"[\s,;]+", correct):
+            if answer.isdigit():
+                index = int(answer) - 1
+            elif len(answer) == 1 and answer.isalpha():
+                index = ord(answer.lower()) - ord("a")
+            else:
+                index = -1
+            if not 0 <= index < choiceCount:
+                raise QuestionsParseError(
+                    "Correct answer \"{}\" of question \"{}\" isn't the "
+                    "number or letter of one of its {} choices.".format(
+                        answer, question, choiceCount),
+                    sourceName,
+                    lineNumber
+                )
+            indices.add(index)
+        return indices
+
+
+# Question importers by the extension of the files they read.
+_questionImporters = {}
+
+
+def registerQuestionImporter(importerClass, *fileExtensions):
+    """
+    Makes questionImporterFor read files with any of fileExtensions, like
+    ".xml", with importerClass, a QuestionImporter subclass.
+    """
+    for fileExtension in fileExtensions:
+        _questionImporters[fileExtension.lower()] = importerClass
+
+
+registerQuestionImporter(TextQuestionImporter, ".txt")
+registerQuestionImporter(QTIQuestionImporter, ".xml", ".qti")
+registerQuestionImporter(CSVQuestionImporter, ".csv")
+
+
+def questionImporterFor(filePath: str, sectionKey: str = "video"):
+    extension = os.path.splitext(filePath)[1].lower()
+    if extension == ".zip":
+        # IMS content packages spread items over files listed in
+        # imsmanifest.xml, which QTIQuestionImporter doesn't follow.
+        raise QuestionsParseError(
+            "QTI content packages aren't supported, only single QTI .xml "
+            "files. Unzip the package and pass the .xml file holding the "
+            "question bank instead.",
+            filePath
+        )
+    importerClass = _questionImporters.get(extension)
+    if importerClass is None:
+        raise QuestionsParseError(
+            "No importer reads {} files, only {}.".format(
+                os.path.splitext(filePath)[1] or "extensionless",
+                ", ".join(sorted(_questionImporters))),
+            filePath
+        )
+    return importerClass(sectionKey)
+
+
+class BuildCache:
+    """
+    Persistent, content-addressed cache of build results shared by every
+    build using the same cache directory.
+
+    Results are stored per stage ("video", "questionSets", "math") under
+    keys made from content hashes of their inputs, so they're reused
+    whenever the inputs are unchanged, whichever course or build produced
+    them. Small results are kept in an SQLite index; files, like encoded
+    videos, are kept next to it. Once everything takes more than maxBytes
+    the least recently used entries are evicted.
+    """
+
+    cacheDirectoryPath: str
+    maxBytes: int
+    statistics: dict
+
+    def __init__(self, cacheDirectoryPath: str,
+                 maxBytes: int = 10 * 1024 ** 3):
+        self.cacheDirectoryPath = cacheDirectoryPath
+        self.maxBytes = maxBytes
+        # Stage -> [hits, misses] for this instance.
+        self.statistics = {}
+        os.makedirs(os.path.join(cacheDirectoryPath, "files"), exist_ok=True)
+        self._connection = sqlite3.connect(
+            os.path.join(cacheDirectoryPath, "build_cache.sqlite"),
+            timeout=60,
+            isolation_level=None
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "stage TEXT, key TEXT, value BLOB, fileName TEXT, size INTEGER, "
+            "lastUsed REAL, PRIMARY KEY (stage, key))"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS fileHashes ("
+            "path TEXT PRIMARY KEY, size INTEGER, modified INTEGER, "
+            "digest TEXT)"
+        )
+        # Size of every entry, kept up to date by this instance so puts
+        # don't have to add up the whole index.
+        self._totalBytes = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def close(self):
+        self._connection.close()
+
+    @staticmethod
+    def key(*parts):
+        """
+        Hashes any JSON serializable parts into a cache key.
+        """
+        return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+    def hashFile(self, filePath: str):
+        """
+        Returns the SHA-256 of a file's contents. Hashes are remembered by
+        path, size and modification time so unchanged files aren't read
+        again.
+        """
+        filePath = os.path.abspath(filePath)
+        fileStatus = os.stat(filePath)
+        row = self._connection.execute(
+            "SELECT digest FROM fileHashes WHERE path = ? AND size = ? "
+            "AND modified = ?",
+            (filePath, fileStatus.st_size, fileStatus.st_mtime_ns)
+        ).fetchone()
+        if row:
+            return row[0]
+        fileHash = hashlib.sha256()
+        with open(filePath, "rb") as hashedFile:
+            for chunk in iter(lambda: hashedFile.read(1024 * 1024), b""):
+                fileHash.update(chunk)
+        digest = fileHash.hexdigest()
+        self._connection.execute(
+            "INSERT OR REPLACE INTO fileHashes VALUES (?, ?, ?, ?)",
+            (filePath, fileStatus.st_size, fileStatus.st_mtime_ns, digest)
+        )
+        return digest
+
+    def _count(self, stage: str, hit: bool):
+        counts = self.statistics.setdefault(stage, [0, 0])
+        counts[0 if hit else 1] += 1
+
+    def get(self, stage: str, key: str):
+        row = self._connection.execute(
+            "SELECT value FROM entries WHERE stage = ? AND key = ? "
+            "AND fileName IS NULL",
+            (stage, key)
+        ).fetchone()
+        self._count(stage, row is not None)
+        if row is None:
+            return None
+        self._touch(stage, key)
+        return row[0]
+
+    def _insert(self, stage: str, key: str, value: bytes, fileName: str,
+                size: int):
+        # Adds or replaces an entry, keeping the total size up to date.
+        row = self._connection.execute(
+            "SELECT size FROM entries WHERE stage = ? AND key = ?",
+            (stage, key)
+        ).fetchone()
+        self._connection.execute(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+            (stage, key, value, fileName, size, time.time())
+        )
+        self._totalBytes += size - (row[0] if row else 0)
+        self._evict()
+
+    def put(self, stage: str, key: str, value: bytes):
+        self._insert(stage, key, value, None, len(value))
+
+    def getFile(self, stage: str, key: str, destinationFilePath: str):
+        """
+        Places the cached file for key at destinationFilePath and returns
+        True, or returns False when there's no such file.
+        """
+        row = self._connection.execute(
+            "SELECT fileName FROM entries WHERE stage = ? AND key = ? "
+            "AND fileName IS NOT NULL",
+            (stage, key)
+        ).fetchone()
+        cachedFilePath = os.path.join(self.cacheDirectoryPath, "files",
+                                      row[0]) if row else None
+        if not cachedFilePath or not os.path.isfile(cachedFilePath):
+            self._count(stage, False)
+            return False
+        self._count(stage, True)
+        self._touch(stage, key)
+        self._linkOrCopy(cachedFilePath, destinationFilePath)
+        return True
+
+    def putFile(self, stage: str, key: str, sourceFilePath: str):
+        fileName = "{}-{}{}".format(stage, key,
+                                    os.path.splitext(sourceFilePath)[1])
+        self._linkOrCopy(sourceFilePath, os.path.join(
+            self.cacheDirectoryPath, "files", fileName))
+        self._insert(stage, key, None, fileName,
+                     os.path.getsize(sourceFilePath))
+
+    @staticmethod
+    def _linkOrCopy(sourceFilePath: str, destinationFilePath: str):
+        # Hard links make this free when both are on the same file system.
+        if os.path.exists(destinationFilePath):
+            os.remove(destinationFilePath)
+        linkOrCloneFile(sourceFilePath, destinationFilePath)
+
+    def _touch(self, stage: str, key: str):
+        self._connection.execute(
+            "UPDATE entries SET lastUsed = ? WHERE stage = ? AND key = ?",
+            (time.time(), stage, key)
+        )
+
+    def _evict(self):
+        if self._totalBytes <= self.maxBytes:
+            return
+        # Other builds sharing the cache may have added or evicted entries
+        # since, so the total is counted again before evicting.
+        self._totalBytes = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if self._totalBytes <= self.maxBytes:
+            return
+        rows = self._connection.execute(
+            "SELECT stage, key, fileName, size FROM entries "
+            "ORDER BY lastUsed")
+        evicted = []
+        for stage, key, fileName, size in rows:
+            if self._totalBytes <= self.maxBytes:
+                break
+            evicted.append((stage, key, fileName))
+            self._totalBytes -= size
+        rows.close()
+        for stage, key, fileName in evicted:
+            self._connection.execute(
+                "DELETE FROM entries WHERE stage = ? AND key = ?",
+                (stage, key))
+            if fileName:
+                cachedFilePath = os.path.join(self.cacheDirectoryPath,
+                                              "files", fileName)
+                if os.path.exists(cachedFilePath):
+                    os.remove(cachedFilePath)
+
+    def describe(self):
+        return "; ".join(
+            "{}: {} hit(s), {} miss(es)".format(stage, hits, misses)
+            for stage, (hits, misses) in sorted(self.statistics.items())
+        )
+
+
+class CourseDefinition:
+    """
+    Everything needed to build one course's .h5p package.
+
+    inputsDirectoryPath holds a videos directory with the clips and a
+    questions directory with questions.txt, unless questionsFilePath points
+    at another questions file, like a QTI or CSV question bank.
+    Intermediate files go into a build directory next to the output
+    package, so courses never share working files.
+    """
+
+    title: str
+    inputsDirectoryPath: str
+    inputVideoType: str
+    outputFilePath: str
+    templatesDirectoryPath: str
+    cacheDirectoryPath: str
+    concatMode: ConcatMode
+    useBuildCache: bool
+    cacheMaxBytes: int
+    encodeWorkers: int
+    chunkSeconds: float
+    # Directory the package is also unpacked into, if any.
+    stageDirectoryPath: str
+    # Heights of the lower quality renditions packaged next to the full
+    # video, if any.
+    renditions: list
+    interactionWindowSeconds: float
+    validateContent: bool
+    questionsFilePath: str
+    # Column, attribute or field of question bank items naming their video.
+    sectionKey: str
+    renderMath: bool
+    bundleLibraries: bool
+
+    def __init__(self, title: str, inputsDirectoryPath: str,
+                 outputFilePath: str, templatesDirectoryPath: str,
+                 inputVideoType: str = "mov",
+                 cacheDirectoryPath: str = None,
+                 concatMode: ConcatMode = ConcatMode.STREAM_COPY,
+                 useBuildCache: bool = True,
+                 cacheMaxBytes: int = 10 * 1024 ** 3,
+                 encodeWorkers: int = None,
+                 chunkSeconds: float = 60.0,
+                 stageDirectoryPath: str = None,
+                 renditions: list = None,
+                 interactionWindowSeconds: float = interactionWindowSeconds,
+                 validateContent: bool = False,
+                 questionsFilePath: str = None,
+                 sectionKey: str = "video",
+                 renderMath: bool = False,
+                 bundleLibraries: bool = False):
+        self.title = title
+        self.inputsDirectoryPath = inputsDirectoryPath
+        self.inputVideoType = inputVideoType
+        self.outputFilePath = outputFilePath
+        self.templatesDirectoryPath = templatesDirectoryPath
+        self.cacheDirectoryPath = cacheDirectoryPath if cacheDirectoryPath \
+            else os.path.join(os.path.dirname(outputFilePath), ".h5p_cache")
+        self.concatMode = concatMode
+        self.useBuildCache = useBuildCache
+        self.cacheMaxBytes = cacheMaxBytes
+        # Number of ffmpeg processes re-encoding clips at the same time.
+        self.encodeWorkers = encodeWorkers
+        self.chunkSeconds = chunkSeconds
+        self.stageDirectoryPath = stageDirectoryPath
+        self.renditions = renditions
+        # Seconds every question set is shown for.
+        self.interactionWindowSeconds = interactionWindowSeconds
+        # Whether content.json is checked against the libraries' semantics.
+        self.validateContent = validateContent
+        self.questionsFilePath = questionsFilePath if questionsFilePath \
+            else os.path.join(inputsDirectoryPath, "questions",
+                              "questions.txt")
+        self.sectionKey = sectionKey
+        # Whether TeX in questions is put in MathDisplay's delimiters while
+        # building.
+        self.renderMath = renderMath
+        # Whether libraries are packaged with their scripts and styles
+        # minified into one file each.
+        self.bundleLibraries = bundleLibraries
+
+    @property
+    def buildDirectoryPath(self):
+        return os.path.splitext(self.outputFilePath)[0] + "_build"
+
+    @staticmethod
+    def fromDict(definition: dict, baseDirectoryPath: str,
+                 templatesDirectoryPath: str, cacheDirectoryPath: str = None):
+        # Relative paths in a manifest are relative to the manifest itself.
+        def resolvePath(path: str):
+            return os.path.join(baseDirectoryPath, os.path.expanduser(path))
+
+        concatMode = ConcatMode.STREAM_COPY
+        if definition.get("concatMode", "copy") == "reencode":
+            concatMode = ConcatMode.REENCODE
+        return CourseDefinition(
+            title=definition["title"],
+            inputsDirectoryPath=resolvePath(definition["inputs"]),
+            outputFilePath=resolvePath(definition["output"]),
+            templatesDirectoryPath=resolvePath(
+                definition["templates"]) if "templates" in definition
+            else templatesDirectoryPath,
+            inputVideoType=definition.get("videoType", "mov"),
+            cacheDirectoryPath=cacheDirectoryPath,
+            concatMode=concatMode,
+            stageDirectoryPath=resolvePath(definition["stage"])
+            if "stage" in definition else None,
+            renditions=definition.get("renditions"),
+            interactionWindowSeconds=definition.get(
+                "interactionWindow", interactionWindowSeconds),
+            validateContent=definition.get("validate", False),
+            questionsFilePath=resolvePath(definition["questions"])
+            if "questions" in definition else None,
+            sectionKey=definition.get("sectionKey", "video"),
+            renderMath=definition.get("renderMath", False),
+            bundleLibraries=definition.get("bundleLibraries", False)
+        )
+
+
+def loadManifest(manifestFilePath: str, templatesDirectoryPath: str):
+    """
+    Reads a JSON manifest of courses, either a list of course objects or an
+    object with a "courses" list, and returns their CourseDefinitions.
+
+    Each course has a "title", an "inputs" directory and an "output" package
+    path, and optionally a "videoType" (defaults to "mov"), "templates"
+    directory, "concatMode" ("copy" or "reencode"), "stage" directory to
+    unpack the package into, "renditions", a list of heights to also
+    encode the video at, "interactionWindow", the seconds questions are
+    shown for, "validate", whether to check the content against the
+    libraries' semantics, "questions", a questions file to use instead of
+    questions/questions.txt, "sectionKey", the column or attribute naming
+    the video of each question in it, "renderMath", whether to render the
+    TeX in questions for MathDisplay, and "bundleLibraries", whether to
+    minify and bundle the libraries' scripts and styles.
+    """
+    with open(manifestFilePath, "r") as manifestFile:
+        manifest = json.loads(manifestFile.read())
+    baseDirectoryPath = os.path.dirname(os.path.abspath(manifestFilePath))
+    courses = manifest["courses"] if isinstance(manifest, dict) else manifest
+    cacheDirectoryPath = os.path.join(baseDirectoryPath, ".h5p_cache")
+    if isinstance(manifest, dict) and "cacheDirectory" in manifest:
+        cacheDirectoryPath = os.path.join(baseDirectoryPath,
+                                          manifest["cacheDirectory"])
+    return [CourseDefinition.fromDict(course, baseDirectoryPath,
+                                      templatesDirectoryPath,
+                                      cacheDirectoryPath)
+            for course in courses]
+
+
+def buildCourse(course: CourseDefinition):
+    """
+    Builds a course's .h5p package and returns its path. Only uses the
+    paths in the course definition, never the working directory.
+    """
+    with tracer.span("buildCourse", course=course.title):
+        return _buildCourse(course)
+
+
+class CourseTemplates:
+    """
+    Paths of the templates a course is built from.
+    """
+
+    contentTemplateFilePath: str
+    interactionTemplateFilePath: str
+    h5pMetaDataTemplateFilePath: str
+    packageTemplateDirectoryPath: str
+
+    def __init__(self, templatesDirectoryPath: str):
+        self.contentTemplateFilePath = os.path.join(
+            templatesDirectoryPath,
+            "template_content.json"
+        )
+        self.interactionTemplateFilePath = os.path.join(
+            templatesDirectoryPath,
+            "template_interaction.json"
+        )
+        self.h5pMetaDataTemplateFilePath = os.path.join(
+            templatesDirectoryPath,
+            "template_h5p.json"
+        )
+        # Libraries packaged with the content.
+        self.packageTemplateDirectoryPath = os.path.join(
+            templatesDirectoryPath,
+            "template_h5p_package_multiple_choice"
+        )
+
+
+def prepareCourse(course: CourseDefinition):
+    """
+    Creates the course's output directories and returns its videos.
+    """
+    os.makedirs(course.buildDirectoryPath, exist_ok=True)
+    os.makedirs(course.cacheDirectoryPath, exist_ok=True)
+    outputDirectoryPath = os.path.dirname(course.outputFilePath)
+    if outputDirectoryPath:
+        os.makedirs(outputDirectoryPath, exist_ok=True)
+    return importVideos(
+        inputVideoType=course.inputVideoType,
+        videosDirectoryPath=os.path.join(course.inputsDirectoryPath,
+                                         "videos")
     )
 
-    h5p = H5P(contentTemplatePath=contentTemplateFilePath,
-              interactionTemplatePath=interactionTemplateFilePath,
-              h5pMetaDataTemplatePath=h5pMetaDataTemplateFilePath,
-              outputsDirectoryPath=outputsDirectoryPath,
-              videoSource=outputVideoFilePath)
 
-    # Create folders if they don't exist.
-    # Create content.json and h5p.json.
-    questionSets = createQuestionSetsFrom(
-        videos=videos,
-        outputVideoFilePath=outputVideoFilePath,
-        templatesDirectoryPath=templatesDirectoryPath,
-        questionsDirectoryPath=questionsDirectoryPath,
-        outputsDirectoryPath=outputsDirectoryPath
+def _buildCourseRenditions(course: CourseDefinition,
+                           outputVideoFilePath: str, videoKey: str,
+                           interactionTimes: list,
+                           buildCache: BuildCache = None):
+    # The combined video and its renditions as (path, label) pairs. Every
+    # rendition missing from the build cache is encoded at the same time.
+    probe = probeVideo(outputVideoFilePath)
+    workers = _encodeWorkerCount(course.encodeWorkers)
+    videoSources = [(outputVideoFilePath, "{}p".format(probe.height))]
+    missingRenditions = []
+    for height, arguments, renditionFilePath in _renditionJobs(
+            probe, course.renditions, workers, interactionTimes):
+        if os.path.exists(renditionFilePath):
+            os.remove(renditionFilePath)
+        renditionKey = buildCache.key(videoKey, arguments) if buildCache \
+            else None
+        if not buildCache or not buildCache.getFile(
+                "rendition", renditionKey, renditionFilePath):
+            missingRenditions.append((renditionKey, arguments,
+                                      renditionFilePath))
+        videoSources.append((renditionFilePath, "{}p".format(height)))
+    with tracer.span("encodeRenditions", renditions=len(missingRenditions)):
+        _runFFmpegJobs([["-i", outputVideoFilePath] + arguments
+                        + [renditionFilePath]
+                        for _, arguments, renditionFilePath
+                        in missingRenditions], workers)
+    if buildCache:
+        for renditionKey, _, renditionFilePath in missingRenditions:
+            buildCache.putFile("rendition", renditionKey, renditionFilePath)
+    return videoSources
+
+
+def courseInteractionTimes(course: CourseDefinition, videos: list):
+    """
+    Returns the times in the combined video the course's question sets
+    start at, before they're moved onto keyframes.
+    """
+    importer = questionImporterFor(course.questionsFilePath,
+                                   course.sectionKey)
+    with importer.open(course.questionsFilePath) as questionsFile:
+        return [questionSet.startTime for questionSet in iterQuestionSets(
+            events=importer.events(questionsFile, course.questionsFilePath,
+                                   videos),
+            videos=videos,
+            templatesDirectoryPath=course.templatesDirectoryPath,
+            sourceName=course.questionsFilePath,
+            windowSeconds=course.interactionWindowSeconds
+        )]
+
+
+def buildCourseVideo(course: CourseDefinition, videos: list,
+                     buildCache: BuildCache = None,
+                     interactionTimes: list = None):
+    """
+    Combines the course's videos into its build directory, unless the same
+    clips have been combined the same way before, and returns the path of
+    the combined video. When the course has renditions, they're encoded
+    from it too and a list of (path, label) pairs is returned instead, the
+    combined video first.
+
+    Keyframes are forced at the course's interactionTimes, which are read
+    from its questions when they aren't given.
+    """
+    if interactionTimes is None:
+        interactionTimes = courseInteractionTimes(course, videos)
+    outputVideoName = "final_h5p_video.mp4"  # Only mp4 is supported for now.
+    # The old video is removed rather than overwritten because it may be
+    # hard linked to the cache.
+    outputVideoFilePath = os.path.join(course.buildDirectoryPath,
+                                       outputVideoName)
+    if os.path.exists(outputVideoFilePath):
+        os.remove(outputVideoFilePath)
+    videoKey = None
+    encodeWorkers = _encodeWorkerCount(course.encodeWorkers)
+    if buildCache:
+        # One worker means moviepy encodes everything; more means chunked
+        # ffmpeg segments, with the CPUs split between them, so the worker
+        # count changes the output.
+        with tracer.span("hashClips"):
+            videoKey = buildCache.key(
+                course.concatMode.name,
+                encodeWorkers,
+                course.chunkSeconds,
+                _segmentVideoArguments,
+                _segmentAudioArguments,
+                _fastStartArguments,
+                interactionTimes,
+                [buildCache.hashFile(video.filename) for video in videos]
+            )
+    if not buildCache or not buildCache.getFile("video", videoKey,
+                                                outputVideoFilePath):
+        outputVideoFilePath = combineVideos(
+            videos=videos,
+            outputVideoFileName=outputVideoName,
+            outputsDirectoryPath=course.buildDirectoryPath,
+            concatMode=course.concatMode,
+            encodeWorkers=encodeWorkers,
+            chunkSeconds=course.chunkSeconds,
+            buildCache=buildCache,
+            keyframeTimes=interactionTimes
+        )
+        if buildCache:
+            buildCache.putFile("video", videoKey, outputVideoFilePath)
+    if not course.renditions:
+        return outputVideoFilePath
+    return _buildCourseRenditions(course, outputVideoFilePath, videoKey,
+                                  interactionTimes, buildCache)
+
+
+def courseKeyframeIndex(videoSource):
+    """
+    Returns the KeyframeIndex of the combined video buildCourseVideo
+    returned, or None when it isn't a local file. The renditions have their
+    keyframes at the same times.
+    """
+    videoFilePath = videoSource if isinstance(videoSource, str) \
+        else videoSource[0][0]
+    if not os.path.isfile(videoFilePath):
+        return None
+    with tracer.span("readKeyframeIndex"):
+        return readKeyframeIndex(videoFilePath)
+
+
+def packageCourse(course: CourseDefinition, videos: list, videoSource,
+                  buildCache: BuildCache = None,
+                  keyframeIndex: KeyframeIndex = None,
+                  writePackage: bool = True):
+    """
+    Writes the course's .h5p package around the already combined video, or
+    videos, that buildCourseVideo returned and returns the package's path.
+
+    keyframeIndex is the combined video's, when it's already known. With
+    writePackage off only the stage directory is written.
+    """
+    templates = CourseTemplates(course.templatesDirectoryPath)
+    h5p = H5P(contentTemplatePath=templates.contentTemplateFilePath,
+              interactionTemplatePath=templates.interactionTemplateFilePath,
+              h5pMetaDataTemplatePath=templates.h5pMetaDataTemplateFilePath,
+              outputsDirectoryPath=course.buildDirectoryPath,
+              videoSource=videoSource,
+              packageTemplateDirectoryPath=(
+                  templates.packageTemplateDirectoryPath),
+              libraryResolver=LibraryResolver(
+                  templates.packageTemplateDirectoryPath,
+                  cacheFilePath=os.path.join(course.cacheDirectoryPath,
+                                             "library_graph.json")
+              ),
+              buildCache=buildCache,
+              validateContent=course.validateContent,
+              libraryBundler=LibraryBundler(os.path.join(
+                  course.cacheDirectoryPath, "library_bundles"))
+              if course.bundleLibraries else None)
+
+    # Interactions start on keyframes of the combined video.
+    if keyframeIndex is None:
+        keyframeIndex = courseKeyframeIndex(videoSource)
+    h5pMetaData = H5PMetaData(title=course.title)
+
+    # Create content.json and h5p.json. Question sets are parsed while
+    # content.json is being written, so only one is in memory at a time.
+    questionsFilePath = course.questionsFilePath
+    importer = questionImporterFor(questionsFilePath, course.sectionKey)
+    mathRenderer = None
+    if course.renderMath:
+        # Every expression in the questions is rendered up front, so the
+        # ones that aren't cached yet are rendered in parallel.
+        mathRenderer = MathRenderer(buildCache)
+        with importer.open(questionsFilePath) as questionsFile:
+            warnings = mathRenderer.prerender(
+                expression
+                for event in importer.events(questionsFile,
+                                             questionsFilePath, videos)
+                if event.eventType != QuestionEventType.VIDEO
+                for expression in MathRenderer.expressions(event.text))
+        for warning in warnings:
+            print("{}: {}".format(course.title, warning))
+    if writePackage:
+        with importer.open(questionsFilePath) as questionsFile:
+            questionSets = iterQuestionSets(
+                events=importer.events(questionsFile, questionsFilePath,
+                                       videos),
+                videos=videos,
+                templatesDirectoryPath=course.templatesDirectoryPath,
+                sourceName=questionsFilePath,
+                keyframeIndex=keyframeIndex,
+                windowSeconds=course.interactionWindowSeconds
+            )
+            content = Content(questionSets=questionSets,
+                              buildCache=buildCache,
+                              mathRenderer=mathRenderer)
+            h5p.export(content=content, h5pMetaData=h5pMetaData,
+                       packageOutput=course.outputFilePath)
+
+    if course.stageDirectoryPath:
+        # The question sets are parsed again, but their interactions come
+        # from the build cache when it's on. content.json is swapped in
+        # atomically, so a preview server can keep serving the directory.
+        with importer.open(questionsFilePath) as questionsFile:
+            questionSets = iterQuestionSets(
+                events=importer.events(questionsFile, questionsFilePath,
+                                       videos),
+                videos=videos,
+                templatesDirectoryPath=course.templatesDirectoryPath,
+                sourceName=questionsFilePath,
+                keyframeIndex=keyframeIndex,
+                windowSeconds=course.interactionWindowSeconds
+            )
+            h5p.exportDirectory(
+                content=Content(questionSets=questionSets,
+                                buildCache=buildCache,
+                                mathRenderer=mathRenderer),
+                h5pMetaData=h5pMetaData,
+                directoryPath=course.stageDirectoryPath,
+                libraryStore=LibraryStore(os.path.join(
+                    course.cacheDirectoryPath, "library_store"))
+            )
+    if h5p.libraryBundler and h5p.libraryBundler.statistics:
+        print("Library bundles for {}: {}".format(
+            course.title, h5p.libraryBundler.describe()))
+    return course.outputFilePath
+
+
+def _buildCourse(course: CourseDefinition):
+    videos = prepareCourse(course)
+    buildCache = None
+    if course.useBuildCache:
+        buildCache = BuildCache(course.cacheDirectoryPath,
+                                course.cacheMaxBytes)
+    try:
+        videoSource = buildCourseVideo(course, videos, buildCache)
+        packageCourse(course, videos, videoSource, buildCache)
+        if buildCache:
+            print("Build cache for {}: {}".format(course.title,
+                                                  buildCache.describe()))
+    finally:
+        if buildCache:
+            buildCache.close()
+    return course.outputFilePath
+
+
+class CourseWatcher:
+    """
+    Rebuilds a course whenever its questions, templates or clips change, so
+    authors can keep a preview open while they edit.
+
+    The watched files are polled every pollSeconds. Once something changes,
+    the watcher waits until nothing has changed for debounceSeconds, so a
+    burst of saves only triggers one rebuild covering all of them.
+
+    Question and template changes only regenerate content.json, which is
+    swapped into the course's stage directory while it's being served.
+    Clip changes, and question changes that move interactions to other
+    clips, combine the video again, and only the clips that changed are
+    re-encoded. The package itself is only rewritten when there's no
+    stage directory, and otherwise once watching stops.
+    """
+
+    course: CourseDefinition
+    pollSeconds: float
+    debounceSeconds: float
+
+    def __init__(self, course: CourseDefinition, pollSeconds: float = 0.25,
+                 debounceSeconds: float = 0.3):
+        self.course = course
+        self.pollSeconds = pollSeconds
+        self.debounceSeconds = debounceSeconds
+        # What the last video build produced, reused by content rebuilds.
+        self._videos = None
+        self._videoSource = None
+        self._keyframeIndex = None
+        self._interactionTimes = None
+        # Whether the stage directory is ahead of the package.
+        self._packageStale = False
+
+    def _videosDirectoryPath(self):
+        return os.path.join(self.course.inputsDirectoryPath, "videos")
+
+    def snapshot(self):
+        """
+        Returns the modification time and size of every watched file by
+        path.
+        """
+        snapshot = {}
+        for directoryPath in (
+                os.path.dirname(self.course.questionsFilePath),
+                self._videosDirectoryPath(),
+                self.course.templatesDirectoryPath):
+            for walkedDirectoryPath, _, fileNames in os.walk(directoryPath):
+                for fileName in fileNames:
+                    filePath = os.path.join(walkedDirectoryPath, fileName)
+                    try:
+                        fileStatus = os.stat(filePath)
+                    except OSError:
+                        # Removed since the directory was listed.
+                        continue
+                    snapshot[filePath] = (fileStatus.st_mtime_ns,
+                                          fileStatus.st_size)
+        return snapshot
+
+    def waitForChanges(self, snapshot: dict):
+        """
+        Blocks until the watched files differ from snapshot and have then
+        stopped changing. Returns the new snapshot and the paths of every
+        file that changed, appeared or disappeared.
+        """
+        changedSnapshot = snapshot
+        while changedSnapshot == snapshot:
+            time.sleep(self.pollSeconds)
+            changedSnapshot = self.snapshot()
+        while True:
+            time.sleep(self.debounceSeconds)
+            settledSnapshot = self.snapshot()
+            if settledSnapshot == changedSnapshot:
+                break
+            changedSnapshot = settledSnapshot
+        changedPaths = {
+            path for path in snapshot.keys() | changedSnapshot.keys()
+            if snapshot.get(path) != changedSnapshot.get(path)
+        }
+        return changedSnapshot, changedPaths
+
+    def rebuild(self, changedPaths: set = None, writePackage: bool = None):
+        """
+        Rebuilds whatever changedPaths affect, or everything when it's None.
+        The package is written on the first build, when there's no stage
+        directory, or when writePackage says so. Returns whether the video
+        was combined again.
+        """
+        course = self.course
+        rebuildVideo = changedPaths is None or self._videos is None or any(
+            path.startswith(self._videosDirectoryPath() + os.sep)
+            for path in changedPaths)
+        interactionTimes = None
+        if not rebuildVideo and course.questionsFilePath in changedPaths:
+            # Interactions that moved need keyframes where they are now.
+            interactionTimes = courseInteractionTimes(course, self._videos)
+            rebuildVideo = interactionTimes != self._interactionTimes
+        if changedPaths is None or any(
+                path.startswith(course.templatesDirectoryPath + os.sep)
+                for path in changedPaths):
+            # Templates are otherwise cached for the life of the process.
+            templateRegistry.invalidate()
+        if writePackage is None:
+            writePackage = changedPaths is None \
+                or not course.stageDirectoryPath
+        buildCache = None
+        if course.useBuildCache:
+            buildCache = BuildCache(course.cacheDirectoryPath,
+                                    course.cacheMaxBytes)
+        try:
+            if rebuildVideo:
+                videos = prepareCourse(course)
+                if interactionTimes is None:
+                    interactionTimes = courseInteractionTimes(course, videos)
+                videoSource = buildCourseVideo(course, videos, buildCache,
+                                               interactionTimes)
+                self._keyframeIndex = courseKeyframeIndex(videoSource)
+                self._videos, self._videoSource = videos, videoSource
+                self._interactionTimes = interactionTimes
+            packageCourse(course, self._videos, self._videoSource, buildCache,
+                          keyframeIndex=self._keyframeIndex,
+                          writePackage=writePackage)
+            self._packageStale = not writePackage
+        finally:
+            if buildCache:
+                buildCache.close()
+        return rebuildVideo
+
+    def _rebuildAndReport(self, changedPaths: set = None,
+                          writePackage: bool = None):
+        startTime = time.perf_counter()
+        try:
+            rebuiltVideo = self.rebuild(changedPaths, writePackage)
+        except Exception as error:
+            # Authors are usually halfway through an edit, so failures are
+            # reported and the next save is waited for.
+            print("Rebuild failed: {}".format(
+                error if isinstance(error, (QuestionsParseError,
+                                            ContentValidationError,
+                                            StagingError))
+                else "{}: {}".format(type(error).__name__, error)))
+            return
+        print("Rebuilt {} in {:.2f}s{}".format(
+            "video and content" if rebuiltVideo else "content",
+            time.perf_counter() - startTime,
+            " after changes to {}".format(", ".join(sorted(
+                os.path.basename(path) for path in changedPaths)))
+            if changedPaths else ""))
+
+    def run(self):
+        """
+        Builds the course and then rebuilds it after every change until
+        interrupted with Ctrl+C.
+        """
+        snapshot = self.snapshot()
+        self._rebuildAndReport()
+        print("Watching {} and {} for changes. Press Ctrl+C to stop.".format(
+            self.course.inputsDirectoryPath,
+            self.course.templatesDirectoryPath))
+        try:
+            while True:
+                snapshot, changedPaths = self.waitForChanges(snapshot)
+                self._rebuildAndReport(changedPaths)
+        except KeyboardInterrupt:
+            pass
+        if self._packageStale:
+            print("Writing {}".format(self.course.outputFilePath))
+            self._rebuildAndReport(set(), writePackage=True)
+
+
+class BuildResult:
+    """
+    Outcome of building one course in a batch.
+    """
+
+    course: CourseDefinition
+    succeeded: bool
+    error: str
+    seconds: float
+    # Spans the worker recorded, when tracing is on.
+    traceEvents: list
+
+    def __init__(self, course: CourseDefinition, succeeded: bool,
+                 error: str = "", seconds: float = 0.0,
+                 traceEvents: list = None):
+        self.course = course
+        self.succeeded = succeeded
+        self.error = error
+        self.seconds = seconds
+        self.traceEvents = traceEvents if traceEvents else []
+
+    def describe(self):
+        if self.succeeded:
+            return "[done] {} -> {} ({:.1f}s)".format(
+                self.course.title, self.course.outputFilePath, self.seconds)
+        return "[failed] {}: {}".format(self.course.title, self.error)
+
+
+def _buildCourseJob(course: CourseDefinition, trace: bool = False,
+                    traceMemory: bool = False, originTime: float = 0.0):
+    # Runs in a worker process. Any failure is reported in the result so one
+    # broken course doesn't take the rest of the batch down with it. Spans
+    # are sent back with the result, on the parent's clock.
+    tracer.reset()
+    tracer.originTime = originTime
+    if trace:
+        tracer.enable(traceMemory)
+    startTime = time.perf_counter()
+    try:
+        buildCourse(course)
+    except Exception as error:
+        return BuildResult(course, False,
+                           "{}: {}".format(type(error).__name__, error),
+                           time.perf_counter() - startTime, tracer.events)
+    return BuildResult(course, True, seconds=time.perf_counter() - startTime,
+                       traceEvents=tracer.events)
+
+
+def buildCourses(courses: list, workers: int = None, onResult=None):
+    """
+    Builds every course concurrently in a pool of worker processes and
+    returns their BuildResults in the order the courses were given.
+
+    workers defaults to the number of CPUs. onResult, when given, is called
+    with each BuildResult as soon as that course finishes. When the tracer is
+    enabled, every worker's spans are merged into it.
+    """
+    results = [None] * len(courses)
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers) as executor:
+        futures = {executor.submit(_buildCourseJob, course, tracer.enabled,
+                                   tracer.traceMemory, tracer.originTime):
+                   index
+                   for index, course in enumerate(courses)}
+        for future in concurrent.futures.as_completed(futures):
+            index = futures[future]
+            try:
+                result = future.result()
+            except Exception as error:
+                # The worker itself died, e.g. killed by the OS.
+                result = BuildResult(courses[index], False,
+                                     "{}: {}".format(type(error).__name__,
+                                                     error))
+            results[index] = result
+            tracer.merge(result.traceEvents)
+            if onResult:
+                onResult(result)
+    return results
+
+
+def parseArguments(arguments: list = None):
+    parser = argparse.ArgumentParser(
+        description="Generates H5P interactive videos from video clips and "
+                    "questions files."
+    )
+    parser.add_argument(
+        "--concat-mode",
+        choices=["copy", "reencode"],
+        default="copy",
+        help="copy remuxes the clips without decoding them and only "
+             "re-encodes clips that don't match the rest. reencode decodes "
+             "and re-encodes every clip. Defaults to copy."
     )
+    parser.add_argument(
+        "--output",
+        help="Path of the .h5p package to write. Defaults to "
+             "outputs/interactive_video.h5p."
+    )
+    parser.add_argument(
+        "--inputs",
+        default="inputs",
+        help="Directory with the videos and questions directories. Defaults "
+             "to inputs."
+    )
+    parser.add_argument(
+        "--title",
+        default="Raj Nadakuditi's Lecture",
+        help="Title of the interactive video."
+    )
+    parser.add_argument(
+        "--video-type",
+        default="mov",
+        help="Extension of the input video clips. Defaults to mov."
+    )
+    parser.add_argument(
+        "--questions",
+        help="Questions file to use instead of questions/questions.txt in "
+             "the inputs directory: a questions.txt style .txt file, a QTI "
+             "1.2 or 2.1 .xml question bank or a .csv question bank. QTI "
+             "content package .zip files have to be unzipped first. - "
+             "reads questions.txt style questions from stdin."
+    )
+    parser.add_argument(
+        "--section-key",
+        default="video",
+        help="CSV column, or QTI item attribute, metadata field or section "
+             "attribute, naming the video each question of a question bank "
+             "is for, by file name with or without the extension. "
+             "section.title maps QTI sections to videos by their titles. "
+             "Defaults to video."
+    )
+    parser.add_argument(
+        "--templates",
+        default="templates",
+        help="Templates directory. Defaults to templates."
+    )
+    parser.add_argument(
+        "--encode-workers",
+        type=int,
+        help="Number of ffmpeg processes re-encoding clips at the same time. "
+             "1 encodes the whole video with moviepy instead. Defaults to the "
+             "number of CPUs."
+    )
+    parser.add_argument(
+        "--chunk-seconds",
+        type=float,
+        default=60.0,
+        help="Length of the chunks long clips are split into when they're "
+             "re-encoded in parallel. 0 encodes whole clips. Defaults to 60."
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Build everything from scratch without reading or writing the "
+             "build cache."
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=float,
+        default=10.0,
+        help="Size in GB the build cache is trimmed down to. Defaults to 10."
+    )
+    parser.add_argument(
+        "--manifest",
+        help="JSON manifest of courses to build in one batch instead of a "
+             "single course."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of courses built at the same time in batch mode. "
+             "Defaults to the number of CPUs."
+    )
+    parser.add_argument(
+        "--stage",
+        help="Also unpacks the package into this directory, e.g. for a "
+             "preview server. Libraries are hard linked from a store in the "
+             "cache directory and only changed files are replaced. The "
+             "directory has to be new, empty or staged into before, since "
+             "files earlier stages put there are removed."
+    )
+    parser.add_argument(
+        "--renditions",
+        type=lambda heights: [int(height) for height in heights.split(",")],
+        help="Comma separated heights, e.g. 720,480,360, to also encode the "
+             "video at. The player offers them as quality levels."
+    )
+    parser.add_argument(
+        "--interaction-window",
+        type=float,
+        default=interactionWindowSeconds,
+        help="Seconds every question set is shown for. Defaults to 2."
+    )
+    parser.add_argument(
+        "--validate",
+        action="store_true",
+        help="Checks the content against the semantics.json of the "
+             "libraries it uses while it's written and fails the build at "
+             "the first question H5P would reject or alter."
+    )
+    parser.add_argument(
+        "--render-math",
+        action="store_true",
+        help="Checks the TeX in questions and choices, like $x^2$ or "
+             "\\alpha, while building and puts it in the \\( \\) and "
+             "\\[ \\] delimiters H5P's MathDisplay typesets, so it shows up "
+             "as math in the player. TeX that can't be rendered is left as "
+             "it is, with a warning. Needs latex2mathml."
+    )
+    parser.add_argument(
+        "--bundle-libraries",
+        action="store_true",
+        help="Packages every library with its preloaded scripts and styles "
+             "minified into one file each and without the font formats "
+             "only old browsers use. Bundled libraries get the next patch "
+             "version, so sites replace the unbundled ones. Bundles are "
+             "cached per library version. Minifying needs rjsmin and "
+             "rcssmin."
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keeps running and rebuilds the course whenever its questions, "
+             "templates or clips change. Use with --stage to preview the "
+             "changes as they're made."
+    )
+    parser.add_argument(
+        "--trace",
+        help="Writes a Chrome trace of every build stage to this file. Open "
+             "it in chrome://tracing or Perfetto."
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Prints how long every build stage took when done."
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="Also traces the peak Python memory of every stage. Slows the "
+             "build down."
+    )
+    return parser.parse_args(arguments)
+
 
-    content = Content(questionSets=questionSets)
-    h5pTitle = "Raj Nadakuditi's Lecture"
-    h5pMetaData = H5PMetaData(title=h5pTitle)
-    h5p.export(content=content, h5pMetaData=h5pMetaData)
+def _reportTrace(options):
+    if options.trace:
+        tracer.writeChromeTrace(options.trace)
+        print("Wrote trace to {}".format(options.trace))
+    if options.profile:
+        print(tracer.summary())
 
-    # Zip h5p directory
+
+def main(arguments: list = None):
+    options = parseArguments(arguments)
+    concatMode = ConcatMode.STREAM_COPY if options.concat_mode == "copy" \
+        else ConcatMode.REENCODE
+    templatesDirectoryPath = os.path.abspath(options.templates)
+
+    cacheMaxBytes = int(options.cache_size * 1024 ** 3)
+    if options.trace or options.profile or options.trace_memory:
+        tracer.enable(traceMemory=options.trace_memory)
+
+    if options.manifest:
+        if options.watch:
+            exit("--watch only works with a single course.")
+        courses = loadManifest(options.manifest, templatesDirectoryPath)
+        for course in courses:
+            course.useBuildCache = not options.no_cache
+            course.cacheMaxBytes = cacheMaxBytes
+            course.encodeWorkers = options.encode_workers
+            course.chunkSeconds = options.chunk_seconds
+            course.validateContent = course.validateContent \
+                or options.validate
+            course.renderMath = course.renderMath or options.render_math
+            course.bundleLibraries = course.bundleLibraries \
+                or options.bundle_libraries
+        results = buildCourses(
+            courses,
+            workers=options.workers,
+            onResult=lambda result: print(result.describe())
+        )
+        failures = sum(1 for result in results if not result.succeeded)
+        print("Built {} of {} course(s).".format(len(results) - failures,
+                                                 len(results)))
+        _reportTrace(options)
+        if failures:
+            exit(1)
+        return
+
+    outputFilePath = options.output if options.output else os.path.join(
+        "outputs",
+        "interactive_video.h5p"
+    )
+    course = CourseDefinition(
+        title=options.title,
+        inputsDirectoryPath=os.path.abspath(options.inputs),
+        outputFilePath=os.path.abspath(outputFilePath),
+        templatesDirectoryPath=templatesDirectoryPath,
+        inputVideoType=options.video_type,
+        concatMode=concatMode,
+        useBuildCache=not options.no_cache,
+        cacheMaxBytes=cacheMaxBytes,
+        encodeWorkers=options.encode_workers,
+        chunkSeconds=options.chunk_seconds,
+        stageDirectoryPath=os.path.abspath(options.stage) if options.stage
+        else None,
+        renditions=options.renditions,
+        interactionWindowSeconds=options.interaction_window,
+        validateContent=options.validate,
+        questionsFilePath=os.path.abspath(options.questions)
+        if options.questions and options.questions != "-" else None,
+        sectionKey=options.section_key,
+        renderMath=options.render_math,
+        bundleLibraries=options.bundle_libraries
+    )
+    if options.questions == "-":
+        # Questions are read again by every build step, but stdin can only
+        # be read once, so it's saved into the build directory first.
+        if options.watch:
+            exit("--watch can't watch questions read from stdin.")
+        os.makedirs(course.buildDirectoryPath, exist_ok=True)
+        course.questionsFilePath = os.path.join(course.buildDirectoryPath,
+                                                "stdin_questions.txt")
+        with open(course.questionsFilePath, "w") as questionsFile:
+            shutil.copyfileobj(sys.stdin, questionsFile)
+    if options.watch:
+        CourseWatcher(course).run()
+        _reportTrace(options)
+        return
+    try:
+        packageFilePath = buildCourse(course)
+    except (QuestionsParseError, ContentValidationError, StagingError) \
+            as error:
+        exit(str(error))
+    print("Wrote {}".format(packageFilePath))
+    _reportTrace(options)
 
 
 if __name__ == "__main__":
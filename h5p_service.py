@@ -0,0 +1,568 @@
+import os
+import json
+import time
+import asyncio
+import socket
+import argparse
+import mimetypes
+import posixpath
+import zipfile
+import itertools
+import concurrent.futures
+from collections import OrderedDict
+from urllib.parse import unquote
+
+from h5p_generator import BuildCache, ContentValidationError, \
+    CourseDefinition, CourseTemplates, LibraryResolver, QuestionsParseError, \
+    buildCourseVideo, packageCourse, prepareCourse, templateRegistry, \
+    _ffmpegBinary
+
+
+def _buildVideoJob(course: CourseDefinition, videos: list):
+    # Runs in the video process pool. Returns what buildCourseVideo does and
+    # what the build cache did.
+    buildCache = None
+    if course.useBuildCache:
+        buildCache = BuildCache(course.cacheDirectoryPath,
+                                course.cacheMaxBytes)
+    try:
+        videoSource = buildCourseVideo(course, videos, buildCache)
+        return videoSource, buildCache.describe() if buildCache else "off"
+    finally:
+        if buildCache:
+            buildCache.close()
+
+
+def _packageJob(course: CourseDefinition, videos: list, videoSource):
+    # Runs on a thread of the service process, where templates and library
+    # graphs stay loaded between jobs.
+    buildCache = None
+    if course.useBuildCache:
+        buildCache = BuildCache(course.cacheDirectoryPath,
+                                course.cacheMaxBytes)
+    try:
+        return packageCourse(course, videos, videoSource, buildCache)
+    finally:
+        if buildCache:
+            buildCache.close()
+
+
+def _warmWorker():
+    # Finding ffmpeg is slow the first time, so video workers do it up front.
+    _ffmpegBinary()
+
+
+class JobState:
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class Job:
+    """
+    A course build submitted to the service, with everything that has
+    happened to it so far.
+    """
+
+    id: str
+    course: CourseDefinition
+    state: str
+    events: list
+    error: str
+    submittedTime: float
+    seconds: float
+
+    def __init__(self, jobId: str, course: CourseDefinition):
+        self.id = jobId
+        self.course = course
+        self.state = JobState.QUEUED
+        self.events = []
+        self.error = ""
+        self.submittedTime = time.time()
+        self.seconds = 0.0
+        self.changed = asyncio.Condition()
+
+    @property
+    def finished(self):
+        return self.state in (JobState.DONE, JobState.FAILED)
+
+    async def addEvent(self, eventType: str, **data):
+        data["type"] = eventType
+        data["time"] = time.time()
+        async with self.changed:
+            self.events.append(data)
+            self.changed.notify_all()
+
+    def toDict(self):
+        return {
+            "id": self.id,
+            "title": self.course.title,
+            "output": self.course.outputFilePath,
+            "state": self.state,
+            "error": self.error,
+            "seconds": self.seconds,
+            "submittedTime": self.submittedTime,
+            "events": self.events
+        }
+
+
+class HTTPError(Exception):
+    status: int
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+_statusReasons = {200: "OK", 202: "Accepted", 400: "Bad Request",
+                  403: "Forbidden", 404: "Not Found",
+                  405: "Method Not Allowed", 413: "Payload Too Large",
+                  415: "Unsupported Media Type",
+                  500: "Internal Server Error"}
+# Largest request body read. Course definitions are a few hundred bytes.
+maxRequestBodyBytes = 1024 * 1024
+# Course keys holding paths, checked to stay inside the base directory.
+_coursePathKeys = ("inputs", "output", "questions", "templates")
+_loopbackHosts = ("127.0.0.1", "localhost", "[::1]")
+
+
+def _isInside(path: str, directoryPath: str):
+    # Whether path, once symlinks and ".." are resolved, is directoryPath or
+    # inside it.
+    directoryPath = os.path.realpath(directoryPath)
+    return os.path.commonpath(
+        [os.path.realpath(path), directoryPath]) == directoryPath
+
+
+class BuildService:
+    """
+    Builds courses in a long running process so templates, library
+    dependency graphs, moviepy and ffmpeg only have to be loaded once.
+
+    Jobs are queued and at most `concurrency` of them are built at once.
+    Video work runs in a pool of `videoWorkers` processes while packaging
+    runs on threads of this process, so rebuilds whose video is already in
+    the build cache only take as long as writing the package.
+
+    The HTTP API, over TCP or a Unix socket:
+
+    - POST /jobs with a course like those in a manifest queues a build.
+      Its paths have to stay inside baseDirectoryPath and it can't be
+      staged, since anything that can reach the service can submit one.
+    - GET /jobs and GET /jobs/<id> report on builds.
+    - GET /jobs/<id>/events streams a build's progress as server-sent
+      events.
+    - GET /jobs/<id>/package downloads the built package.
+    - GET /preview/<id>/ plays the built package with the player in
+      serverDirectoryPath, which is also served as it is from /.
+    """
+
+    templatesDirectoryPath: str
+    serverDirectoryPath: str
+    baseDirectoryPath: str
+    concurrency: int
+    videoWorkers: int
+    useBuildCache: bool
+    cacheMaxBytes: int
+    jobs: OrderedDict
+    # Host headers requests may have, or None to accept any, like on a
+    # Unix socket browsers can't reach.
+    allowedHosts: set
+
+    def __init__(self, templatesDirectoryPath: str, serverDirectoryPath: str,
+                 baseDirectoryPath: str = None, concurrency: int = 2,
+                 videoWorkers: int = None, useBuildCache: bool = True,
+                 cacheMaxBytes: int = 10 * 1024 ** 3):
+        self.templatesDirectoryPath = templatesDirectoryPath
+        self.serverDirectoryPath = serverDirectoryPath
+        # Relative paths in submitted courses are relative to this.
+        self.baseDirectoryPath = baseDirectoryPath if baseDirectoryPath \
+            else os.getcwd()
+        self.concurrency = concurrency
+        self.videoWorkers = videoWorkers if videoWorkers \
+            else os.cpu_count() or 1
+        self.useBuildCache = useBuildCache
+        self.cacheMaxBytes = cacheMaxBytes
+        self.jobs = OrderedDict()
+        self.allowedHosts = None
+        self._jobIds = itertools.count(1)
+        self._queue = None
+        self._videoPool = None
+        # Template file path -> modification time it was loaded at.
+        self._templateModifiedTimes = {}
+
+    def _refreshTemplates(self, templatesDirectoryPath: str):
+        # Templates edited since they were loaded are read again.
+        for fileName in sorted(os.listdir(templatesDirectoryPath)):
+            templatePath = os.path.join(templatesDirectoryPath, fileName)
+            if not fileName.endswith(".json"):
+                continue
+            modifiedTime = os.stat(templatePath).st_mtime_ns
+            loadedModifiedTime = self._templateModifiedTimes.get(templatePath)
+            if loadedModifiedTime is not None \
+                    and loadedModifiedTime != modifiedTime:
+                templateRegistry.invalidate(templatePath)
+            self._templateModifiedTimes[templatePath] = modifiedTime
+
+    def warmUp(self):
+        """
+        Loads the default templates and library graph and starts the video
+        workers.
+        """
+        self._refreshTemplates(self.templatesDirectoryPath)
+        for templatePath in self._templateModifiedTimes:
+            templateRegistry.load(templatePath)
+        LibraryResolver(
+            CourseTemplates(
+                self.templatesDirectoryPath).packageTemplateDirectoryPath
+        ).graph()
+        _ffmpegBinary()
+        self._videoPool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.videoWorkers, initializer=_warmWorker)
+
+    def submit(self, definition: dict):
+        """
+        Queues a build of the course described by definition and returns
+        its Job.
+        """
+        if not isinstance(definition, dict):
+            raise HTTPError(400, "Invalid course: not a JSON object.")
+        if "stage" in definition:
+            raise HTTPError(400, "Courses can't be staged through the "
+                                 "service. Preview them at /preview/<id>/.")
+        try:
+            course = CourseDefinition.fromDict(definition,
+                                               self.baseDirectoryPath,
+                                               self.templatesDirectoryPath)
+        except (KeyError, TypeError) as error:
+            raise HTTPError(400, "Invalid course: {}".format(error))
+        coursePaths = {"inputs": course.inputsDirectoryPath,
+                       "output": course.outputFilePath,
+                       "questions": course.questionsFilePath,
+                       "templates": course.templatesDirectoryPath}
+        for key in _coursePathKeys:
+            if key in definition and not _isInside(coursePaths[key],
+                                                   self.baseDirectoryPath):
+                raise HTTPError(400, "\"{}\" has to be inside {}.".format(
+                    key, self.baseDirectoryPath))
+        course.useBuildCache = self.useBuildCache
+        course.cacheMaxBytes = self.cacheMaxBytes
+        course.encodeWorkers = definition.get("encodeWorkers")
+        job = Job(str(next(self._jobIds)), course)
+        self.jobs[job.id] = job
+        self._queue.put_nowait(job)
+        return job
+
+    async def _runJob(self, job: Job):
+        loop = asyncio.get_running_loop()
+        course = job.course
+        startTime = time.perf_counter()
+        job.state = JobState.RUNNING
+        await job.addEvent("started")
+        try:
+            videos = await asyncio.to_thread(prepareCourse, course)
+            await job.addEvent("videosImported", clips=len(videos))
+            videoSource, cache = await loop.run_in_executor(
+                self._videoPool, _buildVideoJob, course, videos)
+            await job.addEvent("videoCombined", cache=cache)
+            self._refreshTemplates(course.templatesDirectoryPath)
+            await asyncio.to_thread(_packageJob, course, videos,
+                                    videoSource)
+        except Exception as error:
+            job.state = JobState.FAILED
+            job.error = str(error) if isinstance(
+                error, (QuestionsParseError, ContentValidationError)) \
+                else "{}: {}".format(type(error).__name__, error)
+            job.seconds = time.perf_counter() - startTime
+            await job.addEvent("failed", error=job.error,
+                               seconds=job.seconds)
+            return
+        job.state = JobState.DONE
+        job.seconds = time.perf_counter() - startTime
+        await job.addEvent("done", output=course.outputFilePath,
+                           seconds=job.seconds)
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._runJob(job)
+            finally:
+                self._queue.task_done()
+
+    def _job(self, jobId: str):
+        job = self.jobs.get(jobId)
+        if not job:
+            raise HTTPError(404, "No job {}.".format(jobId))
+        return job
+
+    @staticmethod
+    async def _readRequest(reader: asyncio.StreamReader):
+        requestLine = (await reader.readline()).decode("latin-1").strip()
+        if not requestLine:
+            return None
+        try:
+            method, target, _ = requestLine.split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "Malformed request line.")
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        body = b""
+        try:
+            contentLength = int(headers.get("content-length", 0))
+        except ValueError:
+            raise HTTPError(400, "Malformed Content-Length.")
+        if contentLength < 0:
+            raise HTTPError(400, "Malformed Content-Length.")
+        if contentLength > maxRequestBodyBytes:
+            # Checked before reading, so the body is never buffered.
+            raise HTTPError(413, "Request bodies are limited to {} "
+                                 "bytes.".format(maxRequestBodyBytes))
+        if contentLength:
+            body = await reader.readexactly(contentLength)
+        return method, unquote(target.partition("?")[0]), headers, body
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int,
+                       body: bytes, contentType: str = "application/json"):
+        writer.write("HTTP/1.1 {} {}\r\nContent-Type: {}\r\n"
+                     "Content-Length: {}\r\nConnection: close\r\n\r\n"
+                     .format(status, _statusReasons.get(status, ""),
+                             contentType, len(body)).encode())
+        writer.write(body)
+        await writer.drain()
+
+    async def _respondJSON(self, writer: asyncio.StreamWriter, status: int,
+                           value):
+        await self._respond(writer, status, json.dumps(value).encode())
+
+    async def _streamEvents(self, writer: asyncio.StreamWriter, job: Job):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                     b"Cache-Control: no-cache\r\nConnection: close\r\n\r\n")
+        sentEvents = 0
+        while True:
+            async with job.changed:
+                await job.changed.wait_for(
+                    lambda: len(job.events) > sentEvents)
+                events = job.events[sentEvents:]
+            for event in events:
+                writer.write("event: {}\ndata: {}\n\n".format(
+                    event["type"], json.dumps(event)).encode())
+            sentEvents += len(events)
+            await writer.drain()
+            if job.finished and sentEvents == len(job.events):
+                return
+
+    def _readStaticFile(self, rootDirectoryPath: str, relativePath: str):
+        # Only files inside rootDirectoryPath can be served.
+        relativePath = posixpath.normpath("/" + relativePath).lstrip("/")
+        filePath = os.path.join(rootDirectoryPath, relativePath)
+        if os.path.isdir(filePath):
+            filePath = os.path.join(filePath, "index.html")
+        if not os.path.isfile(filePath):
+            raise HTTPError(404, "No file {}.".format(relativePath))
+        with open(filePath, "rb") as staticFile:
+            return staticFile.read(), filePath
+
+    @staticmethod
+    def _readPackageMember(packageFilePath: str, memberName: str):
+        # Previews read straight out of the package instead of unpacking it.
+        try:
+            with zipfile.ZipFile(packageFilePath) as package:
+                return package.read(posixpath.normpath(memberName))
+        except (OSError, KeyError, zipfile.BadZipFile):
+            raise HTTPError(404, "No {} in the package.".format(memberName))
+
+    async def _preview(self, writer: asyncio.StreamWriter, path: str):
+        # The player page is at /preview/<id>/ and loads the package from
+        # /preview/<id>/h5p and the player from /preview/h5p-lib.
+        jobId, _, rest = path.partition("/")
+        if jobId == "h5p-lib":
+            body, filePath = self._readStaticFile(
+                os.path.join(self.serverDirectoryPath, "h5p-lib"), rest)
+        elif rest.startswith("h5p/"):
+            job = self._job(jobId)
+            if job.state != JobState.DONE:
+                raise HTTPError(404, "Job {} isn't done.".format(jobId))
+            filePath = rest[len("h5p/"):]
+            body = await asyncio.to_thread(self._readPackageMember,
+                                           job.course.outputFilePath,
+                                           filePath)
+        else:
+            self._job(jobId)
+            body, filePath = self._readStaticFile(
+                os.path.join(self.serverDirectoryPath, "svd"), "index.html")
+        await self._respond(writer, 200, body,
+                            mimetypes.guess_type(filePath)[0]
+                            or "application/octet-stream")
+
+    def _checkRequest(self, method: str, path: str, headers: dict):
+        # Turns away requests from web pages on other origins, including
+        # ones that rebound their own host name to this address.
+        if self.allowedHosts is not None:
+            if headers.get("host", "").lower() not in self.allowedHosts:
+                raise HTTPError(403, "Unexpected Host header.")
+            origin = headers.get("origin")
+            if origin is not None and origin.lower() not in {
+                    "http://" + host for host in self.allowedHosts}:
+                raise HTTPError(403, "Cross-origin requests aren't "
+                                     "allowed.")
+        # Browsers can only send JSON to other origins after a preflight
+        # request, which is never answered.
+        if method == "POST" and headers.get("content-type", "").partition(
+                ";")[0].strip().lower() != "application/json":
+            raise HTTPError(415, "Send courses as application/json.")
+
+    @staticmethod
+    def _hostNames(host: str, port: int):
+        # Host headers that name host:port.
+        hosts = _loopbackHosts if host in _loopbackHosts + ("::1",) \
+            else (host,)
+        if host in ("", "0.0.0.0", "::"):
+            hosts = _loopbackHosts + (socket.gethostname().lower(),
+                                      socket.getfqdn().lower())
+        names = {"{}:{}".format(name, port) for name in hosts}
+        if port == 80:
+            names.update(hosts)
+        return names
+
+    async def _route(self, method: str, path: str, headers: dict,
+                     body: bytes, writer: asyncio.StreamWriter):
+        self._checkRequest(method, path, headers)
+        parts = path.strip("/").split("/")
+        if parts[0] == "jobs":
+            if len(parts) == 1:
+                if method == "POST":
+                    try:
+                        definition = json.loads(body)
+                    except ValueError as error:
+                        raise HTTPError(400, "Invalid JSON: {}".format(error))
+                    job = self.submit(definition)
+                    await self._respondJSON(writer, 202, job.toDict())
+                    return
+                await self._respondJSON(
+                    writer, 200, [job.toDict() for job in self.jobs.values()])
+                return
+            job = self._job(parts[1])
+            if len(parts) == 2:
+                await self._respondJSON(writer, 200, job.toDict())
+            elif parts[2] == "events":
+                await self._streamEvents(writer, job)
+            elif parts[2] == "package" and job.state == JobState.DONE:
+                with open(job.course.outputFilePath, "rb") as packageFile:
+                    await self._respond(writer, 200, packageFile.read(),
+                                        "application/zip")
+            else:
+                raise HTTPError(404, "Not found.")
+            return
+        if method != "GET":
+            raise HTTPError(405, "Only GET is supported here.")
+        if parts[0] == "preview":
+            await self._preview(writer, "/".join(parts[1:]))
+            return
+        fileBody, filePath = self._readStaticFile(self.serverDirectoryPath,
+                                                  path)
+        await self._respond(writer, 200, fileBody,
+                            mimetypes.guess_type(filePath)[0]
+                            or "application/octet-stream")
+
+    async def _handleConnection(self, reader: asyncio.StreamReader,
+                                writer: asyncio.StreamWriter):
+        try:
+            request = await self._readRequest(reader)
+            if request:
+                method, path, headers, body = request
+                await self._route(method, path, headers, body, writer)
+        except HTTPError as error:
+            await self._respondJSON(writer, error.status,
+                                    {"error": str(error)})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as error:
+            await self._respondJSON(writer, 500, {
+                "error": "{}: {}".format(type(error).__name__, error)})
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8765,
+                    socketPath: str = None):
+        """
+        Serves the API until cancelled, on socketPath when given and on
+        host:port otherwise.
+        """
+        self._queue = asyncio.Queue()
+        await asyncio.to_thread(self.warmUp)
+        workers = [asyncio.create_task(self._worker())
+                   for _ in range(self.concurrency)]
+        if socketPath:
+            server = await asyncio.start_unix_server(self._handleConnection,
+                                                     path=socketPath)
+            print("Serving on {}".format(socketPath))
+        else:
+            self.allowedHosts = self._hostNames(host, port)
+            server = await asyncio.start_server(self._handleConnection,
+                                                host, port)
+            print("Serving on http://{}:{}".format(host, port))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            self._videoPool.shutdown(cancel_futures=True)
+
+
+def parseArguments(arguments: list = None):
+    parser = argparse.ArgumentParser(
+        description="Runs a local service building H5P interactive videos "
+                    "with warm caches."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--socket",
+                        help="Listens on this Unix socket instead of TCP.")
+    parser.add_argument("--templates", default="templates",
+                        help="Templates directory. Defaults to templates.")
+    parser.add_argument("--server", default="server",
+                        help="Player assets served for previews. Defaults "
+                             "to server.")
+    parser.add_argument("--concurrency", type=int, default=2,
+                        help="Number of jobs built at the same time. "
+                             "Defaults to 2.")
+    parser.add_argument("--video-workers", type=int,
+                        help="Number of processes doing video work. Defaults "
+                             "to the number of CPUs.")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Build everything from scratch without reading "
+                             "or writing the build cache.")
+    parser.add_argument("--cache-size", type=float, default=10.0,
+                        help="Size in GB the build cache is trimmed down to. "
+                             "Defaults to 10.")
+    return parser.parse_args(arguments)
+
+
+def main(arguments: list = None):
+    options = parseArguments(arguments)
+    service = BuildService(
+        templatesDirectoryPath=os.path.abspath(options.templates),
+        serverDirectoryPath=os.path.abspath(options.server),
+        concurrency=options.concurrency,
+        videoWorkers=options.video_workers,
+        useBuildCache=not options.no_cache,
+        cacheMaxBytes=int(options.cache_size * 1024 ** 3)
+    )
+    try:
+        asyncio.run(service.serve(options.host, options.port,
+                                  options.socket))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
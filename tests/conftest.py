@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+repositoryDirectoryPath = os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)))
+sys.path.insert(0, repositoryDirectoryPath)
+
+
+@pytest.fixture
+def templatesDirectoryPath():
+    return os.path.join(repositoryDirectoryPath, "templates")
+
+
+class FakeVideo:
+    """
+    Stands in for the VideoProbes importVideos returns.
+    """
+
+    def __init__(self, filename: str, duration: float = 10.0):
+        self.filename = filename
+        self.duration = duration
+
+
+@pytest.fixture
+def videos():
+    return [FakeVideo("1.mov"), FakeVideo("2.mov"), FakeVideo("3.mov")]
@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+from h5p_generator import LibraryBundler, listLibraryFiles
+
+
+@pytest.fixture
+def libraryDirectoryPath(tmp_path):
+    libraryDirectoryPath = tmp_path / "H5P.Test-1.0"
+    (libraryDirectoryPath / "scripts").mkdir(parents=True)
+    (libraryDirectoryPath / "styles").mkdir()
+    (libraryDirectoryPath / "fonts").mkdir()
+    (libraryDirectoryPath / "library.json").write_text(json.dumps({
+        "machineName": "H5P.Test", "majorVersion": 1, "minorVersion": 0,
+        "patchVersion": 4,
+        "preloadedJs": [{"path": "scripts/a.js"}, {"path": "scripts/b.js"}],
+        "preloadedCss": [{"path": "styles/test.css"}]
+    }))
+    (libraryDirectoryPath / "scripts" / "a.js").write_text("var a = 1")
+    (libraryDirectoryPath / "scripts" / "b.js").write_text("var b = 2;")
+    (libraryDirectoryPath / "styles" / "test.css").write_text(
+        "@font-face { font-family: test; "
+        "src: url('../fonts/test.eot') format('embedded-opentype'), "
+        "url('../fonts/test.woff') format('woff'); }\n"
+        ".test { background: url(test.png); }\n")
+    (libraryDirectoryPath / "styles" / "test.png").write_bytes(b"png")
+    (libraryDirectoryPath / "fonts" / "test.eot").write_bytes(b"eot")
+    (libraryDirectoryPath / "fonts" / "test.woff").write_bytes(b"woff")
+    return str(libraryDirectoryPath)
+
+
+def test_bundledLibrary(libraryDirectoryPath, tmp_path):
+    bundler = LibraryBundler(str(tmp_path / "bundles"))
+    bundleDirectoryPath = bundler.bundle(libraryDirectoryPath)
+    assert bundleDirectoryPath != libraryDirectoryPath
+    assert sorted(listLibraryFiles(bundleDirectoryPath)) == [
+        "fonts/test.woff", "h5p-bundle.min.css", "h5p-bundle.min.js",
+        "library.json", "styles/test.png"]
+
+    with open(bundleDirectoryPath + "/library.json") as libraryFile:
+        library = json.load(libraryFile)
+    assert library["patchVersion"] == 5
+    assert library["preloadedJs"] == [{"path": "h5p-bundle.min.js"}]
+    assert library["preloadedCss"] == [{"path": "h5p-bundle.min.css"}]
+
+    with open(bundleDirectoryPath + "/h5p-bundle.min.js") as scriptFile:
+        script = scriptFile.read()
+    # Minified or not, depending on whether rjsmin is installed.
+    assert script.replace(" ", "") == "vara=1;\nvarb=2;"
+    with open(bundleDirectoryPath + "/h5p-bundle.min.css") as styleFile:
+        style = styleFile.read()
+    assert "fonts/test.woff" in style and "test.eot" not in style
+    assert "styles/test.png" in style
+    assert bundler.statistics["H5P.Test-1.0"][2:] == (3, 2)
+
+
+def test_bundlesAreReused(libraryDirectoryPath, tmp_path):
+    bundleDirectoryPath = LibraryBundler(str(tmp_path / "bundles")).bundle(
+        libraryDirectoryPath)
+    assert LibraryBundler(str(tmp_path / "bundles")).bundle(
+        libraryDirectoryPath) == bundleDirectoryPath
+
+
+def test_librariesMissingTheirFilesAreLeftAlone(libraryDirectoryPath,
+                                                tmp_path):
+    with open(libraryDirectoryPath + "/library.json", "w") as libraryFile:
+        json.dump({"preloadedJs": [{"path": "missing.js"}]}, libraryFile)
+    assert LibraryBundler(str(tmp_path / "bundles")).bundle(
+        libraryDirectoryPath) == libraryDirectoryPath
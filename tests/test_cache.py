@@ -0,0 +1,104 @@
+import itertools
+import json
+import os
+
+import pytest
+
+import h5p_generator
+from h5p_generator import BuildCache, Choice, QuestionSet, \
+    SingleChoiceQuestion, templateRegistry
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Every entry is used at a different time, so least recently used is
+    # well defined however fast the test runs.
+    times = itertools.count(1)
+    monkeypatch.setattr(h5p_generator.time, "time",
+                        lambda: float(next(times)))
+
+
+@pytest.fixture
+def cache(tmp_path, clock):
+    cache = BuildCache(str(tmp_path / "cache"), maxBytes=10)
+    yield cache
+    cache.close()
+
+
+def test_putValuesAreHits(cache):
+    cache.put("math", "key", b"value")
+    assert cache.get("math", "key") == b"value"
+    assert cache.get("math", "other") is None
+    assert cache.get("video", "key") is None
+    assert cache.describe() \
+        == "math: 1 hit(s), 1 miss(es); video: 0 hit(s), 1 miss(es)"
+
+
+def test_filesAreHits(cache, tmp_path):
+    sourceFilePath = tmp_path / "video.mp4"
+    sourceFilePath.write_bytes(b"frames")
+    destinationFilePath = str(tmp_path / "copy.mp4")
+    assert not cache.getFile("video", "key", destinationFilePath)
+    cache.putFile("video", "key", str(sourceFilePath))
+    assert cache.getFile("video", "key", destinationFilePath)
+    with open(destinationFilePath, "rb") as destinationFile:
+        assert destinationFile.read() == b"frames"
+
+
+def test_entriesPersistAcrossInstances(cache, tmp_path):
+    cache.put("math", "key", b"value")
+    reopened = BuildCache(str(tmp_path / "cache"), maxBytes=10)
+    assert reopened.get("math", "key") == b"value"
+    reopened.close()
+
+
+def test_changedClipsGetNewKeys(cache, tmp_path):
+    clipFilePath = tmp_path / "1.mov"
+    clipFilePath.write_bytes(b"first take")
+    key = cache.key("video", cache.hashFile(str(clipFilePath)))
+    clipFilePath.write_bytes(b"second take")
+    os.utime(str(clipFilePath), ns=(0, 0))
+    assert cache.key("video", cache.hashFile(str(clipFilePath))) != key
+
+
+def test_changedTemplatesGetNewKeys(tmp_path, templatesDirectoryPath):
+    templatePath = tmp_path / "template_question_single_choice.json"
+    with open(os.path.join(templatesDirectoryPath,
+                           templatePath.name)) as templateFile:
+        template = json.load(templateFile)
+    templatePath.write_text(json.dumps(template))
+    questionSet = QuestionSet([SingleChoiceQuestion(
+        "Why?", [Choice("Yes", True)], str(templatePath))])
+    fingerprint = questionSet.fingerprint()
+    assert QuestionSet(questionSet.questions).fingerprint() == fingerprint
+    template["params"]["behaviour"]["enableRetry"] = False
+    templatePath.write_text(json.dumps(template))
+    templateRegistry.invalidate(str(templatePath))
+    assert questionSet.fingerprint() != fingerprint
+
+
+def test_leastRecentlyUsedEntriesAreEvicted(cache):
+    cache.put("math", "a", b"aaaa")
+    cache.put("math", "b", b"bbbb")
+    assert cache.get("math", "a") == b"aaaa"
+    cache.put("math", "c", b"cccc")
+    assert cache.get("math", "b") is None
+    assert cache.get("math", "a") == b"aaaa"
+    assert cache.get("math", "c") == b"cccc"
+
+
+def test_replacedEntriesOnlyCountOnce(cache):
+    for _ in range(5):
+        cache.put("math", "a", b"aaaa")
+    cache.put("math", "b", b"bbbb")
+    assert cache.get("math", "a") == b"aaaa"
+    assert cache.get("math", "b") == b"bbbb"
+
+
+def test_evictedFilesAreRemoved(cache, tmp_path):
+    sourceFilePath = tmp_path / "video.mp4"
+    sourceFilePath.write_bytes(b"0123456789")
+    cache.putFile("video", "first", str(sourceFilePath))
+    cache.putFile("video", "second", str(sourceFilePath))
+    assert os.listdir(str(tmp_path / "cache" / "files")) \
+        == ["video-second.mp4"]
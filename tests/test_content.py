@@ -0,0 +1,76 @@
+import io
+import json
+import os
+
+import pytest
+
+from h5p_generator import Content, iterQuestionSets, templateRegistry, \
+    tokenizeQuestions
+
+questions = """video: 1.mov
+
+1. What is 2+3?
+a)  6
+*c) 5
+
+video: 3.mov
+
+1. Which of the following are dinosaurs?
+[ ] Woolly mammoth
+[*] Tyrannosaurus rex
+[*] Triceratops "rex"
+"""
+
+
+@pytest.fixture
+def questionSets(videos, templatesDirectoryPath):
+    return list(iterQuestionSets(tokenizeQuestions(questions.splitlines()),
+                                 videos, templatesDirectoryPath))
+
+
+@pytest.fixture
+def templatePaths(templatesDirectoryPath):
+    return (os.path.join(templatesDirectoryPath, "template_content.json"),
+            os.path.join(templatesDirectoryPath, "template_interaction.json"))
+
+
+def assertWritesWhatToDictReturns(content: Content, contentTemplatePath: str,
+                                  interactionTemplatePath: str, videoSource):
+    outputFile = io.StringIO()
+    content.writeJSON(outputFile, contentTemplatePath,
+                      interactionTemplatePath, videoSource)
+    contentDict = content.toDict(contentTemplatePath,
+                                 interactionTemplatePath, videoSource)
+    assert outputFile.getvalue() == json.dumps(contentDict)
+    return contentDict["interactiveVideo"]["assets"]["interactions"]
+
+
+@pytest.mark.parametrize("videoSource", [
+    "videos/final_h5p_video.mp4",
+    [("videos/final_h5p_video.mp4", "720p"),
+     ("videos/final_h5p_video_360p.mp4", "360p")],
+])
+def test_writeJSONMatchesToDict(questionSets, templatePaths, videoSource):
+    interactions = assertWritesWhatToDictReturns(
+        Content(questionSets), *templatePaths, videoSource)
+    assert [interaction["duration"]["from"]
+            for interaction in interactions] == [10.0, 28.0]
+
+
+def test_writeJSONWithoutQuestionSets(templatePaths):
+    assertWritesWhatToDictReturns(Content([]), *templatePaths,
+                                  "https://example.com/video.mp4")
+
+
+def test_writeJSONKeepsTheTemplatesInteractions(questionSets, templatePaths,
+                                                tmp_path):
+    contentTemplatePath, interactionTemplatePath = templatePaths
+    content = templateRegistry.load(contentTemplatePath)
+    content["interactiveVideo"]["assets"]["interactions"] = [
+        templateRegistry.load(interactionTemplatePath)]
+    contentTemplateFile = tmp_path / "template_content.json"
+    contentTemplateFile.write_text(json.dumps(content))
+    interactions = assertWritesWhatToDictReturns(
+        Content(questionSets), str(contentTemplateFile),
+        interactionTemplatePath, "videos/final_h5p_video.mp4")
+    assert len(interactions) == 3
@@ -0,0 +1,79 @@
+import json
+import os
+import shutil
+import zipfile
+
+import pytest
+
+from conftest import repositoryDirectoryPath
+from h5p_generator import buildCourses, loadManifest
+
+
+def writeManifest(directoryPath, manifest):
+    manifestFilePath = directoryPath / "courses.json"
+    manifestFilePath.write_text(json.dumps(manifest))
+    return str(manifestFilePath)
+
+
+def test_manifestPathsAreRelativeToTheManifest(tmp_path,
+                                               templatesDirectoryPath):
+    manifestFilePath = writeManifest(tmp_path, {
+        "cacheDirectory": "cache",
+        "courses": [{"title": "One", "inputs": "one",
+                     "output": "out/one.h5p", "questions": "one/bank.csv",
+                     "templates": "templates"}]
+    })
+    course, = loadManifest(manifestFilePath, templatesDirectoryPath)
+    assert course.inputsDirectoryPath == os.path.join(str(tmp_path), "one")
+    assert course.outputFilePath \
+        == os.path.join(str(tmp_path), "out", "one.h5p")
+    assert course.questionsFilePath \
+        == os.path.join(str(tmp_path), "one", "bank.csv")
+    assert course.templatesDirectoryPath \
+        == os.path.join(str(tmp_path), "templates")
+    assert course.cacheDirectoryPath == os.path.join(str(tmp_path), "cache")
+
+
+def test_manifestsCanBePlainLists(tmp_path, templatesDirectoryPath):
+    manifestFilePath = writeManifest(tmp_path, [
+        {"title": "One", "inputs": "one", "output": "one.h5p"},
+        {"title": "Two", "inputs": "two", "output": "two.h5p",
+         "concatMode": "reencode", "renditions": [360]}
+    ])
+    courses = loadManifest(manifestFilePath, templatesDirectoryPath)
+    assert [course.title for course in courses] == ["One", "Two"]
+    assert courses[0].templatesDirectoryPath == templatesDirectoryPath
+    assert courses[0].questionsFilePath == os.path.join(
+        str(tmp_path), "one", "questions", "questions.txt")
+    assert courses[1].renditions == [360]
+
+
+@pytest.fixture
+def inputsDirectoryPath(tmp_path):
+    inputsDirectoryPath = tmp_path / "inputs"
+    shutil.copytree(os.path.join(repositoryDirectoryPath, "inputs"),
+                    str(inputsDirectoryPath))
+    return inputsDirectoryPath
+
+
+def test_everyCourseInAManifestIsBuilt(tmp_path, templatesDirectoryPath,
+                                       inputsDirectoryPath):
+    (inputsDirectoryPath / "broken.txt").write_text("video: 9.mov\n")
+    manifestFilePath = writeManifest(tmp_path, {"courses": [
+        {"title": "One", "inputs": "inputs", "output": "out/one.h5p"},
+        {"title": "Broken", "inputs": "inputs", "output": "out/broken.h5p",
+         "questions": "inputs/broken.txt"},
+        {"title": "Two", "inputs": "inputs", "output": "out/two.h5p"},
+    ]})
+    results = buildCourses(loadManifest(manifestFilePath,
+                                        templatesDirectoryPath), workers=2)
+    assert [(result.course.title, result.succeeded)
+            for result in results] \
+        == [("One", True), ("Broken", False), ("Two", True)]
+    assert "9.mov" in results[1].error
+    assert not os.path.exists(str(tmp_path / "out" / "broken.h5p"))
+    for name in ("one", "two"):
+        with zipfile.ZipFile(str(tmp_path / "out" / (name + ".h5p"))) \
+                as package:
+            assert package.testzip() is None
+            assert "content/content.json" in package.namelist()
@@ -0,0 +1,198 @@
+import pytest
+
+from h5p_generator import CSVQuestionImporter, QTIQuestionImporter, \
+    QuestionEventType, QuestionImporter, QuestionsParseError, \
+    TextQuestionImporter, questionImporterFor
+
+qti12 = """<?xml version="1.0" encoding="UTF-8"?>
+<questestinterop xmlns="http://www.imsglobal.org/xsd/ims_qtiasiv1p2">
+  <assessment title="Dinosaurs">
+    <section ident="s1" title="1">
+      <item ident="q1" title="Sum">
+        <presentation>
+          <material><mattext>What is 2+3?</mattext></material>
+          <response_lid ident="response1" rcardinality="Single">
+            <render_choice>
+              <response_label ident="a"><material>
+                <mattext>6</mattext></material></response_label>
+              <response_label ident="b"><material>
+                <mattext>5</mattext></material></response_label>
+            </render_choice>
+          </response_lid>
+        </presentation>
+        <resprocessing>
+          <respcondition>
+            <conditionvar><varequal respident="response1">b</varequal>
+            </conditionvar>
+            <setvar action="Set">100</setvar>
+          </respcondition>
+        </resprocessing>
+      </item>
+    </section>
+    <section ident="s3" title="3.mov">
+      <item ident="q2">
+        <presentation>
+          <material><mattext>Which are dinosaurs?</mattext></material>
+          <response_lid ident="response1" rcardinality="Multiple">
+            <render_choice>
+              <response_label ident="a"><material>
+                <mattext>Triceratops</mattext></material></response_label>
+              <response_label ident="b"><material>
+                <mattext>Mammoth</mattext></material></response_label>
+              <response_label ident="c"><material>
+                <mattext>T. rex</mattext></material></response_label>
+            </render_choice>
+          </response_lid>
+        </presentation>
+        <resprocessing>
+          <respcondition>
+            <conditionvar><and>
+              <varequal respident="response1">a</varequal>
+              <not><varequal respident="response1">b</varequal></not>
+              <varequal respident="response1">c</varequal>
+            </and></conditionvar>
+            <setvar action="Set">1</setvar>
+          </respcondition>
+        </resprocessing>
+      </item>
+    </section>
+  </assessment>
+</questestinterop>
+"""
+
+qti21 = """<?xml version="1.0" encoding="UTF-8"?>
+<assessmentItem xmlns="http://www.imsglobal.org/xsd/imsqti_v2p1"
+                identifier="q1" title="Sum" video="2">
+  <responseDeclaration identifier="RESPONSE" cardinality="single">
+    <correctResponse><value>B</value></correctResponse>
+  </responseDeclaration>
+  <itemBody>
+    <choiceInteraction responseIdentifier="RESPONSE" maxChoices="1">
+      <prompt>What is 2+3?</prompt>
+      <simpleChoice identifier="A">6<feedbackInline identifier="A">
+        No</feedbackInline></simpleChoice>
+      <simpleChoice identifier="B">5</simpleChoice>
+    </choiceInteraction>
+  </itemBody>
+</assessmentItem>
+"""
+
+
+def readEvents(importer, filePath: str, videos: list):
+    with importer.open(filePath) as sourceFile:
+        return [(event.eventType, event.text, event.isCorrect)
+                for event in importer.events(sourceFile, filePath, videos)]
+
+
+def test_importersArePickedByExtension():
+    assert isinstance(questionImporterFor("questions.txt"),
+                      TextQuestionImporter)
+    assert isinstance(questionImporterFor("bank.XML"), QTIQuestionImporter)
+    assert isinstance(questionImporterFor("bank.csv", "clip"),
+                      CSVQuestionImporter)
+    assert questionImporterFor("bank.csv", "clip").sectionKey == "clip"
+    with pytest.raises(QuestionsParseError):
+        questionImporterFor("bank.docx")
+
+
+def test_qtiContentPackagesAreRejected():
+    with pytest.raises(QuestionsParseError,
+                       match="QTI content packages aren't supported"):
+        questionImporterFor("export.zip")
+
+
+def test_qti12SectionsNameTheVideos(tmp_path, videos):
+    bankFilePath = tmp_path / "bank.xml"
+    bankFilePath.write_text(qti12)
+    assert readEvents(QTIQuestionImporter("section.title"),
+                      str(bankFilePath), videos) == [
+        (QuestionEventType.VIDEO, "1.mov", False),
+        (QuestionEventType.QUESTION, "What is 2+3?", False),
+        (QuestionEventType.CHOICE, "6", False),
+        (QuestionEventType.CHOICE, "5", True),
+        (QuestionEventType.VIDEO, "3.mov", False),
+        (QuestionEventType.QUESTION, "Which are dinosaurs?", False),
+        (QuestionEventType.CHOICE, "Triceratops", True),
+        (QuestionEventType.CHOICE, "Mammoth", False),
+        (QuestionEventType.CHOICE, "T. rex", True),
+    ]
+
+
+def test_qti21Items(tmp_path, videos):
+    bankFilePath = tmp_path / "item.xml"
+    bankFilePath.write_text(qti21)
+    assert readEvents(QTIQuestionImporter(), str(bankFilePath), videos) == [
+        (QuestionEventType.VIDEO, "2.mov", False),
+        (QuestionEventType.QUESTION, "What is 2+3?", False),
+        (QuestionEventType.CHOICE, "6", False),
+        (QuestionEventType.CHOICE, "5", True),
+    ]
+
+
+def test_malformedXMLIsReported(tmp_path, videos):
+    bankFilePath = tmp_path / "bank.xml"
+    bankFilePath.write_text("<questestinterop><item>")
+    with pytest.raises(QuestionsParseError):
+        readEvents(QTIQuestionImporter(), str(bankFilePath), videos)
+
+
+def test_csvCorrectColumnAndMarkers(tmp_path, videos):
+    bankFilePath = tmp_path / "bank.csv"
+    bankFilePath.write_text(
+        "\ufeffVideo,Question,Choice 1,Choice 2,Choice 3,Correct\n"
+        "1,What is 2+3?,6,5,,b\n"
+        "1.mov,Which are dinosaurs?,Triceratops,Mammoth,T. rex,\"1, 3\"\n"
+        ",,,,,\n"
+        "3,Which one prints 3?,*print(3),print(6),,\n",
+        encoding="utf-8")
+    assert readEvents(CSVQuestionImporter(), str(bankFilePath), videos) == [
+        (QuestionEventType.VIDEO, "1.mov", False),
+        (QuestionEventType.QUESTION, "What is 2+3?", False),
+        (QuestionEventType.CHOICE, "6", False),
+        (QuestionEventType.CHOICE, "5", True),
+        (QuestionEventType.QUESTION, "Which are dinosaurs?", False),
+        (QuestionEventType.CHOICE, "Triceratops", True),
+        (QuestionEventType.CHOICE, "Mammoth", False),
+        (QuestionEventType.CHOICE, "T. rex", True),
+        (QuestionEventType.VIDEO, "3.mov", False),
+        (QuestionEventType.QUESTION, "Which one prints 3?", False),
+        (QuestionEventType.CHOICE, "print(3)", True),
+        (QuestionEventType.CHOICE, "print(6)", False),
+    ]
+
+
+@pytest.mark.parametrize("rows, lineNumber", [
+    ("Video,Question,Choice 1,Correct\n1,What?,Yes,c\n", 2),
+    ("Video,Question,Choice 1\n4,What?,Yes\n", 2),
+    ("Video,Question,Choice 1\n3,What?,*Yes\n1,Why?,*Yes\n", 3),
+    ("Question,Choice 1\nWhat?,*Yes\n", 1),
+])
+def test_csvProblemsAreReportedWithTheirLine(tmp_path, videos, rows,
+                                             lineNumber):
+    bankFilePath = tmp_path / "bank.csv"
+    bankFilePath.write_text(rows)
+    with pytest.raises(QuestionsParseError) as error:
+        readEvents(CSVQuestionImporter(), str(bankFilePath), videos)
+    assert error.value.lineNumber == lineNumber
+
+
+def test_textQuestionsAsItems(tmp_path):
+    questionsFilePath = tmp_path / "questions.txt"
+    questionsFilePath.write_text("video: 1.mov\n\n1. What is 2+3?\na) 6\n"
+                                 "*b) 5\n\nvideo: 3.mov\n1. Why?\n[*] Yes\n")
+    importer = TextQuestionImporter()
+    with importer.open(str(questionsFilePath)) as questionsFile:
+        items = [(item.section, item.question, item.choices, item.lineNumber)
+                 for item in importer.iterItems(questionsFile,
+                                                str(questionsFilePath))]
+    assert items == [("1.mov", "What is 2+3?", [("6", False), ("5", True)],
+                      3),
+                     ("3.mov", "Why?", [("Yes", True)], 8)]
+
+
+def test_importersHaveToReadItems():
+    class IncompleteImporter(QuestionImporter):
+        pass
+
+    with pytest.raises(TypeError):
+        IncompleteImporter()
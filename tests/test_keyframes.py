@@ -0,0 +1,74 @@
+import pytest
+
+from conftest import FakeVideo
+from h5p_generator import KeyframeIndex, VideoProbe, _keyframeTimes, \
+    _segmentJobs, iterQuestionSets, tokenizeQuestions
+
+
+def test_timesAtTheEndMoveOntoTheLastFrame():
+    assert _keyframeTimes([0.0, 10.0, 20.0, 30.0], 30.0, fps=2.0) \
+        == [10.0, 20.0, 29.25]
+
+
+def test_timesAtTheEndCanBeLeftToWhatFollows():
+    assert _keyframeTimes([5.0, 10.0, 12.0], 10.0, fps=25.0,
+                          atEnd=False) == [5.0]
+
+
+def probe(filename: str, duration: float):
+    videoProbe = VideoProbe(filename)
+    videoProbe.duration = duration
+    videoProbe.width, videoProbe.height, videoProbe.fps = 640, 360, "25"
+    return videoProbe
+
+
+def forcedKeyframes(arguments: list):
+    if "-force_key_frames" not in arguments:
+        return None
+    return arguments[arguments.index("-force_key_frames") + 1]
+
+
+def test_segmentsForceTheInteractionsInsideThem(tmp_path):
+    jobs, _ = _segmentJobs([probe("1.mov", 10.0), probe("2.mov", 25.0)],
+                           chunkSeconds=20.0, workers=1,
+                           workingDirectoryPath=str(tmp_path),
+                           keyframeTimes=[4.0, 10.0, 35.0])
+    # 10s starts the second clip's first segment and 35s is the end of the
+    # last one.
+    assert [forcedKeyframes(arguments) for arguments in jobs] \
+        == ["4.0", None, "4.94"]
+
+
+questions = """video: 1.mov
+1. Why?
+*a) Yes
+video: 3.mov
+1. Why not?
+*a) No
+"""
+
+
+@pytest.mark.parametrize("keyframeTimes", [
+    # Stream copied: only the clips' own keyframes.
+    [0.0, 10.0, 20.0],
+    # Re-encoded with keyframes forced at the interaction times.
+    [0.0, 10.0, 20.0, 28.0],
+    # A keyframe too late for the last question set to be shown in full.
+    [0.0, 10.0, 20.0, 29.5],
+])
+def test_questionSetsEndWithTheVideo(videos, templatesDirectoryPath,
+                                     keyframeTimes):
+    questionSets = list(iterQuestionSets(
+        tokenizeQuestions(questions.splitlines()), videos,
+        templatesDirectoryPath, keyframeIndex=KeyframeIndex(keyframeTimes)))
+    assert [(questionSet.startTime, questionSet.endTime)
+            for questionSet in questionSets] == [(10.0, 12.0), (28.0, 30.0)]
+
+
+def test_questionSetsFitShortVideos(templatesDirectoryPath):
+    questionSets = list(iterQuestionSets(
+        tokenizeQuestions(["video: 1.mov", "1. Why?", "*a) Yes"]),
+        [FakeVideo("1.mov", duration=1.0)], templatesDirectoryPath,
+        keyframeIndex=KeyframeIndex([0.0])))
+    assert (questionSets[0].startTime, questionSets[0].endTime) \
+        == (0.0, 1.0)
@@ -0,0 +1,104 @@
+import json
+import os
+
+import pytest
+
+from h5p_generator import LibraryError, LibraryResolver
+
+
+def writeLibrary(packageTemplatePath, directoryName: str,
+                 dependencies: list = ()):
+    libraryDirectoryPath = packageTemplatePath / directoryName
+    libraryDirectoryPath.mkdir(parents=True, exist_ok=True)
+    (libraryDirectoryPath / "library.json").write_text(json.dumps({
+        "preloadedDependencies": [
+            {"machineName": machineName, "majorVersion": majorVersion,
+             "minorVersion": minorVersion}
+            for machineName, majorVersion, minorVersion in dependencies
+        ]
+    }))
+
+
+@pytest.fixture
+def packageTemplatePath(tmp_path):
+    packageTemplatePath = tmp_path / "package"
+    writeLibrary(packageTemplatePath, "H5P.Video-1.5",
+                 [("H5P.Question", 1, 4)])
+    writeLibrary(packageTemplatePath, "H5P.Question-1.4",
+                 [("H5P.JoubelUI", 1, 3)])
+    writeLibrary(packageTemplatePath, "H5P.JoubelUI-1.3")
+    writeLibrary(packageTemplatePath, "H5P.Unused-1.0")
+    return packageTemplatePath
+
+
+@pytest.fixture
+def parses(monkeypatch):
+    # Library graphs parsed from library.json files.
+    parses = []
+    parseGraph = LibraryResolver._parseGraph
+
+    def countingParseGraph(libraryFilePaths):
+        parses.append(sorted(libraryFilePaths))
+        return parseGraph(libraryFilePaths)
+
+    monkeypatch.setattr(LibraryResolver, "_parseGraph",
+                        staticmethod(countingParseGraph))
+    monkeypatch.setattr(LibraryResolver, "_graphs", {})
+    return parses
+
+
+def test_dependenciesAreResolved(packageTemplatePath, parses):
+    assert LibraryResolver(str(packageTemplatePath)).resolve(
+        ["H5P.Video-1.5"]) \
+        == {"H5P.Video-1.5", "H5P.Question-1.4", "H5P.JoubelUI-1.3"}
+
+
+def test_graphIsReusedWhileNothingChanges(packageTemplatePath, parses,
+                                          tmp_path):
+    cacheFilePath = str(tmp_path / "library_graph.json")
+    LibraryResolver(str(packageTemplatePath), cacheFilePath).resolve(
+        ["H5P.Video-1.5"])
+    LibraryResolver(str(packageTemplatePath), cacheFilePath).resolve(
+        ["H5P.Question-1.4"])
+    assert len(parses) == 1
+    # A new process only has the cache file.
+    LibraryResolver._graphs.clear()
+    assert LibraryResolver(str(packageTemplatePath), cacheFilePath).resolve(
+        ["H5P.Video-1.5"]) \
+        == {"H5P.Video-1.5", "H5P.Question-1.4", "H5P.JoubelUI-1.3"}
+    assert len(parses) == 1
+
+
+def test_graphIsRebuiltAfterALibraryChanges(packageTemplatePath, parses,
+                                            tmp_path):
+    cacheFilePath = str(tmp_path / "library_graph.json")
+    resolver = LibraryResolver(str(packageTemplatePath), cacheFilePath)
+    assert "H5P.Unused-1.0" not in resolver.resolve(["H5P.Video-1.5"])
+    libraryFilePath = str(packageTemplatePath / "H5P.Video-1.5"
+                          / "library.json")
+    modifiedTime = os.stat(libraryFilePath).st_mtime_ns
+    writeLibrary(packageTemplatePath, "H5P.Video-1.5",
+                 [("H5P.Question", 1, 4), ("H5P.Unused", 1, 0)])
+    # Making sure the edit shows even on file systems with coarse times.
+    os.utime(libraryFilePath, ns=(modifiedTime + 10 ** 9,
+                                  modifiedTime + 10 ** 9))
+    assert "H5P.Unused-1.0" in resolver.resolve(["H5P.Video-1.5"])
+    assert len(parses) == 2
+    # The cache file was replaced too.
+    LibraryResolver._graphs.clear()
+    assert "H5P.Unused-1.0" in LibraryResolver(
+        str(packageTemplatePath), cacheFilePath).resolve(["H5P.Video-1.5"])
+    assert len(parses) == 2
+
+
+def test_missingDependenciesAreReported(packageTemplatePath, parses):
+    writeLibrary(packageTemplatePath, "H5P.Broken-1.0",
+                 [("H5P.Missing", 2, 0)])
+    with pytest.raises(LibraryError, match="H5P.Missing-2.0"):
+        LibraryResolver(str(packageTemplatePath)).resolve(["H5P.Broken-1.0"])
+
+
+def test_unreadableLibrariesAreReported(packageTemplatePath, parses):
+    (packageTemplatePath / "H5P.Video-1.5" / "library.json").write_text("{")
+    with pytest.raises(LibraryError, match="Couldn't read"):
+        LibraryResolver(str(packageTemplatePath)).resolve(["H5P.Video-1.5"])
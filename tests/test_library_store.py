@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+from h5p_generator import LibraryStore, StagingError
+
+
+@pytest.fixture
+def libraryStore(tmp_path):
+    return LibraryStore(str(tmp_path / "store"))
+
+
+@pytest.fixture
+def sourceFilePaths(tmp_path):
+    sourceDirectoryPath = tmp_path / "source"
+    (sourceDirectoryPath / "H5P.Library-1.0").mkdir(parents=True)
+    sourceFilePaths = {}
+    for relativePath in ("H5P.Library-1.0/library.json",
+                         "H5P.Library-1.0/library.js"):
+        filePath = sourceDirectoryPath.joinpath(*relativePath.split("/"))
+        filePath.write_text(relativePath)
+        sourceFilePaths[relativePath] = str(filePath)
+    return sourceFilePaths
+
+
+def test_stageLinksTheFiles(libraryStore, sourceFilePaths, tmp_path):
+    stageDirectoryPath = tmp_path / "stage"
+    assert libraryStore.stage(str(stageDirectoryPath), sourceFilePaths) == 2
+    assert (stageDirectoryPath / "H5P.Library-1.0" / "library.js") \
+        .read_text() == "H5P.Library-1.0/library.js"
+    assert libraryStore.stagedFilePaths(str(stageDirectoryPath)) \
+        == set(sourceFilePaths)
+    assert libraryStore.stage(str(stageDirectoryPath), sourceFilePaths) == 0
+
+
+def test_restagingOnlyRemovesStagedFiles(libraryStore, sourceFilePaths,
+                                         tmp_path):
+    stageDirectoryPath = tmp_path / "stage"
+    libraryStore.stage(str(stageDirectoryPath), sourceFilePaths)
+    (stageDirectoryPath / "notes.txt").write_text("keep me")
+    libraryStore.stage(str(stageDirectoryPath), {})
+    assert (stageDirectoryPath / "notes.txt").exists()
+    assert not (stageDirectoryPath / "H5P.Library-1.0").exists()
+
+
+def test_unstagedDirectoriesAreNotTouched(libraryStore, sourceFilePaths,
+                                          tmp_path):
+    stageDirectoryPath = tmp_path / "stage"
+    stageDirectoryPath.mkdir()
+    (stageDirectoryPath / "H5P.Editor-1.0.js").write_text("tracked")
+    with pytest.raises(StagingError):
+        libraryStore.stage(str(stageDirectoryPath), sourceFilePaths)
+    assert os.listdir(str(stageDirectoryPath)) == ["H5P.Editor-1.0.js"]
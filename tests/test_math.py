@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+from h5p_generator import Choice, Content, MathRenderer, SemanticsValidator, \
+    MultipleChoicesQuestion, QuestionSet, SingleChoiceQuestion
+
+pytest.importorskip("latex2mathml")
+
+
+@pytest.fixture
+def renderer():
+    return MathRenderer(workers=1)
+
+
+def test_inlineMathUsesMathDisplayDelimiters(renderer):
+    assert renderer.renderText("Is $x^2$ or \\alpha bigger?") \
+        == "Is \\(x^2\\) or \\(\\alpha\\) bigger?"
+
+
+def test_displayMathUsesMathDisplayDelimiters(renderer):
+    assert renderer.renderText("$$a < b$$") == "\\[a &lt; b\\]"
+
+
+def test_textWithoutMathIsUnchanged(renderer):
+    assert renderer.renderText("It costs $5 and $6.") \
+        == "It costs $5 and $6."
+
+
+def test_unrenderableMathIsLeftWithAWarning(renderer):
+    warnings = renderer.prerender([("\\notacommand", False)])
+    assert warnings == ["Leaving \\notacommand as it is, it couldn't be "
+                        "rendered: unknown command"]
+    assert renderer.warnings == warnings
+    assert renderer.renderText("\\notacommand") == "\\notacommand"
+    # Already rendered expressions don't warn again.
+    assert renderer.prerender([("\\notacommand", False)]) == []
+
+
+def test_renderedQuestionsValidate(renderer, templatesDirectoryPath):
+    questionSet = QuestionSet([
+        SingleChoiceQuestion(
+            "What is $\\sqrt{4}$?",
+            [Choice("$2$", True), Choice("\\pi", False)],
+            os.path.join(templatesDirectoryPath,
+                         "template_question_single_choice.json")),
+        MultipleChoicesQuestion(
+            "Which are $< 1$?",
+            [Choice("$\\frac{1}{2}$", True), Choice("$2$", False)],
+            os.path.join(templatesDirectoryPath,
+                         "template_question_multiple_choices.json")),
+    ])
+    validator = SemanticsValidator(
+        os.path.join(templatesDirectoryPath,
+                     "template_h5p_package_multiple_choice"),
+        "H5P.InteractiveVideo 1.21")
+    checkInteraction = validator.checker(
+        "interactiveVideo.assets.interactions.interaction")
+    for interaction in Content.convertQuestionSetToInteractions(
+            questionSet,
+            os.path.join(templatesDirectoryPath, "template_interaction.json"),
+            renderer.renderText):
+        assert checkInteraction(interaction) is None
+        assert "<math" not in str(interaction)
@@ -0,0 +1,44 @@
+import io
+import zipfile
+
+import pytest
+
+import h5p_generator
+from h5p_generator import _compressEntries, _iterCompressedEntries, \
+    _writeCompressedEntry
+
+
+@pytest.fixture
+def libraryFiles(tmp_path):
+    files = []
+    for name, data in (("library.json", b'{"machineName": "H5P.Test"}'),
+                       ("empty.css", b""),
+                       ("test.js", b"var test = 1;\n" * 1000)):
+        filePath = tmp_path / name
+        filePath.write_bytes(data)
+        files.append((str(filePath), "H5P.Test-1.0/" + name))
+    return files
+
+
+@pytest.mark.parametrize("splice", [True, False])
+def test_compressedEntriesRoundTrip(libraryFiles, monkeypatch, splice):
+    if not splice:
+        monkeypatch.setattr(h5p_generator, "_canSpliceEntries",
+                            lambda package, zipInfo: False)
+    packageFile = io.BytesIO()
+    with zipfile.ZipFile(packageFile, "w",
+                         compression=zipfile.ZIP_DEFLATED) as package:
+        package.writestr("h5p.json", "{}")
+        for zipInfo, compressedData in _iterCompressedEntries(
+                _compressEntries(libraryFiles)):
+            _writeCompressedEntry(package, zipInfo, compressedData)
+        package.writestr("content/content.json", "{}")
+
+    with zipfile.ZipFile(packageFile) as package:
+        assert package.testzip() is None
+        assert package.namelist() == ["h5p.json"] + [
+            archiveName for _, archiveName in libraryFiles] + [
+            "content/content.json"]
+        for filePath, archiveName in libraryFiles:
+            with open(filePath, "rb") as libraryFile:
+                assert package.read(archiveName) == libraryFile.read()
@@ -0,0 +1,137 @@
+import pytest
+
+from h5p_generator import Choice, QuestionEventType, QuestionsParseError, \
+    iterQuestionSets, tokenizeQuestions
+
+
+def tokenize(text: str):
+    return [(event.eventType, event.text, event.isCorrect)
+            for event in tokenizeQuestions(text.splitlines(True))]
+
+
+@pytest.mark.parametrize("line, text, isCorrect", [
+    ("[*] Triceratops", "Triceratops", True),
+    ("[ ] Smilodon fatalis", "Smilodon fatalis", False),
+    ("[] Mammoth", "Mammoth", False),
+    ("[x] Mammoth", "Mammoth", False),
+    ("a)  6", "6", False),
+    ("*c) 5", "5", True),
+    ("(a) foo", "foo", False),
+    ("*(b) bar", "bar", True),
+    ("(*b) bar", "bar", True),
+    ("  b) indented (with brackets)", "indented (with brackets)", False),
+])
+def test_choiceMarkers(line, text, isCorrect):
+    assert tokenize(line) == [(QuestionEventType.CHOICE, text, isCorrect)]
+
+
+@pytest.mark.parametrize("line", ["video: 1.mov", "Video: 1.mov",
+                                  "  VIDEO:1.mov  "])
+def test_videoLinesIgnoreCase(line):
+    assert tokenize(line) == [(QuestionEventType.VIDEO, "1.mov", False)]
+
+
+def test_questionsFileIsTokenizedInOrder():
+    assert tokenize("video: 1.mov\n"
+                    "\n"
+                    "1. What is 2+3?\n"
+                    "a) 4\n"
+                    "*b) 5\n") == [
+        (QuestionEventType.VIDEO, "1.mov", False),
+        (QuestionEventType.QUESTION, "What is 2+3?", False),
+        (QuestionEventType.CHOICE, "4", False),
+        (QuestionEventType.CHOICE, "5", True),
+    ]
+
+
+def test_unknownLinesReportTheirLineNumber():
+    with pytest.raises(QuestionsParseError) as error:
+        list(tokenizeQuestions(["video: 1.mov\n", "What is 2+3?\n"],
+                               "questions.txt"))
+    assert error.value.lineNumber == 2
+
+
+@pytest.mark.parametrize("text, lineNumber", [
+    ("video: 4.mov\n1. Why?\n*a) Yes\n", 1),
+    ("video: 2.mov\n1. Why?\n*a) Yes\nvideo: 1.mov\n", 4),
+    ("video: 1.mov\n1. Why?\n*a) Yes\nvideo: 1.mov\n", 4),
+])
+def test_unknownVideosReportTheirLineNumber(videos, templatesDirectoryPath,
+                                            text, lineNumber):
+    with pytest.raises(QuestionsParseError) as error:
+        list(iterQuestionSets(tokenizeQuestions(text.splitlines()), videos,
+                              templatesDirectoryPath))
+    assert error.value.lineNumber == lineNumber
+
+
+def test_videosWithoutQuestionsAreSkipped(videos, templatesDirectoryPath):
+    questionSets = list(iterQuestionSets(tokenizeQuestions(
+        ["video: 1.mov", "1. Why?", "*a) Yes",
+         "video: 3.mov", "1. Why not?", "*a) No"]),
+        videos, templatesDirectoryPath))
+    assert [questionSet.startTime for questionSet in questionSets] \
+        == [10.0, 28.0]
+
+
+def parseQuestionSets(text: str, videos, templatesDirectoryPath):
+    return list(iterQuestionSets(tokenizeQuestions(text.splitlines()),
+                                 videos, templatesDirectoryPath))
+
+
+reorderedQuestions = """video: 1.mov
+1. What is 2+3?
+a)  6
+b)  1
+*c) 5
+"""
+
+
+def test_reorderingChoicesLeavesTheQuestionAlone(videos,
+                                                 templatesDirectoryPath):
+    question, = parseQuestionSets(reorderedQuestions, videos,
+                                  templatesDirectoryPath)[0].questions
+    choices = question.choices
+    action = question.convertToDict()
+    # The correct choice comes first in the package, but the question keeps
+    # its own order.
+    assert action["params"]["choices"][0]["answers"] \
+        == ["<p>5</p>\n", "<p>6</p>\n", "<p>1</p>\n"]
+    assert question.choices is choices
+    assert [choice.text for choice in question.choices] == ["6", "1", "5"]
+    assert question.convertToDict() == action
+
+
+def test_choicesAreCompact():
+    choice = Choice("True", True)
+    assert not hasattr(choice, "__dict__")
+    assert choice.text is Choice("True", False).text
+
+
+def test_fingerprintsOfEqualQuestionSetsMatch(videos,
+                                              templatesDirectoryPath):
+    first, = parseQuestionSets(reorderedQuestions, videos,
+                               templatesDirectoryPath)
+    second, = parseQuestionSets(reorderedQuestions, videos,
+                                templatesDirectoryPath)
+    assert first is not second
+    assert first.fingerprint() == second.fingerprint()
+    assert first.fingerprint("template") == second.fingerprint("template")
+    assert first.fingerprint("template") != first.fingerprint("other")
+    # Converting doesn't change what went into the fingerprint.
+    fingerprint = first.fingerprint()
+    first.convertToActions()
+    assert first.fingerprint() == fingerprint
+
+
+@pytest.mark.parametrize("changedQuestions", [
+    reorderedQuestions.replace("*c) 5", "*c) 7"),
+    reorderedQuestions.replace("*c) 5", "c) 5").replace("a)  6", "*a)  6"),
+    reorderedQuestions.replace("What is", "What's"),
+])
+def test_fingerprintsChangeWithTheQuestions(videos, templatesDirectoryPath,
+                                            changedQuestions):
+    original, = parseQuestionSets(reorderedQuestions, videos,
+                                  templatesDirectoryPath)
+    changed, = parseQuestionSets(changedQuestions, videos,
+                                 templatesDirectoryPath)
+    assert original.fingerprint() != changed.fingerprint()
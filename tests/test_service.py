@@ -0,0 +1,108 @@
+import asyncio
+import os
+
+import pytest
+
+from h5p_service import BuildService, HTTPError
+
+
+@pytest.fixture
+def service(tmp_path, templatesDirectoryPath):
+    (tmp_path / "videos").mkdir()
+    service = BuildService(templatesDirectoryPath, str(tmp_path / "server"),
+                           baseDirectoryPath=str(tmp_path))
+    service._queue = asyncio.Queue()
+    return service
+
+
+def test_coursesInsideTheBaseDirectoryAreQueued(service):
+    job = service.submit({"title": "Course", "inputs": "videos",
+                          "output": "out/course.h5p"})
+    assert service._queue.get_nowait() is job
+
+
+@pytest.mark.parametrize("definition", [
+    {"inputs": "/", "output": "course.h5p"},
+    {"inputs": "videos", "output": "../course.h5p"},
+    {"inputs": "videos", "output": "~/course.h5p"},
+    {"inputs": "videos", "output": "course.h5p", "questions": "/etc/passwd"},
+    {"inputs": "videos", "output": "course.h5p", "templates": "/tmp"},
+])
+def test_pathsOutsideTheBaseDirectoryAreRejected(service, definition):
+    with pytest.raises(HTTPError) as error:
+        service.submit(dict(definition, title="Course"))
+    assert error.value.status == 400
+    assert "has to be inside" in str(error.value)
+    assert service._queue.empty()
+
+
+def test_symlinksOutOfTheBaseDirectoryAreRejected(service, tmp_path):
+    os.symlink("/", str(tmp_path / "root"))
+    with pytest.raises(HTTPError, match="has to be inside"):
+        service.submit({"title": "Course", "inputs": "videos",
+                        "output": "root/tmp/course.h5p"})
+
+
+def test_stagingIsRefused(service):
+    with pytest.raises(HTTPError) as error:
+        service.submit({"title": "Course", "inputs": "videos",
+                        "output": "course.h5p", "stage": "stage"})
+    assert error.value.status == 400
+
+
+@pytest.fixture
+def boundService(service):
+    service.allowedHosts = BuildService._hostNames("127.0.0.1", 8765)
+    return service
+
+
+def test_sameOriginJSONIsAccepted(boundService):
+    boundService._checkRequest("POST", "/jobs", {
+        "host": "localhost:8765", "origin": "http://127.0.0.1:8765",
+        "content-type": "application/json; charset=utf-8"})
+
+
+@pytest.mark.parametrize("headers, status", [
+    ({"host": "127.0.0.1:8765", "content-type": "text/plain"}, 415),
+    ({"host": "127.0.0.1:8765"}, 415),
+    ({"host": "attacker.example:8765", "content-type": "application/json"},
+     403),
+    ({"host": "127.0.0.1:8765", "origin": "http://attacker.example",
+      "content-type": "application/json"}, 403),
+])
+def test_crossSiteRequestsAreRejected(boundService, headers, status):
+    with pytest.raises(HTTPError) as error:
+        boundService._checkRequest("POST", "/jobs", headers)
+    assert error.value.status == status
+
+
+def test_unixSocketsSkipTheHostCheck(service):
+    service._checkRequest("GET", "/jobs", {})
+
+
+def readRequest(data: bytes):
+    async def read():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return await BuildService._readRequest(reader)
+    return asyncio.run(read())
+
+
+def test_requestBodyIsRead():
+    method, path, headers, body = readRequest(
+        b"POST /jobs HTTP/1.1\r\nContent-Length: 2\r\n\r\n{}")
+    assert (method, path, body) == ("POST", "/jobs", b"{}")
+
+
+@pytest.mark.parametrize("contentLength, status", [
+    (b"1073741824", 413),
+    (b"-1", 400),
+    (b"lots", 400),
+])
+def test_oversizedOrMalformedBodiesAreRejected(contentLength, status):
+    # The body isn't there, so reading it would fail if it were attempted.
+    with pytest.raises(HTTPError) as error:
+        readRequest(b"POST /jobs HTTP/1.1\r\nContent-Length: "
+                    + contentLength + b"\r\n\r\n")
+    assert error.value.status == status
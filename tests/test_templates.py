@@ -0,0 +1,84 @@
+import json
+import threading
+
+import pytest
+
+from h5p_generator import TemplateError, TemplateRegistry
+
+
+def writeTemplate(tmp_path, template, fileName="template.json"):
+    templatePath = tmp_path / fileName
+    templatePath.write_text(json.dumps(template))
+    return str(templatePath)
+
+
+def test_loadReturnsIndependentCopies(tmp_path):
+    templatePath = writeTemplate(tmp_path, {"params": {"questions": []}})
+    registry = TemplateRegistry()
+    first = registry.load(templatePath)
+    first["params"]["questions"].append("changed")
+    assert registry.load(templatePath) == {"params": {"questions": []}}
+
+
+def test_loadOnlyReadsTheFileOnce(tmp_path):
+    templatePath = writeTemplate(tmp_path, {"a": 1})
+    registry = TemplateRegistry()
+    registry.load(templatePath)
+    writeTemplate(tmp_path, {"a": 2})
+    assert registry.load(templatePath) == {"a": 1}
+    registry.invalidate(templatePath)
+    assert registry.load(templatePath) == {"a": 2}
+
+
+def test_digestChangesWithTheContents(tmp_path):
+    templatePath = writeTemplate(tmp_path, {"a": 1})
+    registry = TemplateRegistry()
+    digest = registry.digest(templatePath)
+    writeTemplate(tmp_path, {"a": 2})
+    registry.invalidate()
+    assert registry.digest(templatePath) != digest
+
+
+def test_missingRequiredKeyIsReported(tmp_path):
+    templatePath = writeTemplate(tmp_path, {"params": {}})
+    with pytest.raises(TemplateError, match="params.questions"):
+        TemplateRegistry().load(templatePath, ("params.questions",))
+
+
+@pytest.mark.parametrize("text", ["[1, 2]", "{\"a\": NaN}", "{"])
+def test_unusableTemplatesAreRejected(tmp_path, text):
+    templatePath = tmp_path / "template.json"
+    templatePath.write_text(text)
+    with pytest.raises(TemplateError):
+        TemplateRegistry().load(str(templatePath))
+
+
+def test_bundledTemplatesLoad(templatesDirectoryPath):
+    registry = TemplateRegistry()
+    for fileName in ("template_content.json", "template_interaction.json",
+                     "template_question_single_choice.json",
+                     "template_question_multiple_choices.json"):
+        assert isinstance(registry.load(
+            templatesDirectoryPath + "/" + fileName), dict)
+
+
+def test_invalidateWaitsForLoadsInProgress(tmp_path):
+    templatePath = writeTemplate(tmp_path, {"params": {"questions": []}})
+    invalidators = []
+
+    class InterruptedRegistry(TemplateRegistry):
+        def _compile(self, templatePath: str):
+            # Another thread invalidates the template between compiling and
+            # validating it.
+            builder = TemplateRegistry._compile(self, templatePath)
+            invalidator = threading.Thread(target=self.invalidate,
+                                           args=(templatePath,))
+            invalidator.start()
+            invalidator.join(0.1)
+            invalidators.append(invalidator)
+            return builder
+
+    registry = InterruptedRegistry()
+    assert registry.load(templatePath, ("params.questions",)) \
+        == {"params": {"questions": []}}
+    invalidators[0].join()
@@ -0,0 +1,93 @@
+import builtins
+import json
+
+import pytest
+
+import h5p_generator
+from h5p_generator import Tracer, _NoSpan, _readIOCounters
+
+
+def test_spansAreFreeWhileTracingIsOff():
+    tracer = Tracer()
+    span = tracer.span("build", course="One")
+    assert isinstance(span, _NoSpan)
+    with span as enteredSpan:
+        enteredSpan.set(cached=True)
+    assert tracer.events == []
+
+
+def test_spansNestAndRecordErrors():
+    tracer = Tracer()
+    tracer.enable()
+    with tracer.span("build", course="One"):
+        with tracer.span("video") as span:
+            span.set(cached=False)
+        with pytest.raises(ValueError):
+            with tracer.span("questions"):
+                raise ValueError("broken")
+    assert [event["path"] for event in tracer.events] \
+        == ["build/video", "build/questions", "build"]
+    assert tracer.events[0]["arguments"] == {"cached": False}
+    assert tracer.events[1]["arguments"] == {"error": "ValueError"}
+    tracer.disable()
+    assert isinstance(tracer.span("build"), _NoSpan)
+
+
+def test_chromeTraceEventsNestInTime():
+    tracer = Tracer()
+    tracer.enable()
+    with tracer.span("build", course="One"):
+        with tracer.span("video"):
+            pass
+    trace = json.loads(json.dumps(tracer.chromeTrace()))
+    assert trace["displayTimeUnit"] == "ms"
+    child, parent = trace["traceEvents"]
+    for event in (child, parent):
+        assert event["ph"] == "X"
+        assert event["cat"] == "build"
+        assert event["dur"] >= 0
+        assert isinstance(event["pid"], int)
+        assert isinstance(event["tid"], int)
+        assert "cpuSeconds" in event["args"]
+    assert (child["name"], parent["name"]) == ("video", "build")
+    assert parent["args"]["course"] == "One"
+    assert child["tid"] == parent["tid"]
+    assert parent["ts"] <= child["ts"]
+    assert child["ts"] + child["dur"] <= parent["ts"] + parent["dur"]
+
+
+def test_summaryListsChildrenUnderTheirParents():
+    tracer = Tracer()
+    tracer.enable()
+    for _ in range(2):
+        with tracer.span("build"):
+            with tracer.span("video"):
+                pass
+    lines = tracer.summary().splitlines()
+    assert [line.split()[0] for line in lines[1:]] == ["build", "video"]
+    assert lines[2].startswith("  video")
+    assert lines[2].split()[1] == "2"
+
+
+@pytest.fixture
+def withoutProcIO(monkeypatch):
+    # Like on macOS and Windows, which have no /proc/self/io.
+    def open(filePath, *arguments, **keywordArguments):
+        if filePath == "/proc/self/io":
+            raise FileNotFoundError(filePath)
+        return builtins.open(filePath, *arguments, **keywordArguments)
+
+    monkeypatch.setattr(h5p_generator, "open", open, raising=False)
+    monkeypatch.setattr(h5p_generator, "resource", None)
+
+
+def test_spansWorkWithoutIOCounters(withoutProcIO):
+    assert _readIOCounters() == (0, 0)
+    tracer = Tracer()
+    tracer.enable()
+    with tracer.span("build"):
+        pass
+    event, = tracer.events
+    assert (event["readBytes"], event["writtenBytes"]) == (0, 0)
+    assert event["peakResidentBytes"] == 0
+    assert "build" in tracer.summary()
@@ -0,0 +1,143 @@
+import io
+import os
+
+import pytest
+
+from h5p_generator import Choice, Content, ContentValidationError, \
+    SemanticsValidator, iterQuestionSets, tokenizeQuestions
+
+questions = """video: 1.mov
+
+1. What is 2+3?
+a)  6
+*c) 5
+
+2. What is 2+2?
+*a) 4
+b)  5
+
+video: 3.mov
+
+1. Which of the following are dinosaurs?
+[ ] Woolly mammoth
+[*] Tyrannosaurus rex
+[*] Triceratops
+
+2. Which of these are even?
+[*] 2
+[ ] 3
+[*] 4
+"""
+
+
+@pytest.fixture
+def validator(templatesDirectoryPath):
+    return SemanticsValidator(
+        os.path.join(templatesDirectoryPath,
+                     "template_h5p_package_multiple_choice"),
+        "H5P.InteractiveVideo 1.21")
+
+
+@pytest.fixture
+def templatePaths(templatesDirectoryPath):
+    return (os.path.join(templatesDirectoryPath, "template_content.json"),
+            os.path.join(templatesDirectoryPath, "template_interaction.json"))
+
+
+@pytest.fixture
+def questionSets(videos, templatesDirectoryPath):
+    return list(iterQuestionSets(tokenizeQuestions(questions.splitlines()),
+                                 videos, templatesDirectoryPath))
+
+
+@pytest.fixture
+def interaction(questionSets, templatePaths):
+    return Content.convertQuestionSetToInteractions(
+        questionSets[1], templatePaths[1])[0]
+
+
+def interactionProblems(validator: SemanticsValidator, interaction: dict):
+    return SemanticsValidator.describe(validator.checker(
+        "interactiveVideo.assets.interactions.interaction")(interaction)
+        or [])
+
+
+def test_defaultBuildValidates(validator, questionSets, templatePaths):
+    content = Content(questionSets).toDict(*templatePaths,
+                                           "videos/final_h5p_video.mp4")
+    assert validator.checker()(content) is None
+    # Writing with the validator doesn't raise either.
+    Content(questionSets).writeJSON(io.StringIO(), *templatePaths,
+                                    "videos/final_h5p_video.mp4", validator)
+
+
+def test_questionSetsBecomeAllowedActions(questionSets, templatePaths):
+    singleChoice, multipleChoices = [
+        Content.convertQuestionSetToInteractions(questionSet,
+                                                 templatePaths[1])
+        for questionSet in questionSets
+    ]
+    # Single choice questions share one set, multiple choices questions
+    # each get their own interaction.
+    assert [interaction["action"]["library"]
+            for interaction in singleChoice] == ["H5P.SingleChoiceSet 1.11"]
+    assert len(singleChoice[0]["action"]["params"]["choices"]) == 2
+    assert [interaction["action"]["library"]
+            for interaction in multipleChoices] == ["H5P.MultiChoice 1.14"] * 2
+    assert multipleChoices[0]["x"] != multipleChoices[1]["x"]
+
+
+def test_wrongTypeIsRejected(validator, interaction):
+    interaction["duration"]["from"] = "10"
+    assert interactionProblems(validator, interaction) \
+        == "duration.from: should be a number, not text"
+
+
+def test_numberOutOfRangeIsRejected(validator, interaction):
+    interaction["action"]["params"]["behaviour"]["passPercentage"] = 101
+    assert "is above the maximum of 100" \
+        in interactionProblems(validator, interaction)
+
+
+def test_unknownSelectOptionIsRejected(validator, interaction):
+    interaction["action"]["params"]["behaviour"]["type"] = "several"
+    assert "action.params.behaviour.type: \"several\" isn't one of" \
+        in interactionProblems(validator, interaction)
+
+
+def test_disallowedLibraryIsRejected(validator, interaction):
+    interaction["action"]["library"] = "H5P.QuestionSet 1.17"
+    assert "H5P.QuestionSet 1.17" \
+        in interactionProblems(validator, interaction)
+
+
+def test_strippedTagIsRejected(validator, interaction):
+    interaction["action"]["params"]["question"] = "<p><question-title></p>"
+    assert interactionProblems(validator, interaction) \
+        == "action.params.question: has tags H5P would strip: " \
+           "<question-title>"
+
+
+def test_unknownKeyIsRejected(validator, interaction):
+    interaction["action"]["params"]["hint"] = "Dinosaurs are reptiles."
+    assert interactionProblems(validator, interaction) \
+        == "action.params.hint: isn't in the semantics, so H5P would drop it"
+
+
+def test_listTooShortIsRejected(validator, interaction):
+    interaction["action"]["params"]["answers"] = []
+    assert "action.params.answers: has fewer than" \
+        in interactionProblems(validator, interaction)
+
+
+def test_invalidQuestionFailsTheWrite(validator, questionSets,
+                                      templatePaths):
+    questionSets[1].questions[1].choices += (Choice("<blink>6</blink>",
+                                                    True),)
+    with pytest.raises(ContentValidationError) as error:
+        Content(questionSets).writeJSON(io.StringIO(), *templatePaths,
+                                        "videos/final_h5p_video.mp4",
+                                        validator)
+    assert str(error.value).startswith(
+        "Question set 2 at 28.0s, question 2 \"Which of these are even?\": "
+        "action.params.answers[3].text: has tags H5P would strip: <blink>")